@@ -0,0 +1,193 @@
+
+"""
+Non-interactive execution of a script of prompt commands (telnet.py HOST -f SCRIPT).
+
+Script lines are the same commands typed at the prompt, plus
+  # comment
+  sleep SECONDS
+  expect LINE          e.g. "expect PWR0", "expect VOL121", "expect FN19"
+Commands are sent in pipelined batches: a batch grows until a code would wait
+for the same kind of answer (VOL, FN, ...) as one already in it, then it is
+written at once and its answers are awaited. Each step's latency is reported,
+and at the end the expected lines are checked against fresh status queries.
+"""
+
+from typing import Callable, Optional
+import threading
+import time
+
+import config
+import events
+import state
+
+report = config.report
+
+# how long to wait for the answers to a batch, in seconds:
+BATCH_TIMEOUT = 3.0
+
+
+class ResponseWaiter:
+    """Waits for the answers to a batch of codes (usable as an events listener).
+    The AVR answers in order, so an answer also settles the codes sent before it
+    that have no answer of their own, and an error line (E04, ...) belongs to
+    the oldest code not yet settled."""
+
+    def __init__(self, error_lines: set[str]):
+        self.error_lines = error_lines
+        self.cond = threading.Condition()
+        self.waiting: list[tuple[int, Optional[str]]] = []
+        self.arrived: dict[int, float] = {}
+        self.errors: dict[int, str] = {}
+
+    def start(self, keys: list[Optional[str]]) -> None:
+        "Begins waiting for the answer prefixes of a batch; call before sending it"
+        with self.cond:
+            self.waiting = list(enumerate(keys))
+            self.arrived = {}
+            self.errors = {}
+
+    def on_line(self, line: str, _message: Optional[str]) -> None:
+        key = state.response_prefix(line)
+        now = time.monotonic()
+        with self.cond:
+            if line in self.error_lines and self.waiting:
+                (i, _) = self.waiting.pop(0)
+                self.errors[i] = line
+                self.arrived[i] = now
+            elif key is not None and (i := next((j for (j, k) in self.waiting if k == key), None)) is not None:
+                for (j, k) in self.waiting:
+                    if j == i or k is None:
+                        self.arrived[j] = now
+                    if j == i:
+                        break
+                self.waiting = [(j, k) for (j, k) in self.waiting if j not in self.arrived]
+            else:
+                return
+            self.cond.notify_all()
+
+    def wait(self, timeout: float) -> dict[int, float]:
+        "Arrival times by batch position, for the codes settled before timeout"
+        with self.cond:
+            self.cond.wait_for(lambda: all(k is None for (_, k) in self.waiting), timeout)
+            self.waiting = []
+            return dict(self.arrived)
+
+
+class Step:
+    """One script command, and when it was sent and answered"""
+
+    def __init__(self, command: str, codes: list[str]):
+        self.command = command
+        self.codes = codes
+        self.sent: Optional[float] = None
+        self.done: Optional[float] = None
+        self.error: Optional[str] = None
+        self.answered = True
+
+    def describe(self) -> str:
+        if self.error:
+            return f"{'error':>10}  {self.command} ({self.error})"
+        if not self.answered:
+            return f"{'no answer':>10}  {self.command}"
+        if self.sent is None or self.done is None:
+            return f"{'-':>10}  {self.command}"
+        return f"{(self.done - self.sent) * 1000:7.1f} ms  {self.command}"
+
+
+class ScriptRunner:
+    """Runs script lines; resolve turns a command into codes, send_batch writes codes at once"""
+
+    def __init__(self, resolve: Callable[[str], list[str]], send_batch: Callable[[list[str]], None],
+                 status: state.StatusCache, error_lines: set[str], timeout: float = BATCH_TIMEOUT):
+        self.resolve = resolve
+        self.send_batch = send_batch
+        self.status = status
+        self.waiter = ResponseWaiter(error_lines)
+        self.timeout = timeout
+        self.steps: list[Step] = []
+        self.batch: list[tuple[Step, str, Optional[str]]] = []
+
+    def flush(self) -> None:
+        "Sends the current batch and waits for its answers"
+        if not self.batch:
+            return
+        keys = [k for (_, _, k) in self.batch]
+        self.waiter.start(keys)
+        sent = time.monotonic()
+        self.send_batch([c for (_, c, _) in self.batch])
+        arrived = self.waiter.wait(self.timeout)
+        for (i, (step, _, key)) in enumerate(self.batch):
+            if step.sent is None:
+                step.sent = sent
+            if i in self.waiter.errors:
+                step.error = self.waiter.errors[i]
+            done = arrived.get(i, sent if key is None else None)
+            if done is None:
+                step.answered = False
+                continue
+            step.done = done if step.done is None else max(step.done, done)
+        self.batch = []
+
+    def add(self, step: Step) -> None:
+        "Adds a step's codes to the batch, sending the batch first if they depend on it"
+        self.steps.append(step)
+        for code in step.codes:
+            key = state.expected_response(code)
+            if key is not None and any(k == key for (_, _, k) in self.batch):
+                self.flush()
+            self.batch.append((step, code, key))
+
+    def check(self, expected: list[str]) -> list[str]:
+        "Queries the status for the expected lines; returns the mismatches"
+        keys = [k for k in dict.fromkeys(state.response_prefix(e) for e in expected) if k is not None]
+        queries = [state.RESPONSE_QUERIES[k] for k in keys if k in state.RESPONSE_QUERIES]
+        if queries:
+            self.waiter.start([state.QUERY_RESPONSES[q] for q in queries])
+            self.send_batch(queries)
+            self.waiter.wait(self.timeout)
+        mismatches = []
+        for e in expected:
+            key = state.response_prefix(e)
+            actual = self.status.get(key) if key is not None else None
+            if actual != e:
+                mismatches.append(f"expected {e}, got {actual}")
+        return mismatches
+
+    def run(self, lines: list[str]) -> bool:
+        "Runs the script; True if every step was answered and every expectation met"
+        expected = []
+        bad_lines = 0
+        events.subscribe(self.waiter.on_line)
+        try:
+            for (number, line) in enumerate(lines, 1):
+                command = line.strip()
+                if command == "" or command.startswith("#"):
+                    continue
+                words = command.split()
+                if words[0] == "expect" and len(words) == 2:
+                    expected.append(words[1])
+                    continue
+                if words[0] == "sleep" and len(words) == 2:
+                    try:
+                        seconds = float(words[1])
+                    except ValueError:
+                        seconds = -1.0
+                    if not seconds >= 0: # nan too
+                        report(f"Line {number}: Could not understand sleep {words[1]}")
+                        bad_lines += 1
+                        continue
+                    self.flush()
+                    time.sleep(seconds)
+                    continue
+                self.add(Step(command, self.resolve(command)))
+            self.flush()
+            mismatches = self.check(expected)
+        finally:
+            events.unsubscribe(self.waiter.on_line)
+        with config.print_lock:
+            for step in self.steps:
+                print(step.describe())
+            for m in mismatches:
+                print(m)
+        failed = [s for s in self.steps if s.error or not s.answered]
+        return not failed and not mismatches and not bad_lines
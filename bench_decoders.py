@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+
+"""
+Microbenchmark of the decoders and of the whole read_loop dispatch (decode_line),
+in nanoseconds per line over a corpus of typical AVR output.
+
+Each benchmark is timed next to a reference function doing plain interpreter
+work on the same lines, and the baseline keeps the ratio of the two: machines
+and runs differ in speed by 2x or more, but mostly for both alike.
+
+  python3 bench_decoders.py            compare with the stored baseline
+  python3 bench_decoders.py --save     store the current ratios as the baseline
+
+Exits with status 1 if a ratio is larger than its baseline * threshold.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+import decoders
+
+baseline_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+# Typical lines, roughly in the proportions they arrive in (display updates dominate):
+CORPUS = [
+    "FL022020204150504C45545620202020",
+    "FL000048444D4931202020202020202020",
+    "FL02202056504C20202D33352E30644220",
+    "FL022020204150504C45545620202020",
+    "VOL121",
+    "VOL081",
+    "PWR0",
+    "FN19",
+    "FN05",
+    "SR0001",
+    "LM0101",
+    "LM0e01",
+    "AST0602111010001000000001110100010000000000",
+    "VST14122110922110921",
+    "GHH00",
+    "GCH01000000Stations",
+    "GDH000010000800500",
+    "GEH01020Station 1",
+    "GEH02021Some Artist",
+    "GEH03022Some Album",
+    "TR06",
+    "BA04",
+    "TO1",
+    "IS1",
+    "ATE97",
+    "VTC05",
+    "ATW1",
+    "ATC0",
+    "ATD1",
+    "E04",
+    "SVB0009B0123456",
+    'SSI"1-234-567/890"',
+    "RGD<001><SC-1222>",
+]
+
+# times best-of:
+REPEATS = 5
+# ratio growth counted as a regression; unchanged code varies by up to about
+# 1.2x between runs once compared to the reference:
+THRESHOLD = 1.5
+
+REFERENCE_NAMES = {"FL0": "display", "VOL": "volume", "PWR": "power", "GEH": "item"}
+
+def reference(s: str) -> str:
+    "Plain interpreter work (slicing, a lookup, formatting), to time the decoders against"
+    return f"{s[:2]} {REFERENCE_NAMES.get(s[:3], '?')} {len(s)} {s[3:].isdecimal()}"
+
+def ns_total(fn, lines: list[str], rounds: int) -> int:
+    start = time.perf_counter_ns()
+    for _r in range(rounds):
+        for s in lines:
+            fn(s)
+    return time.perf_counter_ns() - start
+
+def timed(fn, lines: list[str], rounds: int) -> tuple[float, float]:
+    """(ns per line, ratio to the reference), both best of REPEATS,
+    timing fn and the reference in turns so that both see the same machine state"""
+    best = best_reference = None
+    for _ in range(REPEATS):
+        t = ns_total(fn, lines, rounds)
+        r = ns_total(reference, lines, rounds)
+        best = t if best is None else min(best, t)
+        best_reference = r if best_reference is None else min(best_reference, r)
+    assert best is not None and best_reference is not None
+    return (best / (rounds * len(lines)), best / best_reference)
+
+def run(rounds: int) -> dict[str, tuple[float, float]]:
+    "(ns/line, ratio to the reference) for every decoder, and for the whole dispatch"
+    results = {}
+    for d in dict.fromkeys(decoders.DECODERS): # each decoder once
+        results[d.__name__] = timed(d, CORPUS, rounds)
+    results["try_all"] = timed(decoders.try_all, CORPUS, rounds)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import telnet # pylint: disable=import-outside-toplevel
+        results["decode_line"] = timed(telnet.decode_line, CORPUS, rounds)
+    return results
+
+def compare(ratios: dict[str, float], baseline: dict[str, float], threshold: float) -> list[str]:
+    "Names of the benchmarks whose ratio grew beyond baseline * threshold"
+    return [k for (k, v) in ratios.items() if k in baseline and v > baseline[k] * threshold]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--save', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help=f'slowdown factor counted as a regression (default {THRESHOLD})')
+    parser.add_argument('--rounds', type=int, default=1000, help='passes over the corpus')
+    args = parser.parse_args()
+
+    current = run(args.rounds)
+    ratios = {k: r for (k, (_, r)) in current.items()}
+    if args.save:
+        with open(baseline_filename, "w", encoding='UTF-8') as f:
+            json.dump({k: round(r, 3) for (k, r) in ratios.items()}, f, indent=2, sort_keys=True)
+        print(f"Wrote baseline to {baseline_filename}")
+    try:
+        with open(baseline_filename, encoding='UTF-8') as f:
+            base = json.load(f)
+    except OSError:
+        base = {}
+    for (name, (ns, r)) in current.items():
+        change = f"{r / base[name]:.2f}x baseline" if name in base else "(no baseline)"
+        print(f"{name:15} {ns:9.1f} ns/line  {r:6.2f}x reference  {change}")
+    if regressions := compare(ratios, base, args.threshold):
+        print(f"Slower than baseline by more than {args.threshold}x: {', '.join(regressions)}")
+        sys.exit(1)
@@ -0,0 +1,123 @@
+
+"""
+Command router: maps what the user types to the handler that runs it.
+
+Handlers are registered for exact commands, for lookups (functions that check
+a data-driven map such as commandMap), for a first word (prefix), or for a
+regular expression, and are tried in that order, then the default handler.
+Exact names and prefixes are dict lookups; the patterns are compiled into a
+single regular expression.
+
+A handler is called as handler(tn, command, split_command), where tn is
+anything with a write(bytes) method. Returning False means "not mine", and the
+next candidate is tried; anything else is returned by dispatch.
+
+Plugins are modules with a register(router) function, see load_plugin.
+"""
+
+from typing import Any, Callable, Iterator, Optional
+import importlib
+import re
+
+Handler = Callable[[Any, str, list[str]], Any]
+
+# returned by a handler to end the session:
+QUIT = "quit"
+
+
+class Router:
+    """Table of command handlers"""
+
+    def __init__(self):
+        self.exact: dict[str, Handler] = {}
+        self.lookups: list[Handler] = []
+        self.prefixes: dict[str, Handler] = {}
+        self.patterns: list[tuple[str, Handler]] = []
+        self.default: Optional[Handler] = None
+        self.compiled: Optional[re.Pattern] = None
+
+    def exact_command(self, *names: str) -> Callable[[Handler], Handler]:
+        "Decorator registering a handler for whole commands"
+        def register(fn: Handler) -> Handler:
+            for n in names:
+                self.exact[n] = fn
+            return fn
+        return register
+
+    def lookup(self, fn: Handler) -> Handler:
+        "Decorator registering a handler that looks the command up in some map"
+        self.lookups.append(fn)
+        return fn
+
+    def prefix_command(self, *words: str) -> Callable[[Handler], Handler]:
+        "Decorator registering a handler for commands starting with one of words"
+        def register(fn: Handler) -> Handler:
+            for w in words:
+                self.prefixes[w] = fn
+            return fn
+        return register
+
+    def pattern_command(self, regex: str) -> Callable[[Handler], Handler]:
+        "Decorator registering a handler for commands fully matching regex"
+        def register(fn: Handler) -> Handler:
+            self.patterns.append((regex, fn))
+            self.compiled = None
+            return fn
+        return register
+
+    def default_command(self, fn: Handler) -> Handler:
+        "Decorator registering the handler of last resort"
+        self.default = fn
+        return fn
+
+    def compile(self) -> None:
+        "Combines the patterns into one regular expression"
+        alternatives = [f"(?P<p{i}>{rx})" for (i, (rx, _)) in enumerate(self.patterns)]
+        self.compiled = re.compile("|".join(alternatives)) if alternatives else None
+
+    def candidates(self, command: str, split_command: list[str]) -> Iterator[Handler]:
+        "Handlers for command, in the order they should be tried"
+        if h := self.exact.get(command):
+            yield h
+        yield from self.lookups
+        if split_command and (h := self.prefixes.get(split_command[0])):
+            yield h
+        if self.patterns:
+            if self.compiled is None:
+                self.compile()
+            assert self.compiled is not None
+            if (m := self.compiled.fullmatch(command)) and m.lastgroup:
+                yield self.patterns[int(m.lastgroup[1:])][1]
+        if self.default is not None:
+            yield self.default
+
+    def dispatch(self, tn, command: str) -> Any:
+        "Runs the first handler that accepts command; returns its result"
+        command = command.strip()
+        split_command = command.split()
+        for h in self.candidates(command, split_command):
+            result = h(tn, command, split_command)
+            if result is not False:
+                return result
+        return None
+
+
+class Recorder:
+    """Stands in for a connection, keeping the commands written to it"""
+
+    def __init__(self):
+        self.codes: list[str] = []
+
+    def write(self, b: bytes) -> None:
+        self.codes += [c for c in b.decode().split("\r\n") if c]
+
+def capture(router: Router, command: str) -> list[str]:
+    "The codes that dispatching command would send to the AVR"
+    r = Recorder()
+    router.dispatch(r, command)
+    return r.codes
+
+def load_plugin(router: Router, module_name: str) -> None:
+    "Imports a plugin module and lets it register its commands"
+    module = importlib.import_module(module_name)
+    module.register(router)
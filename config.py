@@ -1,9 +1,21 @@
 from threading import Lock
 
+import tracing
+
 print_lock = Lock()
 
 def report(s):
+    if tracing.ENABLED:
+        t0 = tracing.begin()
+        with print_lock:
+            t1 = tracing.begin()
+            print(s)
+        tracing.end("report", "print", t0, lock_wait_us=t1 - t0)
+        return
     with print_lock:
         print(s)
 
 DEBUG = False
+
+# only report the AST/VST fields that changed:
+DIFF = False
@@ -0,0 +1,341 @@
+
+"""
+Offline index of network-source menus (Internet Radio, Media Server, ...):
+"crawl" walks the menu tree in the background, "find <text>" searches it, and
+"goto N" opens a result.
+
+Items are the GEH lines of each list page; their type (trackFieldsMap) tells
+folders (Artist, Album, Genre, Category, Composer) from playable items (Track,
+Channel), which are indexed but never selected, so crawling plays nothing.
+Each folder is reached by replaying its select path from the top menu, so the
+walk can stop and resume anywhere: the folders still to visit are saved with
+the index, per receiver and source, in ~/.pioneer_avr_lists.json.
+The pages of a folder are asked for a few at a time, CRAWL_PACE apart.
+
+A select path is the list of item numbers from the top menu. Item n of a list
+is opened by selecting its line (NNGFI) when the page shown has it, else by
+showing the page that starts with it (nGCI) first.
+"""
+
+from collections import deque
+from typing import Callable, Optional
+import bisect
+import json
+import os
+import threading
+import time
+
+import config
+import events
+from decoders import trackFieldsMap
+from list_cache import ListPage
+
+report = config.report
+
+# goes to the top of the network-source menu:
+TOP_MENU = "19IP"
+# item types that are lists of other items, and are walked into:
+FOLDER_TYPES = {"21", "22", "24", "28", "29", "30"}
+# list pages asked for before waiting for them:
+CRAWL_WINDOW = 2
+# time between writes while crawling, in seconds:
+CRAWL_PACE = 0.1
+# how long to wait for a list page, in seconds:
+PAGE_TIMEOUT = 5.0
+# the index is saved after this many folders:
+SAVE_EVERY = 10
+
+lists_filename = os.path.expanduser("~/.pioneer_avr_lists.json")
+
+Path = tuple[int, ...]
+
+def tokens(text: str) -> list[str]:
+    "Lowercase words of text"
+    return "".join(c if c.isalnum() else " " for c in text.lower()).split()
+
+def parse_item(line: str, start: int) -> Optional[tuple[int, str, str]]:
+    "(item number, type, title) for a GEH line of the page starting at start"
+    s = line[3:]
+    if not line.startswith("GEH") or len(s) < 5 or not s[0:2].isdecimal():
+        return None
+    return (start + int(s[0:2]) - 1, s[3:5], s[5:].strip().strip('"'))
+
+
+def select_codes(page: ListPage, n: int) -> list[str]:
+    "The codes that select item n of the list whose page is shown"
+    if page.contains(n):
+        return [f"{n - page.start + 1:02}GFI"]
+    return [f"{n:05}GCI", "01GFI"]
+
+
+class ListIndex:
+    """Items of one source by select path, with an inverted index over their titles"""
+
+    def __init__(self):
+        self.items: dict[Path, tuple[str, str]] = {} # path -> (type, title)
+        self.postings: dict[str, set[Path]] = {}
+        self.words: list[str] = [] # sorted, for prefix search
+        self.lock = threading.Lock() # the crawler adds while the prompt searches
+
+    def add(self, path: Path, kind: str, title: str) -> None:
+        with self.lock:
+            if path in self.items:
+                return
+            self.items[path] = (kind, title)
+            for w in set(tokens(title)):
+                if w not in self.postings:
+                    self.postings[w] = set()
+                    bisect.insort(self.words, w)
+                self.postings[w].add(path)
+
+    def entries(self) -> list[list]:
+        "[path, type, title] of every item, for saving"
+        with self.lock:
+            return [[list(p), kind, title] for (p, (kind, title)) in self.items.items()]
+
+    def find(self, text: str, limit: int = 20) -> list[Path]:
+        """Paths of the items with every word of text in their title (the last word
+        may be the start of one), shortest paths first"""
+        words = tokens(text)
+        if not words:
+            return []
+        matches: Optional[set[Path]] = None
+        with self.lock:
+            for (i, w) in enumerate(words):
+                if i < len(words) - 1:
+                    found = set(self.postings.get(w, ()))
+                else:
+                    found = set()
+                    j = bisect.bisect_left(self.words, w)
+                    while j < len(self.words) and self.words[j].startswith(w):
+                        found |= self.postings[self.words[j]]
+                        j += 1
+                matches = found if matches is None else matches & found
+        return sorted(matches or (), key=lambda p: (len(p), self.items[p][1].lower(), p))[:limit]
+
+    def describe(self, path: Path) -> str:
+        (kind, title) = self.items[path]
+        parents = [self.items[path[:i]][1] for i in range(1, len(path)) if path[:i] in self.items]
+        return f"{title} ({trackFieldsMap.get(kind, kind)}" + (f" in {' / '.join(parents)})" if parents else ")")
+
+
+class ListStore:
+    """The indexes and crawl progress by receiver and source, saved between runs"""
+
+    def __init__(self, receiver: str = ""):
+        self.receiver = receiver
+        self.all: dict[str, dict] = self.load()
+        self.indexes: dict[str, ListIndex] = {}
+        self.lock = threading.RLock() # the crawler saves while the prompt finds
+
+    def load(self) -> dict[str, dict]:
+        try:
+            with open(lists_filename, encoding='UTF-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self) -> None:
+        with self.lock:
+            for (source, index) in self.indexes.items():
+                entry = self.entry(source)
+                entry["items"] = index.entries()
+            text = json.dumps(self.all)
+        try:
+            with open(lists_filename + ".tmp", "w", encoding='UTF-8') as f:
+                f.write(text)
+            os.replace(lists_filename + ".tmp", lists_filename)
+        except OSError as ex:
+            report(f"Could not save the list index to {lists_filename}: {ex}")
+
+    def entry(self, source: str) -> dict:
+        with self.lock:
+            return self.all.setdefault(self.receiver, {}).setdefault(source, {"items": [], "todo": [[]]})
+
+    def index(self, source: str) -> ListIndex:
+        with self.lock:
+            if source not in self.indexes:
+                index = ListIndex()
+                for (p, kind, title) in self.entry(source)["items"]:
+                    index.add(tuple(p), kind, title)
+                self.indexes[source] = index
+            return self.indexes[source]
+
+    def todo(self, source: str) -> list[Path]:
+        "Folders still to crawl (the top menu if none was crawled yet)"
+        with self.lock:
+            return [tuple(p) for p in self.entry(source)["todo"]]
+
+    def set_todo(self, source: str, todo: list[Path]) -> None:
+        with self.lock:
+            self.entry(source)["todo"] = [list(p) for p in todo]
+
+    def restart(self, source: str) -> None:
+        "Forgets the index of source, to crawl it again from the top"
+        with self.lock:
+            self.all.setdefault(self.receiver, {})[source] = {"items": [], "todo": [[]]}
+            self.indexes.pop(source, None)
+
+    def sources(self) -> list[str]:
+        with self.lock:
+            return list(self.all.get(self.receiver, {}))
+
+
+class ListReader:
+    """Assembles the list pages the AVR sends (an events listener), and waits for them"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.page: Optional[ListPage] = None
+        self.pages: deque[ListPage] = deque() # not yet waited for
+        self.count = 0 # pages received
+        self.dropped = 0 # pages taken off self.pages
+
+    def on_line(self, line: str, _message: Optional[str]) -> None:
+        with self.cond:
+            if line.startswith("GDH"):
+                r = line[3:]
+                if len(r) >= 15 and r.isdecimal():
+                    self.page = ListPage(int(r[0:5]), int(r[5:10]), int(r[10:15]), line)
+                    self.check_complete()
+            elif line.startswith("GEH") and self.page is not None:
+                self.page.lines.append(line)
+                self.check_complete()
+
+    def check_complete(self) -> None:
+        page = self.page
+        if page is not None and (page.total == 0 or page.complete()):
+            self.page = None
+            self.pages.append(page)
+            self.count += 1
+            self.cond.notify_all()
+
+    def wait(self, after: int, timeout: Optional[float] = None) -> Optional[ListPage]:
+        """The first page received after the first `after` ones, None after timeout (PAGE_TIMEOUT).
+        That page and the ones before it are let go: pages are waited for in order."""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.count > after, PAGE_TIMEOUT if timeout is None else timeout):
+                return None
+            if after < self.dropped:
+                return None
+            while self.dropped <= after:
+                page = self.pages.popleft()
+                self.dropped += 1
+            return page
+
+    def request(self, send_batch: Callable[[list[str]], None], code: str,
+                pace: float) -> Optional[ListPage]:
+        "Sends code, and waits for the page it brings"
+        before = self.count
+        send_batch([code])
+        page = self.wait(before)
+        time.sleep(pace)
+        return page
+
+    def open(self, send_batch: Callable[[list[str]], None], path: Path,
+             pace: float = CRAWL_PACE) -> Optional[ListPage]:
+        "Replays the select path of a folder; the first page of its list, None if it did not show"
+        page = self.request(send_batch, TOP_MENU, pace)
+        for n in path:
+            if page is None:
+                return None
+            codes = select_codes(page, n)
+            if len(codes) > 1:
+                page = self.request(send_batch, codes[0], pace)
+                if page is None:
+                    return None
+            page = self.request(send_batch, codes[-1], pace)
+        return page
+
+
+class Crawler:
+    """Walks the menu tree of a network source on a background thread.
+    background(True) is called when it starts and background(False) when it ends,
+    so that its list pages are not shown meanwhile."""
+
+    def __init__(self, send_batch: Callable[[list[str]], None], store: ListStore, source: str,
+                 background: Callable[[bool], None] = lambda on: None,
+                 window: int = CRAWL_WINDOW, pace: float = CRAWL_PACE):
+        self.send_batch = send_batch
+        self.store = store
+        self.source = source
+        self.background = background
+        self.reader = ListReader()
+        self.window = window
+        self.pace = pace
+        self.stopping = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.folders = 0
+
+    def start(self) -> None:
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def run(self) -> None:
+        events.subscribe(self.reader.on_line)
+        self.background(True)
+        try:
+            self.crawl()
+        finally:
+            self.background(False)
+            events.unsubscribe(self.reader.on_line)
+            self.store.save()
+
+    def crawl(self) -> None:
+        source = self.source
+        index = self.store.index(source)
+        todo = self.store.todo(source)
+        while todo and not self.stopping.is_set():
+            path = todo[-1]
+            items = self.read_folder(path)
+            if items is None:
+                if self.stopping.is_set():
+                    return
+                report(f"Crawling stopped: no answer for {index.describe(path) if path else 'the top menu'}")
+                return
+            for (n, kind, title) in items:
+                index.add(path + (n,), kind, title)
+            todo.pop()
+            todo += [path + (n,) for (n, kind, _) in reversed(items) if kind in FOLDER_TYPES]
+            self.store.set_todo(source, todo)
+            self.folders += 1
+            if self.folders % SAVE_EVERY == 0:
+                self.store.save()
+        if not todo:
+            report(f"Crawl done: {len(index.items)} items indexed")
+
+    def read_folder(self, path: Path) -> Optional[list[tuple[int, str, str]]]:
+        "The items of the folder at path, None if the AVR stopped answering"
+        first = self.reader.open(self.send_batch, path, self.pace)
+        if first is None:
+            return None
+        pages = {first.start: first}
+        starts = list(range(first.end + 1, first.total + 1, max(1, first.end - first.start + 1)))
+        while starts and not self.stopping.is_set():
+            batch = starts[:self.window]
+            before = self.reader.count
+            for start in batch:
+                self.send_batch([f"{start:05}GCI"])
+                time.sleep(self.pace)
+            for i in range(len(batch)):
+                if (page := self.reader.wait(before + i)) is None:
+                    return None
+                pages[page.start] = page
+            starts = starts[len(batch):]
+        if self.stopping.is_set():
+            return None
+        items = {}
+        for page in pages.values():
+            for line in page.lines[1:]:
+                if item := parse_item(line, page.start):
+                    items[item[0]] = item
+        return [items[n] for n in sorted(items)]
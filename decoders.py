@@ -1,28 +1,41 @@
 
 from typing import Optional
+import functools
 
 import config
 report = config.report
 
 # TODO: add unit tests
 
+# the AVR's error answers:
+ErrorMap = {
+    "E02" : "NOT AVAILABLE NOW",
+    "E03" : "INVALID COMMAND",
+    "E04" : "COMMAND ERROR",
+    "E06" : "PARAMETER ERROR",
+    "B00" : "BUSY"
+    }
+
 def decode_fl(s:str) -> Optional[str]:
     # print("Original Url string is:", s)
     if not s.startswith('FL'):
         return None
     s = s[2:] # the FL
     s = s[2:] # skip first two
-    result = bytes.fromhex(s).decode('ascii')
+    try:
+        result = bytes.fromhex(s).decode('ascii')
+    except ValueError: # bad hex digits or non-ascii
+        return None
     # print("original is", s, "result is", result)
     return result
 
 def decode_is(s:str) -> Optional[str]:
     if s.startswith('IS'): # TODO: use match
-        if s[2] == '0':
+        if s[2:3] == '0':
             r = "Phase control OFF"
-        elif s[2] == '1':
+        elif s[2:3] == '1':
             r = "Phase control ON"
-        elif s[2] == '2':
+        elif s[2:3] == '2':
             r = "Full band phase control on"
         else:
             r = "Phase control: unknown"
@@ -34,11 +47,11 @@ def decode_geh(s: str) -> Optional[str]:
         sbytes = s[3:]
         return "items " + sbytes[0:5] + " to " + sbytes[5:10] + " of total " + sbytes[10:]
     if s.startswith("GBH"):
-        return "max list number: " + s[2:]
+        return "max list number: " + s[3:]
     if s.startswith("GCH"):
         return screenTypeMap.get(s[3:5], "unknown")  + " - " + s
     if s.startswith('GHH'):
-        source = s[2:]
+        source = s[3:]
         return "source: " + internetSourceMap.get(source, "unknown")
     if not s.startswith('GEH'):
         return None
@@ -125,32 +138,51 @@ CHANNEL_MAP = {
     20: "XR"
 }
 
+# AST and VST answers are resent unchanged many times, so each payload is decoded once:
+SIGNAL_CACHE_SIZE = 32
+
 def decode_ast(s:str) -> Optional[str]:
     "Decodes an AST return status string"
     if not s.startswith('AST'):
         return None
-    s = s[3:]
+    return ast_text(s[3:])
+
+@functools.lru_cache(maxsize=SIGNAL_CACHE_SIZE)
+def ast_channels(s: str) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    "(input channels, output channels) of an AST payload"
+    # The manual starts counting at 1, so to fix this off-by-one, we do:
+    s = '-' + s
+    channels = sorted(CHANNEL_MAP.items())
+    inputs = tuple(v for (i,v) in channels if i < len(s) and s[i] == "1")
+    outputs = tuple(v for (i,v) in channels if i + 21 < len(s) and s[i + 21] == "1")
+    return (inputs, outputs)
+
+@functools.lru_cache(maxsize=SIGNAL_CACHE_SIZE)
+def ast_text(s: str) -> str:
+    "Readable version of an AST payload"
+    (inputs, outputs) = ast_channels(s)
     r = ""
     r += "Audio input signal: " + decode_ais( s[0:2] ) + "\n"
     r += "Audio input frequency: " + decode_aif( s[2:4] ) + "\n"
-    # The manual starts counting at 1, so to fix this off-by-one, we do:
-    s = '-' + s
-    # channels...
     r += "Input Channels:\n"
-    for (i,v) in sorted(CHANNEL_MAP.items()):
-        if i >= len(s):
-            break
-        if int(s[i]):
-            r+=(f"{v},\n")
+    for v in inputs:
+        r+=(f"{v},\n")
     r += "\nOutput Channels:\n"
-    for (i,v) in sorted(CHANNEL_MAP.items()):
-        idx = i + 21
-        if idx >= len(s):
-            break
-        if int(s[idx]):
-            r+=f"{v},\n"
+    for v in outputs:
+        r+=f"{v},\n"
     return r
 
+@functools.lru_cache(maxsize=SIGNAL_CACHE_SIZE)
+def ast_fields(s: str) -> tuple[tuple[str, str], ...]:
+    "(name, value) pairs of an AST payload, for diffing"
+    (inputs, outputs) = ast_channels(s)
+    return (
+        ("Audio input signal", decode_ais(s[0:2])),
+        ("Audio input frequency", decode_aif(s[2:4])),
+        ("Input channels", ", ".join(inputs) or "---"),
+        ("Output channels", ", ".join(outputs) or "---"),
+    )
+
 
 aif_map = {
     "00": "32kHz",
@@ -210,11 +242,15 @@ def decode_ais(s:str) -> str:
 
 def db_level(s:str) -> str:
     "db level conversion"
+    if not s.isdecimal():
+        return f"unknown ({s})"
     n = int(s)
     db = 6 - n
     return f"{db}dB"
 
 def vol_db_level(s:str) -> str:
+    if not s.isdecimal():
+        return f"unknown ({s})"
     n = int(s)
     db = (n - 161)/2.0
     return f"{db}dB"
@@ -299,39 +335,53 @@ def decode_vst(s: str) -> Optional[str]:
     """Decodes a VSTXXXXX string from the AVR"""
     if not s.startswith('VST'):
         return None
-    print(f"Debug is {config.DEBUG}")
     if config.DEBUG:
         report(f"Decoding {s}\n")
-    result = ""
-    s = "-" + s[3:] # for off-by-one
-    signal = SIGNAL_MAP.get(s[1], "Unknown")
-    result += f"Signal: {signal}\n"
-    sformat = SIGNAL_FORMAT_MAP.get(s[2:4], "Unknown")
-    result += f"Input resolution: {sformat}\n"
-    aspect = ASPECT_MAP.get(s[4], "Unknown")
-    result += f"Aspect: {aspect}\n"
-    color = COLOR_MAP.get(s[5], "Unknown")
-    result += f"Input color format: {color}\n"
-    ibit = FORMAT_BIT_MAP.get(s[6], "Unknown")
-    result += f"Input bit (HDMI only): {ibit}\n"
-    cspace = COLOR_SPACE_MAP.get(s[7], "Unknown")
-    result += f"Input extend color space (HDMI only): {cspace}\n"
-    oformat = SIGNAL_FORMAT_MAP.get(s[8:10], "Unknown")
-    result += f"Output resolution: {oformat}\n"
-    oaspect = ASPECT_MAP.get(s[10], "Unknown")
-    result += f"Output aspect: {oaspect}\n"
-    ocolor = COLOR_MAP.get(s[11], "Unknown")
-    result += f"Output color format (HDMI only): {ocolor}\n"
-    obit = FORMAT_BIT_MAP.get(s[12], "Unknown")
-    result += f"Output bit (HDMI only): {obit}\n"
-    ospace = COLOR_SPACE_MAP.get(s[13], "Unknown")
-    result += f"Output extend color space (HDMI only): {ospace}\n"
-    mrecommend = SIGNAL_FORMAT_MAP.get(s[14:16], "Unknown")
-    result += f"Monitor recommend resolution information: {mrecommend}\n"
-    mdcolor = FORMAT_BIT_MAP.get(s[16], "Unknown")
-    result += f"Monitor DeepColor: {mdcolor}\n"
-    # ... TODO
-    return result
+    return vst_text(s[3:])
+
+@functools.lru_cache(maxsize=SIGNAL_CACHE_SIZE)
+def vst_fields(s: str) -> tuple[tuple[str, str], ...]:
+    "(name, value) pairs of a VST payload"
+    s = ("-" + s).ljust(17) # for off-by-one; missing fields are "Unknown"
+    return (
+        ("Signal", SIGNAL_MAP.get(s[1], "Unknown")),
+        ("Input resolution", SIGNAL_FORMAT_MAP.get(s[2:4], "Unknown")),
+        ("Aspect", ASPECT_MAP.get(s[4], "Unknown")),
+        ("Input color format", COLOR_MAP.get(s[5], "Unknown")),
+        ("Input bit (HDMI only)", FORMAT_BIT_MAP.get(s[6], "Unknown")),
+        ("Input extend color space (HDMI only)", COLOR_SPACE_MAP.get(s[7], "Unknown")),
+        ("Output resolution", SIGNAL_FORMAT_MAP.get(s[8:10], "Unknown")),
+        ("Output aspect", ASPECT_MAP.get(s[10], "Unknown")),
+        ("Output color format (HDMI only)", COLOR_MAP.get(s[11], "Unknown")),
+        ("Output bit (HDMI only)", FORMAT_BIT_MAP.get(s[12], "Unknown")),
+        ("Output extend color space (HDMI only)", COLOR_SPACE_MAP.get(s[13], "Unknown")),
+        ("Monitor recommend resolution information", SIGNAL_FORMAT_MAP.get(s[14:16], "Unknown")),
+        ("Monitor DeepColor", FORMAT_BIT_MAP.get(s[16], "Unknown")),
+        # ... TODO
+    )
+
+@functools.lru_cache(maxsize=SIGNAL_CACHE_SIZE)
+def vst_text(s: str) -> str:
+    "Readable version of a VST payload"
+    return "".join(f"{k}: {v}\n" for (k, v) in vst_fields(s))
+
+# last fields seen for AST and VST, for diff mode:
+last_signal_fields: dict[str, tuple[tuple[str, str], ...]] = {}
+
+def diff_signal(s: str) -> Optional[str]:
+    """For an AST or VST line, only the fields that changed since the previous one
+    (the whole block the first time); None if nothing changed"""
+    kind = s[:3]
+    fields = ast_fields(s[3:]) if kind == "AST" else vst_fields(s[3:])
+    previous = last_signal_fields.get(kind)
+    last_signal_fields[kind] = fields
+    if previous is None:
+        return decode_ast(s) if kind == "AST" else decode_vst(s)
+    if previous is fields: # same payload, from the cache
+        return None
+    old = dict(previous)
+    changes = [f"{k}: {old.get(k, '---')} → {v}" for (k, v) in fields if old.get(k) != v]
+    return "\n".join(changes) or None
 
 def decode_ate(s: str) -> Optional[str]:
     if not s.startswith('ATE'):
@@ -0,0 +1,109 @@
+
+"""
+Finds Pioneer AVRs on the local network by probing a whole subnet concurrently.
+Each host that accepts a connection is asked ?RGD, ?SVB and ?SSI; those that
+answer with a model are reported. Results are cached for later runs.
+"""
+
+from typing import Optional
+import asyncio
+import ipaddress
+import json
+import os
+import time
+
+import config
+report = config.report
+
+DEFAULT_PORT = 23
+# connections in flight at the same time:
+DEFAULT_LIMIT = 128
+# per-host time limit for connecting and for answering, in seconds:
+DEFAULT_TIMEOUT = 0.5
+# how long discovery results stay valid, in seconds:
+CACHE_TTL = 24 * 3600
+
+discovery_cache_filename = os.path.expanduser("~/.pioneer_avr_discovery.json")
+
+Receiver = dict[str, str]
+
+async def identify(host: str, port: int = DEFAULT_PORT,
+                   timeout: float = DEFAULT_TIMEOUT) -> Optional[Receiver]:
+    "Asks host for its model, mac address and software version; None if not an AVR"
+    try:
+        (reader, writer) = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    info: Receiver = {"host": host, "port": str(port)}
+    try:
+        writer.write(b"?RGD\r\n?SVB\r\n?SSI\r\n")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not ("model" in info and "mac" in info and "software" in info):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            line = await asyncio.wait_for(reader.readline(), remaining)
+            if not line:
+                break
+            s = line.decode(errors="replace").strip()
+            if s.startswith("RGD"):
+                info["model"] = s[3:]
+            elif s.startswith("SVB"):
+                info["mac"] = s[3:]
+            elif s.startswith("SSI"):
+                info["software"] = s[3:]
+    except (OSError, asyncio.TimeoutError):
+        pass
+    finally:
+        writer.close()
+    return info if "model" in info else None
+
+async def scan(cidr: str, port: int = DEFAULT_PORT, timeout: float = DEFAULT_TIMEOUT,
+               limit: int = DEFAULT_LIMIT) -> list[Receiver]:
+    "Probes every host address in cidr, at most limit at a time"
+    semaphore = asyncio.Semaphore(limit)
+
+    async def probe(host: str) -> Optional[Receiver]:
+        async with semaphore:
+            return await identify(host, port, timeout)
+
+    network = ipaddress.ip_network(cidr, strict=False)
+    hosts = [str(h) for h in network.hosts()] or [str(network.network_address)]
+    results = await asyncio.gather(*(probe(h) for h in hosts))
+    return [r for r in results if r is not None]
+
+def load_cache(cidr: Optional[str] = None, ttl: float = CACHE_TTL) -> Optional[list[Receiver]]:
+    "Cached receivers (for cidr, if given) if any were found and still fresh, else None"
+    try:
+        with open(discovery_cache_filename, encoding='UTF-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - cached.get("time", 0) > ttl:
+        return None
+    if cidr is not None and cached.get("cidr") != cidr:
+        return None
+    return cached.get("receivers") or None
+
+def save_cache(cidr: str, receivers: list[Receiver]) -> None:
+    "Saves discovery results with the current time"
+    try:
+        with open(discovery_cache_filename, "w", encoding='UTF-8') as f:
+            json.dump({"time": time.time(), "cidr": cidr, "receivers": receivers}, f)
+    except OSError as ex:
+        report(f"Could not save discovery results to {discovery_cache_filename}: {ex}")
+
+def discover(cidr: str, port: int = DEFAULT_PORT, refresh: bool = False) -> list[Receiver]:
+    "Receivers on cidr, from the cache unless stale or refresh is set"
+    if not refresh and (cached := load_cache(cidr)) is not None:
+        return cached
+    start = time.monotonic()
+    found = asyncio.run(scan(cidr, port))
+    report(f"Scanned {cidr} in {time.monotonic() - start:.2f}s, found {len(found)} AVR(s)")
+    if found: # the AVR may just be off: scan again next time
+        save_cache(cidr, found)
+    return found
+
+def describe(r: Receiver) -> str:
+    return f"{r['host']}: {r.get('model', '?')} mac {r.get('mac', '?')} software {r.get('software', '?')}"
@@ -0,0 +1,33 @@
+
+"""
+Fan-out of the lines read from the AVR to any interested listeners
+(status cache, gateway clients, ...).
+Listeners are called on the reader thread, so they should be quick.
+"""
+
+from typing import Callable, Optional
+
+import config
+report = config.report
+
+Listener = Callable[[str, Optional[str]], None]
+
+_listeners: list[Listener] = []
+
+def subscribe(fn: Listener) -> None:
+    "Registers fn to be called with (line, decoded message) for each line read"
+    if fn not in _listeners:
+        _listeners.append(fn)
+
+def unsubscribe(fn: Listener) -> None:
+    "Removes a listener added with subscribe"
+    if fn in _listeners:
+        _listeners.remove(fn)
+
+def publish(line: str, message: Optional[str]) -> None:
+    "Passes a line and its decoded message (if any) to all the listeners"
+    for fn in _listeners:
+        try:
+            fn(line, message)
+        except Exception as ex:
+            report(f"Error in listener {fn}: {ex}")
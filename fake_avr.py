@@ -0,0 +1,204 @@
+
+"""
+A minimal stand-in for a Pioneer AVR, listening on a local TCP port.
+Answers the common status queries and tracks power, volume, input and mode,
+which is enough for tests and local experiments without a receiver.
+
+Run with: python3 fake_avr.py [port]
+"""
+
+from typing import Callable, Optional
+import asyncio
+import sys
+
+import config
+report = config.report
+
+
+# the Internet Radio menu: (title, item type, items if a folder)
+MENU = ("Internet Radio", "", [
+    ("Jazz", "24", [(f"Jazz Channel {i}", "32", None) for i in range(1, 11)]),
+    ("Rock", "24", [
+        ("Classic Rock", "24", [(f"Rock Radio {i}", "32", None) for i in range(1, 4)]),
+        ("Hard Rock FM", "32", None),
+    ]),
+    ("News Talk", "28", [("BBC World Service", "32", None), ("NPR News", "32", None)]),
+    ("Lounge Live", "32", None),
+])
+LIST_PAGE_SIZE = 8
+
+
+class FakeAVR:
+    """State and command handling of the simulated receiver"""
+
+    def __init__(self, model: str = "SC-1222", mac: str = "0009B0123456",
+                 software: str = '"1-234-567/890"'):
+        self.model = model
+        self.mac = mac
+        self.software = software
+        self.power = "0" # PWR0 is on
+        self.volume = 121
+        self.input = "19"
+        self.mode = "0001"
+        self.preset = "A01"
+        # tuner presets: preset -> (frequency, name)
+        self.presets = {f"{c}{n:02d}": (f"F{8750 + 20 * (i * 9 + n):05d}", f"STATION {c}{n}")
+                        for (i, c) in enumerate("ABCDEFG") for n in range(1, 10)}
+        self.list_path: list[int] = [] # indexes of the folders opened from the top menu
+        self.list_start = 1
+        self.server = None
+        self.writers: set[asyncio.StreamWriter] = set()
+
+    def handle(self, command: str) -> list[str]:
+        "Returns the lines the AVR would answer command with"
+        if command == "?RGD":
+            return [f"RGD<001><{self.model}>"]
+        if command == "?SVB":
+            return [f"SVB{self.mac}"]
+        if command == "?SSI":
+            return [f"SSI{self.software}"]
+        if command == "?P":
+            return [f"PWR{self.power}"]
+        if command in ("PO", "PF"):
+            self.power = "0" if command == "PO" else "1"
+            return [f"PWR{self.power}"]
+        if command == "?V":
+            return [f"VOL{self.volume:03}"]
+        if command in ("VU", "VD"):
+            step = 1 if command == "VU" else -1
+            self.volume = max(0, min(185, self.volume + step))
+            return [f"VOL{self.volume:03}"]
+        if command.endswith("VL") and command[:-2].isdecimal():
+            self.volume = max(0, min(185, int(command[:-2])))
+            return [f"VOL{self.volume:03}"]
+        if command == "?F":
+            return [f"FN{self.input}"]
+        if command.endswith("FN") and len(command) == 4:
+            self.input = command[:2]
+            return [f"FN{self.input}"]
+        if command == "?S":
+            return [f"SR{self.mode}"]
+        if command.endswith("SR") and len(command) == 6:
+            self.mode = command[:4]
+            return [f"SR{self.mode}"]
+        if command in ("19IP", "?GAI"):
+            if command == "19IP":
+                (self.list_path, self.list_start) = ([], 1)
+            return self.list_lines()
+        if command.endswith("GCI") and command[:-3].isdecimal():
+            self.list_start = max(1, int(command[:-3]))
+            return self.list_lines()
+        if command.endswith("GFI") and command[:-3].isdecimal():
+            n = self.list_start + int(command[:-3]) - 1
+            items = self.folder()[2]
+            if not 1 <= n <= len(items):
+                return ["E04"]
+            if items[n - 1][2] is None:
+                return ["GCH02000000" + items[n - 1][0]] # playing
+            (self.list_path, self.list_start) = (self.list_path + [n - 1], 1)
+            return self.list_lines()
+        if command == "?PR":
+            return [f"PR{self.preset}"]
+        if command in ("TPI", "TPD"):
+            order = list(self.presets)
+            step = 1 if command == "TPI" else -1
+            self.preset = order[(order.index(self.preset) + step) % len(order)]
+            return [f"PR{self.preset}", f"FR{self.presets[self.preset][0]}"]
+        if command.endswith("PR") and command[:3] in self.presets:
+            self.preset = command[:3]
+            return [f"PR{self.preset}", f"FR{self.presets[self.preset][0]}"]
+        if command == "?FR":
+            return [f"FR{self.presets[self.preset][0]}"]
+        if command == "?TQ":
+            return [f'TQ{self.preset}"{self.presets[self.preset][1]:<8}"']
+        return ["E04"]
+
+    def folder(self) -> tuple:
+        folder = MENU
+        for i in self.list_path:
+            folder = folder[2][i]
+        return folder
+
+    def list_lines(self) -> list[str]:
+        "The lines of the list page shown"
+        (title, _, items) = self.folder()
+        end = min(len(items), self.list_start + LIST_PAGE_SIZE - 1)
+        lines = ["GHH00", f"GCH01000000{title}", f"GDH{self.list_start:05}{end:05}{len(items):05}"]
+        for n in range(self.list_start, end + 1):
+            lines.append(f"GEH{n - self.list_start + 1:02}0{items[n - 1][1]}{items[n - 1][0]}")
+        return lines
+
+    def broadcast(self, line: str) -> None:
+        "Sends an unsolicited line to every connected client"
+        data = line.encode() + b"\r\n"
+        for w in list(self.writers):
+            w.write(data)
+
+    async def client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.writers.add(writer)
+        try:
+            while line := await reader.readline():
+                command = line.decode(errors="replace").strip()
+                if not command:
+                    continue
+                for answer in self.handle(command):
+                    self.broadcast(answer)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        "Starts listening; returns the port (useful when port is 0)"
+        self.server = await asyncio.start_server(self.client, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+
+class Responder:
+    """Stands in for a connection in tests: answers codes at once with a FakeAVR, in
+    order, and passes each answer to listener(line, None). replies (code -> lines)
+    replaces the answers to some codes; after `answers` codes, nothing is answered."""
+
+    def __init__(self, listener: Callable[[str, Optional[str]], None],
+                 replies: Optional[dict[str, list[str]]] = None, answers: Optional[int] = None):
+        self.avr = FakeAVR()
+        self.listener = listener
+        self.replies = replies or {}
+        self.answers = answers
+        self.batches: list[list[str]] = [] # as written
+        self.codes: list[str] = []
+        self.lines: list[str] = []
+
+    def write(self, b: bytes) -> None:
+        self.send_batch(b.decode().split())
+
+    def send_batch(self, codes: list[str]) -> None:
+        self.batches.append(list(codes))
+        for c in codes:
+            self.codes.append(c)
+            if self.answers is not None and len(self.codes) > self.answers:
+                continue
+            for line in self.replies[c] if c in self.replies else self.avr.handle(c):
+                self.lines.append(line)
+                self.listener(line, None)
+
+
+async def main(port: int) -> None:
+    avr = FakeAVR()
+    port = await avr.start(port=port)
+    report(f"Fake AVR listening on 127.0.0.1:{port}")
+    assert avr.server is not None
+    await avr.server.serve_forever()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2323))
+    except KeyboardInterrupt:
+        pass
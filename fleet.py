@@ -0,0 +1,392 @@
+#!/usr/bin/python3
+
+"""
+Supervises connections to many receivers at once (an installation with a
+hundred or more), which telnet.py, with its one connection and module-level
+state, is not made for.
+
+Receivers are split over worker processes (one per CPU by default) by a hash
+of their address, so a receiver stays in the same shard across restarts. Each
+worker runs all of its connections on one event loop, turns every line into a
+typed event (as ndjson.py does) and sends the events up in batches. The
+supervisor writes one NDJSON stream: the events, with a "receiver" field,
+and health reports ("type":"health") of every shard. It routes commands to
+the worker holding the receiver, and restarts a worker that dies.
+
+A receiver sending too much (a scrolling display, a fault) is kept from
+slowing the others: past LINE_BUDGET lines per second, only its latest line
+per kind is kept until the next batch, and its reader gives the loop up
+every YIELD_EVERY lines.
+
+    python3 fleet.py --workers 8 -f receivers.txt
+    python3 fleet.py 192.168.1.20 192.168.1.21:23
+
+Commands are read from stdin as "<receiver> <code>", e.g. "192.168.1.20 ?V",
+or "* PF" for every receiver. Receiver files have one host[:port] per line.
+"""
+
+from typing import Any, Callable, Optional
+import asyncio
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import threading
+import time
+import zlib
+
+import config
+import ndjson
+import state
+
+report = config.report
+
+DEFAULT_PORT = 23
+# events are sent to the supervisor this often, in seconds:
+BATCH_INTERVAL = 0.05
+# each shard reports its health this often, in seconds:
+HEALTH_INTERVAL = 5.0
+# lines per second per receiver before its lines are coalesced:
+LINE_BUDGET = 200
+# a reader lets the other connections run after this many lines in a row:
+YIELD_EVERY = 32
+CONNECT_TIMEOUT = 5.0
+# waits before reconnecting to a receiver, and before restarting a worker, in seconds:
+RECONNECT_DELAYS = (1, 2, 5, 10, 30)
+RESTART_DELAYS = (0.5, 1, 2, 5, 10)
+# commands kept for a receiver while it is not connected:
+MAX_PENDING = 32
+
+def receiver_id(address: str) -> str:
+    "host:port for 'host' or 'host:port'"
+    (host, _, port) = address.strip().partition(":")
+    return f"{host}:{port or DEFAULT_PORT}"
+
+def shard_of(receiver: str, workers: int) -> int:
+    return zlib.crc32(receiver.encode()) % workers
+
+def delay(delays: tuple, attempt: int) -> float:
+    return delays[min(attempt, len(delays) - 1)]
+
+
+class Link:
+    """One receiver connection inside a worker"""
+
+    def __init__(self, worker: "Worker", receiver: str):
+        self.worker = worker
+        self.receiver = receiver
+        (self.host, _, port) = receiver.rpartition(":")
+        self.port = int(port)
+        self.prefix = '{"receiver":' + json.dumps(receiver) + ","
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.pending: list[str] = []
+        self.names: dict[str, str] = {}
+        self.lines = 0
+        self.coalesced = 0
+        self.reconnects = 0
+        self.last_line = 0.0
+        # lines over budget, latest per kind, until the next batch:
+        self.held: dict[str, tuple[float, str]] = {}
+        self.budget_start = 0.0
+        self.budget_used = 0
+
+    async def run(self) -> None:
+        attempt = 0
+        while True:
+            try:
+                (reader, writer) = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), CONNECT_TIMEOUT)
+            except (OSError, asyncio.TimeoutError):
+                await asyncio.sleep(delay(RECONNECT_DELAYS, attempt))
+                attempt += 1
+                continue
+            attempt = 0
+            self.writer = writer
+            self.worker.status(self, "connected")
+            if self.pending:
+                writer.write(b"".join(c.encode() + b"\r\n" for c in self.pending))
+                self.pending = []
+            try:
+                await self.read(reader)
+            except (OSError, ValueError):
+                pass
+            finally:
+                self.writer = None
+                writer.close()
+            self.reconnects += 1
+            self.worker.status(self, "disconnected")
+            await asyncio.sleep(delay(RECONNECT_DELAYS, 0))
+
+    async def read(self, reader: asyncio.StreamReader) -> None:
+        in_a_row = 0
+        while line := await reader.readline():
+            s = line.decode(errors="replace").strip()
+            if s:
+                self.on_line(s)
+            in_a_row += 1
+            if in_a_row >= YIELD_EVERY:
+                in_a_row = 0
+                await asyncio.sleep(0) # readline does not yield while data is buffered
+
+    def on_line(self, line: str) -> None:
+        now = time.time()
+        self.lines += 1
+        self.last_line = now
+        if line.startswith("RGB"):
+            self.names[line[3:5]] = line[6:]
+        if now - self.budget_start >= 1.0:
+            (self.budget_start, self.budget_used) = (now, 0)
+        self.budget_used += 1
+        if self.budget_used > LINE_BUDGET:
+            kind = state.response_prefix(line) or line[:3]
+            if kind in self.held:
+                self.coalesced += 1
+            self.held[kind] = (now, line)
+            return
+        self.worker.emit(self.encode(line, now))
+
+    def encode(self, line: str, t: float) -> str:
+        encoded = ndjson.encode(line, t, self.names.get)
+        return self.prefix + encoded[1:]
+
+    def release(self) -> None:
+        "Sends the held lines on"
+        for (t, line) in self.held.values():
+            self.worker.emit(self.encode(line, t))
+        self.held = {}
+
+    def send(self, code: str) -> None:
+        if self.writer is not None:
+            self.writer.write(code.encode() + b"\r\n")
+        elif len(self.pending) < MAX_PENDING:
+            self.pending.append(code)
+
+    def health(self) -> dict[str, Any]:
+        return {"connected": self.writer is not None, "lines": self.lines,
+                "coalesced": self.coalesced, "reconnects": self.reconnects,
+                "idle": round(time.time() - self.last_line, 1) if self.last_line else None}
+
+
+class Worker:
+    """The connections of one shard, on one event loop; talks to the supervisor over conn"""
+
+    def __init__(self, shard: int, receivers: list[str], conn):
+        self.shard = shard
+        self.conn = conn
+        self.links = {r: Link(self, r) for r in receivers}
+        self.batch: list[str] = []
+        self.done: Optional[asyncio.Future] = None
+
+    def emit(self, encoded: str) -> None:
+        self.batch.append(encoded)
+
+    def status(self, link: Link, what: str) -> None:
+        self.emit(self.envelope({"type": what, "receiver": link.receiver}))
+
+    def envelope(self, fields: dict[str, Any]) -> str:
+        return json.dumps({"t": round(time.time(), 3), "shard": self.shard, **fields},
+                          separators=(",", ":"))
+
+    def on_command(self) -> None:
+        try:
+            while self.conn.poll():
+                (receiver, code) = self.conn.recv()
+                if link := self.links.get(receiver):
+                    link.send(code)
+        except (EOFError, OSError):
+            self.stop() # the supervisor is gone
+
+    def stop(self) -> None:
+        if self.done is not None and not self.done.done():
+            self.done.set_result(None)
+
+    async def send_batches(self) -> None:
+        next_health = time.monotonic()
+        while True:
+            await asyncio.sleep(BATCH_INTERVAL)
+            for link in self.links.values():
+                if link.held:
+                    link.release()
+            if time.monotonic() >= next_health:
+                next_health += HEALTH_INTERVAL
+                self.emit(self.envelope({"type": "health", "pid": os.getpid(),
+                                         "receivers": {r: l.health() for (r, l) in self.links.items()}}))
+            if self.batch:
+                (batch, self.batch) = (self.batch, [])
+                try:
+                    self.conn.send_bytes(("\n".join(batch) + "\n").encode())
+                except OSError:
+                    self.stop()
+                    return
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.done = loop.create_future()
+        loop.add_reader(self.conn.fileno(), self.on_command)
+        tasks = [asyncio.create_task(link.run()) for link in self.links.values()]
+        tasks.append(asyncio.create_task(self.send_batches()))
+        try:
+            await self.done
+        finally:
+            loop.remove_reader(self.conn.fileno())
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+def worker_main(shard: int, receivers: list[str], conn) -> None:
+    "Entry point of a worker process"
+    try:
+        asyncio.run(Worker(shard, receivers, conn).run())
+    except KeyboardInterrupt:
+        pass
+
+
+class Shard:
+    """The supervisor's side of a worker process"""
+
+    def __init__(self, number: int, receivers: list[str]):
+        self.number = number
+        self.receivers = receivers
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.conn: Any = None
+        self.send_lock = threading.Lock()
+        self.restarts = 0
+        self.started_at = 0.0
+
+    def start(self, context) -> None:
+        (ours, theirs) = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(self.number, self.receivers, theirs),
+                                       name=f"fleet-worker-{self.number}", daemon=True)
+        self.process.start()
+        theirs.close()
+        self.conn = ours
+        self.started_at = time.monotonic()
+
+    def send(self, receiver: str, code: str) -> bool:
+        with self.send_lock:
+            try:
+                self.conn.send((receiver, code))
+                return True
+            except (OSError, AttributeError):
+                return False
+
+
+class Fleet:
+    """Worker processes for receivers; on_event gets each line of the NDJSON stream"""
+
+    def __init__(self, receivers: list[str], workers: Optional[int] = None,
+                 on_event: Callable[[str], None] = print):
+        receivers = list(dict.fromkeys(receiver_id(r) for r in receivers))
+        workers = max(1, min(workers or os.cpu_count() or 1, len(receivers) or 1))
+        self.on_event = on_event
+        self.shard_of = {r: shard_of(r, workers) for r in receivers}
+        self.shards = [Shard(n, [r for r in receivers if self.shard_of[r] == n]) for n in range(workers)]
+        self.context = multiprocessing.get_context("spawn") # no forking of our threads
+        self.stopping = threading.Event()
+        self.pump_thread = threading.Thread(target=self.pump, daemon=True)
+        self.restart_due: dict[int, float] = {}
+
+    def start(self) -> None:
+        for shard in self.shards:
+            if shard.receivers:
+                shard.start(self.context)
+        self.pump_thread.start()
+
+    def send(self, receiver: str, code: str) -> bool:
+        "Sends code to receiver (an address, or '*' for all); False if unknown or its worker is down"
+        if receiver == "*":
+            return all([self.send(r, code) for r in self.shard_of])
+        receiver = receiver_id(receiver)
+        if receiver not in self.shard_of:
+            return False
+        return self.shards[self.shard_of[receiver]].send(receiver, code)
+
+    def emit(self, fields: dict[str, Any]) -> None:
+        self.on_event(json.dumps({"t": round(time.time(), 3), **fields}, separators=(",", ":")))
+
+    def pump(self) -> None:
+        "Passes the events of all workers on, and restarts workers that died"
+        while not self.stopping.is_set():
+            running = [s for s in self.shards if s.process is not None]
+            waitables: list[Any] = [s.conn for s in running] + [s.process.sentinel for s in running]
+            ready = multiprocessing.connection.wait(waitables, timeout=0.2) if waitables else []
+            if not waitables:
+                time.sleep(0.2)
+            for shard in running:
+                if shard.conn in ready:
+                    self.read_events(shard)
+            for shard in running:
+                if shard.process.sentinel in ready and not self.stopping.is_set():
+                    self.worker_died(shard)
+            now = time.monotonic()
+            for (n, due) in list(self.restart_due.items()):
+                if now >= due and not self.stopping.is_set():
+                    del self.restart_due[n]
+                    self.shards[n].start(self.context)
+                    self.emit({"type": "worker_restarted", "shard": n, "restarts": self.shards[n].restarts})
+
+    def read_events(self, shard: Shard) -> None:
+        try:
+            while shard.conn.poll():
+                for line in shard.conn.recv_bytes().decode().splitlines():
+                    self.on_event(line)
+        except (EOFError, OSError):
+            pass # the sentinel tells whether it died
+
+    def worker_died(self, shard: Shard) -> None:
+        assert shard.process is not None
+        shard.process.join()
+        self.emit({"type": "worker_exit", "shard": shard.number, "exitcode": shard.process.exitcode})
+        shard.conn.close()
+        (shard.process, shard.conn) = (None, None)
+        # a worker that ran for a while starts over with the shortest delay:
+        if time.monotonic() - shard.started_at > 60:
+            shard.restarts = 0
+        self.restart_due[shard.number] = time.monotonic() + delay(RESTART_DELAYS, shard.restarts)
+        shard.restarts += 1
+
+    def stop(self) -> None:
+        self.stopping.set()
+        self.pump_thread.join()
+        for shard in self.shards:
+            if shard.process is not None:
+                shard.conn.close() # the worker stops when its pipe closes
+                shard.process.join(2.0)
+                if shard.process.is_alive():
+                    shard.process.terminate()
+                    shard.process.join()
+
+def read_receivers(filename: str) -> list[str]:
+    "host[:port] lines of a file ('#' starts a comment)"
+    with open(filename, encoding='UTF-8') as f:
+        return [line for raw in f if (line := raw.split("#")[0].strip())]
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Connections to many receivers, as one NDJSON stream")
+    parser.add_argument('receivers', nargs='*', help='host or host:port of each receiver')
+    parser.add_argument('-f', '--file', metavar='FILE', type=str, default=None,
+                        help='read the receivers from FILE, one host[:port] per line')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    args = parser.parse_args()
+    all_receivers = args.receivers + (read_receivers(args.file) if args.file else [])
+    if not all_receivers:
+        parser.error("give receivers, or a file of them with -f")
+    out_lock = threading.Lock()
+
+    def write_event(line: str) -> None:
+        with out_lock:
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+
+    fleet = Fleet(all_receivers, args.workers, write_event)
+    fleet.start()
+    try:
+        for command_line in sys.stdin:
+            (target, _, code) = command_line.strip().partition(" ")
+            if code and not fleet.send(target, code.strip()):
+                report(f"Could not send {code.strip()} to {target}")
+    except KeyboardInterrupt:
+        pass
+    fleet.stop()
@@ -0,0 +1,280 @@
+
+"""
+Local HTTP/WebSocket gateway: keeps a single connection to the AVR and
+serves any number of local clients.
+
+  GET  /status           all cached status lines (JSON)
+  GET  /query?q=?V       one status query, answered from the cache when possible
+  POST /command          one command per body line, queued for the AVR
+  GET  /events           WebSocket: decoded events pushed as JSON text frames,
+                         text frames received are treated as commands
+
+Commands from all clients go through one writer, and identical queries and
+absolute sets (05FN, PO) that are still pending are only sent once; steps and
+toggles (VU, TPI, PZ) are sent as many times as they are asked for.
+"""
+
+from typing import Callable, Optional
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import urllib.parse
+
+import config
+import events
+import state
+
+report = config.report
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# events queued per client before the oldest ones are dropped:
+CLIENT_QUEUE_SIZE = 256
+# pause between commands written to the AVR, in seconds:
+COMMAND_GAP = 0.05
+# how long /query waits for the AVR to answer, in seconds:
+QUERY_TIMEOUT = 2.0
+# largest body of a POST /command, in bytes:
+MAX_BODY = 65536
+
+# codes that step or toggle, whose repeats are not duplicates:
+RELATIVE_CODES = {
+    "VU", "VD", "FU", "FD", "TI", "TD", "BI", "BD", "TPI", "TPD", "PZ", "MZ",
+    "ZU", "ZD", "YU", "YD", "HZU", "HZD",
+}
+
+def idempotent(code: str) -> bool:
+    "True if sending code twice in a row does the same as sending it once"
+    if code in state.QUERY_RESPONSES:
+        return True
+    return code not in RELATIVE_CODES and state.expected_response(code) is not None
+
+def content_length(headers: dict[str, str]) -> Optional[int]:
+    "The Content-Length of a request (0 if none), None if not a count of bytes"
+    value = headers.get("content-length", "0")
+    return int(value) if value.isdecimal() else None
+
+def ws_accept_key(key: str) -> str:
+    "The Sec-WebSocket-Accept value for a client's Sec-WebSocket-Key"
+    digest = hashlib.sha1((key + WS_GUID).encode()).digest()
+    return base64.b64encode(digest).decode()
+
+def ws_frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    "A single unmasked (server to client) WebSocket frame"
+    n = len(payload)
+    if n < 126:
+        header = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return header + payload
+
+async def ws_read_frame(reader: asyncio.StreamReader) -> tuple[int, bytes]:
+    "Reads one (possibly masked) frame; returns (opcode, payload)"
+    b0, b1 = await reader.readexactly(2)
+    opcode = b0 & 0x0F
+    n = b1 & 0x7F
+    if n == 126:
+        (n,) = struct.unpack("!H", await reader.readexactly(2))
+    elif n == 127:
+        (n,) = struct.unpack("!Q", await reader.readexactly(8))
+    mask = await reader.readexactly(4) if b1 & 0x80 else None
+    payload = await reader.readexactly(n)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for (i, b) in enumerate(payload))
+    return (opcode, payload)
+
+
+class Gateway:
+    """Multiplexes local clients over one AVR connection.
+    send_fn writes a raw command to the AVR; resolve turns a user command
+    (as typed at the prompt) into the raw codes to send."""
+
+    def __init__(self, send_fn: Callable[[str], None],
+                 resolve: Callable[[str], list[str]] = lambda c: [c]):
+        self.send_fn = send_fn
+        self.resolve = resolve
+        self.cache = state.StatusCache()
+        self.clients: set[asyncio.Queue] = set()
+        self.pending: set[str] = set()
+        self.commands: asyncio.Queue = asyncio.Queue()
+        self.waiters: dict[str, list[asyncio.Future]] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def on_line(self, line: str, message: Optional[str]) -> None:
+        "events listener; called on the reader thread"
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.dispatch, line, message)
+
+    def dispatch(self, line: str, message: Optional[str]) -> None:
+        "Updates the cache and pushes the event to every client"
+        key = self.cache.update(line, message)
+        if key is not None:
+            for fut in self.waiters.pop(key, []):
+                if not fut.done():
+                    fut.set_result(line)
+        if not self.clients:
+            return
+        # encoded and framed once, whatever the number of clients:
+        frame = ws_frame(json.dumps({"line": line, "text": message}).encode())
+        for q in self.clients:
+            if q.full():
+                q.get_nowait() # slow client: drop its oldest event
+            q.put_nowait(frame)
+
+    def enqueue(self, codes: list[str]) -> list[str]:
+        "Queues codes for the AVR, except idempotent ones already pending; returns the ones queued"
+        queued = []
+        for code in codes:
+            if code == "" or code in self.pending:
+                continue
+            if idempotent(code):
+                self.pending.add(code)
+            self.commands.put_nowait(code)
+            queued.append(code)
+        return queued
+
+    async def submit(self, command: str) -> list[str]:
+        "Queues the codes for a user command; returns the ones actually queued"
+        assert self.loop is not None
+        # resolving may pause between steps (volume), so it does not run on the loop:
+        codes = await self.loop.run_in_executor(None, self.resolve, command.strip())
+        return self.enqueue(codes)
+
+    async def writer(self) -> None:
+        "The only task writing to the AVR"
+        while True:
+            code = await self.commands.get()
+            self.pending.discard(code)
+            if config.DEBUG:
+                report(f"Gateway sending {code}")
+            self.send_fn(code)
+            await asyncio.sleep(COMMAND_GAP)
+
+    async def query(self, q: str) -> Optional[str]:
+        "Answers a status query from the cache, asking the AVR only on a miss"
+        if line := self.cache.answer(q):
+            return line
+        key = state.QUERY_RESPONSES.get(q)
+        if key is None:
+            return None
+        assert self.loop is not None
+        fut = self.loop.create_future()
+        self.waiters.setdefault(key, []).append(fut)
+        self.enqueue([q]) # concurrent misses share the same pending query
+        try:
+            return await asyncio.wait_for(fut, QUERY_TIMEOUT)
+        except asyncio.TimeoutError:
+            return None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        "Serves one HTTP request (or WebSocket session)"
+        try:
+            request = await reader.readline()
+            parts = request.decode("latin-1").split()
+            if len(parts) < 2:
+                return
+            (method, target) = (parts[0], parts[1])
+            headers = {}
+            while (h := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                (name, _, value) = h.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            url = urllib.parse.urlsplit(target)
+            if url.path == "/events" and headers.get("upgrade", "").lower() == "websocket":
+                await self.serve_websocket(reader, writer, headers)
+                return
+            if method == "GET" and url.path == "/status":
+                self.respond(writer, 200, self.cache.snapshot())
+            elif method == "GET" and url.path == "/query":
+                q = urllib.parse.parse_qs(url.query).get("q", [""])[0]
+                line = await self.query(q)
+                if line is None:
+                    self.respond(writer, 504, {"query": q, "error": "no answer"})
+                else:
+                    key = state.response_prefix(line) or ""
+                    self.respond(writer, 200, {"query": q, "line": line,
+                                               "text": self.cache.messages.get(key)})
+            elif method == "POST" and url.path == "/command":
+                length = content_length(headers)
+                if length is None:
+                    self.respond(writer, 400, {"error": "bad Content-Length"})
+                elif length > MAX_BODY:
+                    self.respond(writer, 413, {"error": f"body over {MAX_BODY} bytes"})
+                else:
+                    body = (await reader.readexactly(length)).decode() if length else ""
+                    queued = []
+                    for c in body.splitlines():
+                        queued += await self.submit(c)
+                    self.respond(writer, 202, {"queued": queued})
+            else:
+                self.respond(writer, 404, {"error": f"unknown request {method} {url.path}"})
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def respond(self, writer: asyncio.StreamWriter, code: int, obj) -> None:
+        "Writes a JSON HTTP response"
+        body = json.dumps(obj).encode()
+        writer.write(f"HTTP/1.1 {code} {'OK' if code < 300 else 'Error'}\r\n"
+                     "Content-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\n"
+                     "Connection: close\r\n\r\n".encode() + body)
+
+    async def serve_websocket(self, reader: asyncio.StreamReader,
+                              writer: asyncio.StreamWriter, headers: dict[str, str]) -> None:
+        "Pushes events to a WebSocket client and reads its commands"
+        accept = ws_accept_key(headers.get("sec-websocket-key", ""))
+        writer.write("HTTP/1.1 101 Switching Protocols\r\n"
+                     "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                     f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode())
+        q: asyncio.Queue = asyncio.Queue(CLIENT_QUEUE_SIZE)
+        self.clients.add(q)
+
+        async def push():
+            while True:
+                writer.write(await q.get())
+                await writer.drain()
+
+        pusher = asyncio.create_task(push())
+        try:
+            while True:
+                (opcode, payload) = await ws_read_frame(reader)
+                if opcode == 0x8: # close
+                    writer.write(ws_frame(b"", 0x8))
+                    break
+                if opcode == 0x9: # ping
+                    writer.write(ws_frame(payload, 0xA))
+                elif opcode == 0x1:
+                    for c in payload.decode().splitlines():
+                        await self.submit(c)
+        finally:
+            self.clients.discard(q)
+            pusher.cancel()
+
+    async def serve(self, host: str, port: int) -> None:
+        "Runs the gateway until cancelled"
+        self.loop = asyncio.get_running_loop()
+        events.subscribe(self.on_line)
+        server = await asyncio.start_server(self.handle, host, port)
+        report(f"Gateway listening on http://{host}:{port}")
+        writer_task = asyncio.create_task(self.writer())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            writer_task.cancel()
+            events.unsubscribe(self.on_line)
+
+
+def run(send_fn: Callable[[str], None], resolve: Callable[[str], list[str]],
+        host: str, port: int) -> None:
+    "Runs a gateway in the current thread"
+    try:
+        asyncio.run(Gateway(send_fn, resolve).serve(host, port))
+    except KeyboardInterrupt:
+        print("Goodbye!")
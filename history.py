@@ -0,0 +1,212 @@
+
+"""
+In-process history of volume, power, input and listening mode.
+Each metric keeps its raw points and minute and hour rollups in fixed-size,
+array-backed ring buffers, so memory stays bounded however long we run.
+"""
+
+from array import array
+from typing import Callable, Optional
+import math
+import time
+
+RAW_SIZE = 2048
+MINUTE_SIZE = 48 * 60 # two days of minutes
+HOUR_SIZE = 120 * 24 # four months of hours
+# windows up to this long are answered from minute buckets, longer ones from hour buckets:
+MINUTE_WINDOW = 6 * 3600
+
+# bucket columns: start time, min, max, sum, count, last value, changes
+BUCKET_COLUMNS = 7
+
+
+class Ring:
+    """Fixed-size ring buffer of rows of floats, one array per column"""
+
+    def __init__(self, size: int, columns: int):
+        self.size = size
+        self.columns = [array("d", bytes(8 * size)) for _ in range(columns)]
+        self.next = 0
+        self.count = 0
+
+    def append(self, row: tuple[float, ...]) -> None:
+        for (c, v) in zip(self.columns, row):
+            c[self.next] = v
+        self.next = (self.next + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def rows_since(self, t: float) -> list[tuple[float, ...]]:
+        "Rows whose first column is >= t, oldest first"
+        result = []
+        for k in range(self.count):
+            i = (self.next - 1 - k) % self.size
+            if self.columns[0][i] < t:
+                break
+            result.append(tuple(c[i] for c in self.columns))
+        result.reverse()
+        return result
+
+
+class Bucket:
+    """Aggregate of the points in one time period"""
+
+    def __init__(self, start: float):
+        self.start = start
+        self.min = math.inf
+        self.max = -math.inf
+        self.sum = 0.0
+        self.count = 0
+        self.last = math.nan
+        self.changes = 0
+
+    def add(self, value: float, previous: Optional[float]) -> None:
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.sum += value
+        self.count += 1
+        if previous is not None and previous != value:
+            self.changes += 1
+        self.last = value
+
+    def merge(self, b: "Bucket") -> None:
+        self.min = min(self.min, b.min)
+        self.max = max(self.max, b.max)
+        self.sum += b.sum
+        self.count += b.count
+        self.changes += b.changes
+        self.last = b.last
+
+    def row(self) -> tuple[float, ...]:
+        return (self.start, self.min, self.max, self.sum, self.count, self.last, self.changes)
+
+
+class Metric:
+    """Raw points of one metric and their minute and hour rollups.
+    Categorical metrics (input, mode) store the index of their label as value."""
+
+    def __init__(self, name: str, categorical: bool = False):
+        self.name = name
+        self.categorical = categorical
+        self.labels: list[str] = []
+        self.label_index: dict[str, int] = {}
+        self.raw = Ring(RAW_SIZE, 2)
+        self.minutes = Ring(MINUTE_SIZE, BUCKET_COLUMNS)
+        self.hours = Ring(HOUR_SIZE, BUCKET_COLUMNS)
+        self.minute: Optional[Bucket] = None
+        self.hour: Optional[Bucket] = None
+        self.last: Optional[float] = None
+
+    def add(self, value: float, t: float) -> None:
+        "Records a point, closing the minute and hour buckets that are over"
+        self.raw.append((t, value))
+        minute_start = t - t % 60
+        if self.minute is not None and self.minute.start != minute_start:
+            self.close_minute()
+        if self.minute is None:
+            self.minute = Bucket(minute_start)
+        self.minute.add(value, self.last)
+        self.last = value
+
+    def add_label(self, label: str, t: float) -> None:
+        "Records a point of a categorical metric"
+        i = self.label_index.get(label)
+        if i is None:
+            i = self.label_index[label] = len(self.labels)
+            self.labels.append(label)
+        self.add(float(i), t)
+
+    def close_minute(self) -> None:
+        "Moves the open minute to its ring, and rolls it up into the open hour"
+        m = self.minute
+        assert m is not None
+        self.minutes.append(m.row())
+        hour_start = m.start - m.start % 3600
+        if self.hour is not None and self.hour.start != hour_start:
+            self.hours.append(self.hour.row())
+            self.hour = None
+        if self.hour is None:
+            self.hour = Bucket(hour_start)
+        self.hour.merge(m)
+        self.minute = None
+
+    def buckets(self, window: float, now: float) -> list[tuple[float, ...]]:
+        "Bucket rows covering the last window seconds, including the open ones"
+        since = now - window
+        if window <= MINUTE_WINDOW:
+            rows = self.minutes.rows_since(since - 60)
+            # the open minute stays open while the metric is idle, maybe long past the window:
+            if self.minute is not None and self.minute.start >= since - 60:
+                rows.append(self.minute.row())
+            return rows
+        rows = self.hours.rows_since(since - 3600)
+        # the open hour, with the open minute rolled in (without closing it):
+        h = None
+        if self.hour is not None:
+            h = Bucket(self.hour.start)
+            h.merge(self.hour)
+        if self.minute is not None:
+            minute_hour = self.minute.start - self.minute.start % 3600
+            if h is None or h.start != minute_hour:
+                if h is not None and h.start >= since - 3600:
+                    rows.append(h.row())
+                h = Bucket(minute_hour)
+            h.merge(self.minute)
+        return rows + ([h.row()] if h is not None and h.start >= since - 3600 else [])
+
+    def label(self, value: float) -> str:
+        return self.labels[int(value)] if self.categorical else f"{value}"
+
+
+class History:
+    """The metrics we keep, fed with lines from the AVR (usable as an events listener)"""
+
+    def __init__(self):
+        self.metrics = {
+            "volume": Metric("volume"),
+            "power": Metric("power"),
+            "input": Metric("input", categorical=True),
+            "mode": Metric("mode", categorical=True),
+        }
+
+    def on_line(self, line: str, _message: Optional[str] = None, t: Optional[float] = None) -> None:
+        "Records the metric carried by line, if any"
+        t = time.time() if t is None else t
+        if line.startswith("VOL"):
+            if line[3:].isdecimal():
+                self.metrics["volume"].add((int(line[3:]) - 161) / 2.0, t)
+        elif line.startswith("PWR"):
+            self.metrics["power"].add(1.0 if line == "PWR0" else 0.0, t)
+        elif line.startswith("FN"):
+            self.metrics["input"].add_label(line[2:], t)
+        elif line.startswith("LM") or line.startswith("SR"):
+            self.metrics["mode"].add_label(line, t)
+
+    def report(self, name: str, window: float, label: Callable[[str], str] = lambda s: s,
+               now: Optional[float] = None) -> list[str]:
+        "Readable summary of a metric over the last window seconds, one line per bucket"
+        metric = self.metrics.get(name)
+        if metric is None:
+            return [f"Unknown metric {name}; use one of {', '.join(self.metrics)}"]
+        now = time.time() if now is None else now
+        rows = metric.buckets(window, now)
+        if not rows:
+            return [f"No {name} history yet"]
+        fmt = "%H:%M" if window <= MINUTE_WINDOW else "%a %H:00"
+        result = []
+        for (start, lo, hi, total, count, last, changes) in rows:
+            when = time.strftime(fmt, time.localtime(start))
+            if metric.categorical:
+                result.append(f"{when}  {label(metric.label(last))} ({int(changes)} changes)")
+            else:
+                result.append(f"{when}  min {lo}  avg {total / count:.1f}  max {hi}  last {last}")
+        return result
+
+
+def parse_window(s: str) -> Optional[float]:
+    "Seconds in a window like 90s, 15m, 2h or 3d (minutes if no unit)"
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    (number, unit) = (s[:-1], s[-1]) if s[-1:] in units else (s, "m")
+    try:
+        return float(number) * units[unit]
+    except ValueError:
+        return None
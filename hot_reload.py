@@ -0,0 +1,46 @@
+
+"""
+Cheap change detection for configuration files (commandMap.json, the sources map),
+so that a long-running session can pick up edits without restarting.
+"""
+
+from typing import Callable, Optional, Union
+import os
+import time
+
+# files are stat'ed at most this often, in seconds:
+RELOAD_INTERVAL = 2.0
+
+class FileWatch:
+    """Tells whether a file changed (by path, mtime and size) since the last check.
+    The file is given as a path, or as a function returning the current path (or None)."""
+
+    def __init__(self, path: Union[str, Callable[[], Optional[str]]],
+                 interval: float = RELOAD_INTERVAL):
+        self.find = path if callable(path) else (lambda: path)
+        self.interval = interval
+        self.path: Optional[str] = None
+        self.signature = self.stat()
+        self.checked = time.monotonic()
+
+    def stat(self) -> Optional[tuple[str, int, int]]:
+        self.path = self.find()
+        if self.path is None:
+            return None
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (self.path, st.st_mtime_ns, st.st_size)
+
+    def changed(self) -> bool:
+        "True if the file changed since the last call; stats it at most every interval seconds"
+        now = time.monotonic()
+        if now - self.checked < self.interval:
+            return False
+        self.checked = now
+        signature = self.stat()
+        if signature == self.signature:
+            return False
+        self.signature = signature
+        return True
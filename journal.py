@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+
+"""
+Append-only binary journal of the lines received from the AVR.
+
+A journal is a folder of segment files. Each record is
+  timestamp (uint64, microseconds since the epoch)
+  prefix code (uint8, index into JOURNAL_PREFIXES)
+  payload length (uint16)
+  payload (the rest of the line, UTF-8)
+Every INDEX_EVERY records, (timestamp, offset) is appended to the segment's
+.idx file; readers mmap the segment and binary-search that sparse index
+to find the first record of a time range without parsing the whole file.
+Segments are rotated when they reach SEGMENT_SIZE bytes.
+
+Query from the command line with:
+  python3 journal.py FOLDER [--start T1] [--end T2] [PREFIX ...]
+"""
+
+from typing import Iterator, Optional
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+
+RECORD = struct.Struct("<QBH")
+INDEX = struct.Struct("<QQ")
+
+INDEX_EVERY = 64
+SEGMENT_SIZE = 16 * 1024 * 1024
+# records buffered before they are flushed to disk:
+FLUSH_EVERY = 32
+# ... or seconds since the last flush:
+FLUSH_INTERVAL = 1.0
+
+# Prefix codes stored in the journal; only ever append to this list.
+JOURNAL_PREFIXES = (
+    "", "PWR", "VOL", "MUT", "FN", "SR", "LM", "FL", "AST", "VST",
+    "VTC", "IS", "ATW", "ATC", "ATD", "ATE", "TO", "TR", "BA", "RGB",
+    "RGD", "SVB", "SSI", "GBH", "GCH", "GDH", "GEH", "GHH", "VTA", "AUA",
+    "E0", "B00",
+    # tuner presets, and Zone 2, Zone 3 and HDZone power, volume, mute and input:
+    "PR", "FR", "TQ", "APR", "ZV", "Z2M", "Z2F", "BPR", "YV", "Z3M", "Z3F",
+    "ZEP", "XV", "HZM", "ZEA",
+)
+PREFIX_CODES = {p: i for (i, p) in enumerate(JOURNAL_PREFIXES)}
+
+def encode_prefix(line: str) -> tuple[int, str]:
+    "(prefix code, rest of the line) for a line"
+    for n in (3, 2):
+        code = PREFIX_CODES.get(line[:n])
+        if code is not None:
+            return (code, line[n:])
+    return (0, line)
+
+def segment_name(first_us: int) -> str:
+    return f"journal-{first_us:020d}.seg"
+
+def list_segments(folder: str) -> list[tuple[int, str]]:
+    "(first timestamp, path) of each segment in folder, oldest first"
+    result = []
+    for name in os.listdir(folder):
+        if name.startswith("journal-") and name.endswith(".seg"):
+            result.append((int(name[8:-4]), os.path.join(folder, name)))
+    return sorted(result)
+
+
+class JournalWriter:
+    """Appends lines to the journal in folder; can be used as an events listener.
+    Records are flushed every FLUSH_EVERY records, FLUSH_INTERVAL seconds after
+    the first unflushed one, and on close."""
+
+    def __init__(self, folder: str, segment_size: int = SEGMENT_SIZE):
+        self.folder = folder
+        self.segment_size = segment_size
+        os.makedirs(folder, exist_ok=True)
+        self.data = None
+        self.index = None
+        self.size = 0
+        self.count = 0
+        self.unflushed = 0
+        self.flushed_at = time.monotonic()
+        self.last_us = 0
+        self.lock = threading.Lock()
+        self.timer: Optional[threading.Timer] = None
+
+    def open_segment(self, first_us: int) -> None:
+        self.close_locked()
+        path = os.path.join(self.folder, segment_name(first_us))
+        self.data = open(path, "ab") # pylint: disable=consider-using-with
+        self.index = open(path[:-4] + ".idx", "ab") # pylint: disable=consider-using-with
+        self.size = self.data.tell()
+        self.count = 0
+
+    def append(self, line: str, t: Optional[float] = None) -> None:
+        "Adds a line received at time t (default now)"
+        with self.lock:
+            self.append_locked(line, t)
+
+    def append_locked(self, line: str, t: Optional[float]) -> None:
+        us = int((time.time() if t is None else t) * 1_000_000)
+        us = max(us, self.last_us) # keep timestamps in order if the clock steps back
+        self.last_us = us
+        (code, rest) = encode_prefix(line)
+        payload = rest.encode("utf-8")[:0xFFFF]
+        if self.data is None or self.size >= self.segment_size:
+            self.open_segment(us)
+        assert self.data is not None and self.index is not None
+        if self.count % INDEX_EVERY == 0:
+            self.index.write(INDEX.pack(us, self.size))
+        self.data.write(RECORD.pack(us, code, len(payload)))
+        self.data.write(payload)
+        self.size += RECORD.size + len(payload)
+        self.count += 1
+        self.unflushed += 1
+        if self.unflushed >= FLUSH_EVERY or time.monotonic() - self.flushed_at > FLUSH_INTERVAL:
+            self.flush_locked()
+        elif self.timer is None:
+            # a quiet receiver may send nothing more for a long time:
+            self.timer = threading.Timer(FLUSH_INTERVAL, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def on_line(self, line: str, _message: Optional[str]) -> None:
+        "events listener"
+        self.append(line)
+
+    def flush(self) -> None:
+        with self.lock:
+            self.flush_locked()
+
+    def flush_locked(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.data is not None and self.index is not None:
+            self.data.flush()
+            self.index.flush()
+        self.unflushed = 0
+        self.flushed_at = time.monotonic()
+
+    def close(self) -> None:
+        with self.lock:
+            self.close_locked()
+
+    def close_locked(self) -> None:
+        self.flush_locked()
+        if self.data is not None and self.index is not None:
+            self.data.close()
+            self.index.close()
+        self.data = None
+        self.index = None
+
+
+def read_index(path: str, size: int) -> list[tuple[int, int]]:
+    "The sparse index of a segment, without entries past its flushed data"
+    try:
+        with open(path[:-4] + ".idx", "rb") as f:
+            raw = f.read()
+    except OSError:
+        return []
+    raw = raw[:len(raw) - len(raw) % INDEX.size]
+    return [e for e in INDEX.iter_unpack(raw) if e[1] < size]
+
+def scan_segment(path: str, start_us: int, end_us: int,
+                 codes: Optional[set[int]]) -> Iterator[tuple[float, str]]:
+    "Records of one segment with start_us <= timestamp <= end_us"
+    size = os.path.getsize(path)
+    if size == 0:
+        return
+    index = read_index(path, size)
+    i = bisect.bisect_left(index, (start_us, -1)) - 1 # last entry before start_us
+    offset = index[i][1] if i >= 0 else 0
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        while offset + RECORD.size <= size:
+            (us, code, n) = RECORD.unpack_from(m, offset)
+            payload_at = offset + RECORD.size
+            offset = payload_at + n
+            if offset > size or us > end_us:
+                break # partly written record, or past the range
+            if us < start_us or (codes is not None and code not in codes):
+                continue
+            line = JOURNAL_PREFIXES[code] + m[payload_at:offset].decode("utf-8", errors="replace")
+            yield (us / 1_000_000, line)
+
+def query(folder: str, start: float = 0.0, end: Optional[float] = None,
+          prefixes: Optional[list[str]] = None) -> Iterator[tuple[float, str]]:
+    """(timestamp, line) for the lines received between start and end (seconds since
+    the epoch), optionally only those with the given prefixes (e.g. ["VOL", "FN"]).
+    Raises ValueError for a prefix that is not in JOURNAL_PREFIXES."""
+    if unknown := [p for p in prefixes or [] if p not in PREFIX_CODES]:
+        raise ValueError(f"unknown prefix {', '.join(unknown)}")
+    start_us = int(start * 1_000_000)
+    end_us = (1 << 64) - 1 if end is None else int(end * 1_000_000)
+    codes = None if prefixes is None else {PREFIX_CODES[p] for p in prefixes}
+    segments = list_segments(folder)
+    for (i, (first_us, path)) in enumerate(segments):
+        next_first = segments[i + 1][0] if i + 1 < len(segments) else None
+        if first_us > end_us or (next_first is not None and next_first < start_us):
+            continue
+        yield from scan_segment(path, start_us, end_us, codes)
+
+
+def parse_time(s: str) -> float:
+    "Seconds since the epoch, from a number or an ISO date/time"
+    try:
+        return float(s)
+    except ValueError:
+        from datetime import datetime # pylint: disable=import-outside-toplevel
+        return datetime.fromisoformat(s).timestamp()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('folder', help='journal folder')
+    parser.add_argument('--start', type=parse_time, default=0.0, help='epoch seconds or ISO time')
+    parser.add_argument('--end', type=parse_time, default=None, help='epoch seconds or ISO time')
+    parser.add_argument('prefixes', nargs='*', help='only lines with these prefixes, e.g. VOL FN')
+    args = parser.parse_args()
+    if unknown := [p for p in args.prefixes if p not in PREFIX_CODES or p == ""]:
+        parser.error(f"unknown prefix {', '.join(unknown)}; the journal knows "
+                     + " ".join(p for p in JOURNAL_PREFIXES if p))
+    for (t, l) in query(args.folder, args.start, args.end, args.prefixes or None):
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))}.{int(t * 1000) % 1000:03d} {l}")
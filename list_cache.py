@@ -0,0 +1,155 @@
+
+"""
+Client-side cache of network-source list pages (Internet Radio, Media Server, ...).
+Pages are built from the GDH (item range) and GEH (item) lines the AVR sends,
+keyed by source, list and first item, and evicted least-recently-used first.
+When a page arrives, the next one is fetched in the background, so that
+"display N" can usually be answered without a round trip.
+"""
+
+from collections import OrderedDict
+from typing import Callable, Optional
+import threading
+import time
+
+DEFAULT_CAPACITY = 64
+# give up on a background fetch that got no answer after this many seconds:
+PREFETCH_TIMEOUT = 5.0
+
+
+class ListPage:
+    """The raw GDH and GEH lines for one page of a list"""
+
+    def __init__(self, start: int, end: int, total: int, header: str, quiet: bool = False):
+        self.start = start
+        self.end = end
+        self.total = total
+        self.lines = [header]
+        self.quiet = quiet # fetched in the background, not shown
+
+    def complete(self) -> bool:
+        return len(self.lines) - 1 >= self.end - self.start + 1
+
+    def contains(self, n: int) -> bool:
+        return self.start <= n <= self.end
+
+
+class ListCache:
+    """LRU cache of list pages, fed with every line read from the AVR.
+    send_fn, if set, is used to prefetch the following page."""
+
+    def __init__(self, send_fn: Optional[Callable[[str], None]] = None,
+                 capacity: int = DEFAULT_CAPACITY):
+        self.send_fn = send_fn
+        self.capacity = capacity
+        self.pages: OrderedDict[tuple[Optional[str], Optional[str], int], ListPage] = OrderedDict()
+        self.source: Optional[str] = None # from GHH
+        self.list_id: Optional[str] = None # from GCH
+        self.page: Optional[ListPage] = None # page being received
+        self.avr_start: Optional[int] = None # first item of the page the AVR is on
+        self.view_start: Optional[int] = None # first item of the page the user is on
+        self.prefetch_start: Optional[int] = None
+        self.prefetch_time = 0.0
+        self.background = False # pages are being read for someone else (see crawler.py)
+        self.lock = threading.RLock() # the reader thread feeds while the prompt looks up
+
+    def key(self, start: int) -> tuple[Optional[str], Optional[str], int]:
+        return (self.source, self.list_id, start)
+
+    def feed(self, line: str) -> bool:
+        """Updates the cache with a line from the AVR.
+        Returns True if the line belongs to a background fetch (and should not be shown)."""
+        if self.prefetch_start is not None and time.monotonic() - self.prefetch_time > PREFETCH_TIMEOUT:
+            self.prefetch_start = None
+            if self.page is not None and self.page.quiet and not self.background:
+                self.page = None # half received: its missing lines are not coming
+        if line.startswith("GHH"):
+            self.source = line[3:]
+            return False
+        if line.startswith("GCH"):
+            self.list_id = line[3:]
+            return self.prefetch_start is not None or self.background
+        if line.startswith("GDH"):
+            r = line[3:]
+            if len(r) < 15 or not r.isdecimal():
+                return False
+            (start, end, total) = (int(r[0:5]), int(r[5:10]), int(r[10:15]))
+            quiet = start == self.prefetch_start or self.background
+            self.page = ListPage(start, end, total, line, quiet)
+            self.avr_start = start
+            if not quiet:
+                self.view_start = start
+            self.check_complete()
+            return quiet
+        if line.startswith("GEH") and self.page is not None:
+            page = self.page
+            page.lines.append(line)
+            self.check_complete()
+            return page.quiet
+        return False
+
+    def set_background(self, background: bool) -> None:
+        "While on, list pages are cached but not shown; when over, the user sees the AVR's page"
+        self.background = background
+        if not background:
+            self.view_start = self.avr_start
+
+    def check_complete(self) -> None:
+        with self.lock:
+            page = self.page
+            if page is None or not page.complete():
+                return
+            self.page = None
+            self.store(page)
+            if page.quiet:
+                self.prefetch_start = None
+            elif page.end < page.total:
+                self.prefetch(page.end + 1)
+
+    def store(self, page: ListPage) -> None:
+        with self.lock:
+            k = self.key(page.start)
+            self.pages[k] = page
+            self.pages.move_to_end(k)
+            while len(self.pages) > self.capacity:
+                self.pages.popitem(last=False)
+
+    def prefetch(self, start: int) -> None:
+        "Fetches the page starting at item start in the background, unless cached"
+        with self.lock:
+            if self.send_fn is None or self.key(start) in self.pages:
+                return
+            self.prefetch_start = start
+            self.prefetch_time = time.monotonic()
+            self.send_fn(f"{start:05}GCI")
+
+    def request(self, start: int) -> None:
+        "The user asked the AVR for the page starting at start: it is shown, even if being prefetched"
+        if self.prefetch_start == start:
+            self.prefetch_start = None
+
+    def lookup(self, n: int) -> Optional[ListPage]:
+        "The cached page of the current list starting at (or else containing) item n"
+        with self.lock:
+            page = self.pages.get(self.key(n))
+            if page is None:
+                for (k, p) in self.pages.items():
+                    if k[0:2] == (self.source, self.list_id) and p.contains(n):
+                        page = p
+                        break
+            if page is None:
+                return None
+            self.pages.move_to_end(self.key(page.start))
+            self.view_start = page.start
+            if page.end < page.total:
+                self.prefetch(page.end + 1)
+            return page
+
+    def select_codes(self, line_number: str) -> list[str]:
+        """Codes to select a line of the page the user is looking at;
+        moves the AVR back to that page first if a prefetch moved it away"""
+        codes = []
+        if self.view_start is not None and self.avr_start != self.view_start:
+            codes.append(f"{self.view_start:05}GCI")
+        codes.append(line_number.rjust(2, "0") + "GFI")
+        return codes
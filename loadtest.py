@@ -0,0 +1,297 @@
+
+"""
+Load and soak test: runs telnet.py's read loop against the simulated receiver
+(fake_avr.py) under a configurable workload, and reports what happened as JSON.
+
+Each session is a real connection with its own read_loop thread (decoding,
+report and print_lock included) and a writer thread sending commands from a
+mix at a steady rate. Meanwhile the receiver pushes unsolicited FL (display)
+and RGB (input name) lines to every session.
+
+    python3 loadtest.py --sessions 4 --rate 20 --event-rate 100 --duration 3600
+
+Reported:
+  throughput, p50/p99/max latency of commands (ms) from send to answer;
+  dropped: commands never answered; unmatched: answers when nothing of that
+  kind was pending (with several sessions, these include the other sessions'
+  answers, since the receiver sends every line to every connection);
+  errors: E04-style error lines;
+  events lost: pushed lines that some session never read;
+  rss: resident memory (KB) sampled over the run (the receiver runs in the same
+  process unless --host is given).
+"""
+
+from typing import Any, Optional
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import sys
+import telnetlib
+import threading
+import time
+
+import events
+import state
+import telnet
+from fake_avr import FakeAVR
+
+DEFAULT_MIX = ["?V", "VU", "VD", "?P", "?F", "05FN", "19FN", "?S"]
+# how long to wait for the last answers after the run, in seconds:
+DRAIN_TIME = 2.0
+
+def rss_kb() -> Optional[int]:
+    "Current resident memory of this process in KB, None where unknown"
+    try:
+        with open("/proc/self/statm", encoding='UTF-8') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # peak, not current
+    except ImportError:
+        return None
+
+def percentile(sorted_values: list[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[int(q * (len(sorted_values) - 1))]
+
+def fl_line(n: int) -> str:
+    "A display line, as sent while the front panel scrolls"
+    return "FL02" + f"LOAD {n % 100000000:08d} ".encode().hex().upper()
+
+
+class Session:
+    """One connection to the receiver: telnet.read_loop reading, a thread writing"""
+
+    def __init__(self, host: str, port: int, mix: list[str], rate: float):
+        self.tn = telnetlib.Telnet(host, port)
+        self.mix = mix
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.pending: dict[str, list[float]] = {}
+        self.latencies: list[float] = []
+        self.sent = 0
+        self.unmatched = 0
+        self.errors = 0
+        self.fl_lines = 0
+        self.reader = threading.Thread(target=self.read, daemon=True)
+        self.writer = threading.Thread(target=self.write, daemon=True)
+        self.stopping = threading.Event()
+
+    def read(self) -> None:
+        try:
+            telnet.read_loop(self.tn)
+        except (EOFError, OSError, ValueError):
+            pass # closed at the end of the run
+
+    def on_line(self, line: str) -> None:
+        "Called (on this session's reader thread) for every line read"
+        now = time.monotonic()
+        if line.startswith("FL"):
+            self.fl_lines += 1
+            return
+        if telnet.parse_error(line):
+            self.errors += 1
+            return
+        key = state.response_prefix(line)
+        if key is None:
+            return
+        with self.lock:
+            waiting = self.pending.get(key)
+            if not waiting:
+                self.unmatched += 1
+                return
+            self.latencies.append(now - waiting.pop(0))
+
+    def write(self) -> None:
+        period = 1.0 / self.rate
+        next_time = time.monotonic()
+        i = 0
+        while not self.stopping.is_set():
+            code = self.mix[i % len(self.mix)]
+            i += 1
+            key = state.expected_response(code)
+            with self.lock:
+                if key is not None:
+                    self.pending.setdefault(key, []).append(time.monotonic())
+                self.sent += 1
+            telnet.send(self.tn, code)
+            next_time += period
+            self.stopping.wait(max(0.0, next_time - time.monotonic()))
+
+    def close(self) -> None:
+        "Stops both threads and closes the connection"
+        self.stopping.set()
+        with contextlib.suppress(OSError):
+            self.tn.get_socket().shutdown(socket.SHUT_RDWR) # ends read_loop with EOFError
+        for t in (self.writer, self.reader):
+            if t.is_alive():
+                t.join(1.0)
+        self.tn.close()
+
+    def dropped(self) -> int:
+        with self.lock:
+            return sum(len(w) for w in self.pending.values())
+
+
+class Receiver:
+    """The simulated receiver, on its own event loop thread, pushing events at a rate"""
+
+    def __init__(self, event_rate: float):
+        self.avr = FakeAVR()
+        self.event_rate = event_rate
+        self.events_sent = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.emitter: Optional[asyncio.Future] = None
+
+    def start(self) -> int:
+        self.thread.start()
+        return asyncio.run_coroutine_threadsafe(self.avr.start(port=0), self.loop).result()
+
+    async def emit(self) -> None:
+        "Pushes FL lines (and now and then an RGB line) at event_rate per second"
+        start = time.monotonic()
+        while True:
+            due = int((time.monotonic() - start) * self.event_rate)
+            while self.events_sent < due:
+                n = self.events_sent
+                self.avr.broadcast(f"RGB{n % 60:02d}1INPUT {n % 60}" if n % 100 == 99 else fl_line(n))
+                self.events_sent += 1
+            await asyncio.sleep(0.01)
+
+    def start_events(self) -> None:
+        if self.event_rate > 0:
+            self.emitter = asyncio.run_coroutine_threadsafe(self.emit(), self.loop)
+
+    def stop_events(self) -> None:
+        if self.emitter is not None:
+            self.emitter.cancel()
+
+    async def shutdown(self) -> None:
+        await self.avr.stop()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+def run_load(sessions: int = 1, rate: float = 20.0, event_rate: float = 50.0,
+             duration: float = 10.0, sample: float = 1.0, mix: Optional[list[str]] = None,
+             host: Optional[str] = None, port: int = 0) -> dict[str, Any]:
+    "Runs the workload and returns the results; without host, starts a receiver here"
+    receiver = None
+    if host is None:
+        receiver = Receiver(event_rate)
+        port = receiver.start()
+        host = "127.0.0.1"
+    running = [Session(host, port, mix or DEFAULT_MIX, rate) for _ in range(sessions)]
+    by_reader = {s.reader: s for s in running}
+
+    def listener(line: str, _message: Optional[str]) -> None:
+        if s := by_reader.get(threading.current_thread()):
+            s.on_line(line)
+
+    rss: list[dict[str, Any]] = []
+    start = time.monotonic()
+
+    def take_sample() -> None:
+        rss.append({"t": round(time.monotonic() - start, 3), "rss_kb": rss_kb(),
+                    "sent": sum(s.sent for s in running),
+                    "answered": sum(len(s.latencies) for s in running)})
+
+    events.subscribe(listener)
+    try:
+        for s in running:
+            s.reader.start()
+        if receiver is not None:
+            receiver.start_events()
+        for s in running:
+            s.writer.start()
+        while (elapsed := time.monotonic() - start) < duration:
+            take_sample()
+            time.sleep(min(sample, max(0.0, duration - elapsed)))
+        for s in running:
+            s.stopping.set()
+            s.writer.join()
+        if receiver is not None:
+            receiver.stop_events()
+        elapsed = time.monotonic() - start
+        drain_end = time.monotonic() + DRAIN_TIME
+        while time.monotonic() < drain_end and any(s.dropped() for s in running):
+            time.sleep(0.05)
+        if receiver is not None:
+            while time.monotonic() < drain_end and any(s.fl_lines < receiver_fl(receiver) for s in running):
+                time.sleep(0.05)
+        take_sample()
+    finally:
+        events.unsubscribe(listener)
+        for s in running:
+            s.close()
+        if receiver is not None:
+            receiver.stop()
+    latencies = sorted(x for s in running for x in s.latencies)
+    result: dict[str, Any] = {
+        "config": {"sessions": sessions, "rate": rate, "event_rate": event_rate,
+                   "duration": duration, "mix": mix or DEFAULT_MIX},
+        "elapsed": round(elapsed, 3),
+        "sent": sum(s.sent for s in running),
+        "answered": len(latencies),
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+        "latency_ms": {q: (round(v * 1000, 3) if (v := percentile(latencies, p)) is not None else None)
+                       for (q, p) in (("p50", 0.5), ("p99", 0.99), ("max", 1.0))},
+        "dropped": sum(s.dropped() for s in running),
+        "unmatched": sum(s.unmatched for s in running),
+        "errors": sum(s.errors for s in running),
+        "rss": rss,
+    }
+    if receiver is not None:
+        expected = receiver_fl(receiver)
+        result["events_sent"] = receiver.events_sent
+        result["events_lost"] = sum(max(0, expected - s.fl_lines) for s in running)
+    return result
+
+def receiver_fl(receiver: Receiver) -> int:
+    "How many FL lines the receiver pushed (every 100th event is an RGB line)"
+    return receiver.events_sent - receiver.events_sent // 100
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test against the simulated receiver")
+    parser.add_argument('--sessions', type=int, default=1, help='concurrent connections (default 1)')
+    parser.add_argument('--rate', type=float, default=20.0, help='commands per second per session (default 20)')
+    parser.add_argument('--event-rate', type=float, default=50.0,
+                        help='unsolicited lines per second from the receiver (default 50)')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to run (default 10)')
+    parser.add_argument('--sample', type=float, default=1.0, help='seconds between memory samples (default 1)')
+    parser.add_argument('--mix', type=str, default=",".join(DEFAULT_MIX),
+                        help='comma-separated commands to cycle through')
+    parser.add_argument('--host', type=str, default=None,
+                        help='use a receiver already running there (no events are pushed then)')
+    parser.add_argument('--port', type=int, default=2323, help='port of the receiver given by --host')
+    parser.add_argument('--output', metavar='FILE', type=str, default=None,
+                        help='write the JSON results to FILE instead of stdout')
+    parser.add_argument('--show', action='store_true', help='print the decoded lines as telnet.py would')
+    args = parser.parse_args()
+
+    with open(os.devnull, "w", encoding='UTF-8') as devnull, \
+         (contextlib.nullcontext() if args.show else contextlib.redirect_stdout(devnull)):
+        results = run_load(args.sessions, args.rate, args.event_rate, args.duration, args.sample,
+                           args.mix.split(","), args.host, args.port)
+    if args.output:
+        with open(args.output, "w", encoding='UTF-8') as f:
+            json.dump(results, f, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+        print()
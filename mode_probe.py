@@ -0,0 +1,147 @@
+
+"""
+Which listening modes a receiver accepts ("probe modes").
+
+Not every mode in modes_set works on every receiver, or for every input
+signal: a 2-channel source allows other modes than a multichannel one.
+ModeProbe tries each mode code, a few at a time, and sorts them by the answer:
+the AVR confirms a mode it accepts with SR<code> (or the code of a related
+mode), and answers E02/E04, or stays in the mode it was in, otherwise.
+SR<code> settles that code; other answers come in order, so each one settles
+the oldest code still waiting, once the late answers of codes given up on
+are out of the way.
+
+ModeSupport keeps the results per receiver and per signal class in
+~/.pioneer_avr_modes.json, so that help, completion and "mode X" only offer
+the modes that work.
+"""
+
+from typing import Callable, Optional
+import json
+import os
+import threading
+import time
+
+import config
+import decoders
+
+report = config.report
+
+# mode codes sent before waiting for answers:
+PROBE_WINDOW = 4
+# how long to wait for the answer to a mode code, in seconds:
+ANSWER_TIMEOUT = 2.0
+
+mode_support_filename = os.path.expanduser("~/.pioneer_avr_modes.json")
+
+def signal_class(ast_line: Optional[str]) -> str:
+    "2ch, multi-ch or unknown, from the input channels of an AST line"
+    if not ast_line or not ast_line.startswith("AST"):
+        return "unknown"
+    (inputs, _) = decoders.ast_channels(ast_line[3:])
+    if not inputs:
+        return "unknown"
+    return "2ch" if len(inputs) <= 2 else "multi-ch"
+
+
+class ModeProbe:
+    """Sends mode codes with a few in flight, and records which were accepted (an events listener).
+    send_batch writes a list of codes at once."""
+
+    def __init__(self, send_batch: Callable[[list[str]], None], error_lines: set[str],
+                 window: int = PROBE_WINDOW, timeout: float = ANSWER_TIMEOUT):
+        self.send_batch = send_batch
+        self.error_lines = error_lines
+        self.window = window
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.pending: list[str] = []
+        self.results: dict[str, Optional[bool]] = {}
+        self.current: Optional[str] = None
+        self.late: dict[str, float] = {} # codes given up on -> until when their answer may come
+
+    def on_line(self, line: str, _message: Optional[str]) -> None:
+        if not (line.startswith("SR") or line in self.error_lines):
+            return
+        mode = line[2:] if line.startswith("SR") else None
+        with self.cond:
+            now = time.monotonic()
+            self.late = {c: t for (c, t) in self.late.items() if t > now}
+            if mode in self.late:
+                del self.late[mode]
+            elif mode in self.pending:
+                self.pending.remove(mode)
+                self.results[mode] = True
+            elif self.late:
+                del self.late[next(iter(self.late))] # the answer to the oldest code given up on
+            elif self.pending:
+                code = self.pending.pop(0)
+                # a mode that changes to a related one (cyclic modes) still works,
+                # but staying in an unknown mode cannot be told from it:
+                self.results[code] = (mode is not None and self.current is not None
+                                      and mode != self.current)
+            else:
+                return
+            if mode is not None:
+                self.current = mode
+            self.cond.notify_all()
+
+    def sweep(self, codes: list[str], restore: Optional[str] = None) -> dict[str, Optional[bool]]:
+        """Tries every mode code; True if accepted, False if not, None if unanswered.
+        Then goes back to the restore mode, if given."""
+        todo = list(codes)
+        with self.cond:
+            self.results = {}
+            self.current = restore
+            self.late = {}
+            while todo or self.pending:
+                batch = []
+                while todo and len(self.pending) + len(batch) < self.window:
+                    batch.append(todo.pop(0))
+                self.pending += batch
+                answered = len(self.results)
+                if batch:
+                    self.send_batch([c + "SR" for c in batch])
+                if not self.cond.wait_for(lambda: len(self.results) > answered, self.timeout):
+                    code = self.pending.pop(0)
+                    self.results[code] = None
+                    self.late[code] = time.monotonic() + self.timeout
+            results = dict(self.results)
+        if restore is not None:
+            self.send_batch([restore + "SR"])
+        return results
+
+
+class ModeSupport:
+    """Accepted mode codes by receiver and signal class, saved between runs"""
+
+    def __init__(self, receiver: str = ""):
+        self.receiver = receiver
+        self.matrix: dict[str, dict[str, dict]] = self.load()
+
+    def load(self) -> dict[str, dict[str, dict]]:
+        try:
+            with open(mode_support_filename, encoding='UTF-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self) -> None:
+        try:
+            with open(mode_support_filename, "w", encoding='UTF-8') as f:
+                json.dump(self.matrix, f, indent=1)
+        except OSError as ex:
+            report(f"Could not save mode support to {mode_support_filename}: {ex}")
+
+    def record(self, signal: str, results: dict[str, Optional[bool]]) -> None:
+        "Keeps the results of a sweep (unanswered codes are left out)"
+        self.matrix.setdefault(self.receiver, {})[signal] = {
+            "time": time.time(),
+            "accepted": sorted(c for (c, ok) in results.items() if ok),
+            "rejected": sorted(c for (c, ok) in results.items() if ok is False),
+        }
+
+    def rejected(self, signal: str) -> set[str]:
+        "Codes known not to work for signal on this receiver (none if never probed)"
+        entry = self.matrix.get(self.receiver, {}).get(signal)
+        return set(entry["rejected"]) if entry else set()
@@ -0,0 +1,183 @@
+
+"""
+Machine-readable output (telnet.py --output ndjson): one compact JSON object
+per line from the AVR, such as
+    {"t":1700000000.123,"raw":"VOL121","type":"volume","level":121,"db":-20.0}
+
+The fields are typed (numbers, booleans, lists), and built directly from the
+line, without going through the messages printed in text mode. Lines repeat a
+lot (display scrolling, AST/VST answers), so the encoded fields of a line are
+cached, except where they depend on the (learnable) input names.
+Output is written in batches: every FLUSH_EVERY lines, or FLUSH_INTERVAL
+seconds after the first unwritten one.
+"""
+
+from typing import Any, Callable, Optional, TextIO
+import functools
+import json
+import threading
+import time
+
+import decoders
+import presets
+import zones
+
+FLUSH_EVERY = 64
+FLUSH_INTERVAL = 0.25
+ENCODED_CACHE_SIZE = 256
+
+ENCODER = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+
+def number(s: str) -> Optional[int]:
+    return int(s) if s.isdecimal() else None
+
+def snake(name: str) -> str:
+    "'Input bit (HDMI only)' -> 'input_bit_hdmi_only'"
+    return "_".join("".join(c if c.isalnum() else " " for c in name.lower()).split())
+
+@functools.lru_cache(maxsize=None)
+def snake_cached(name: str) -> str:
+    return snake(name)
+
+def level_db(s: str, zero: int, steps: int) -> Optional[float]:
+    n = number(s)
+    return None if n is None else (n - zero) / steps
+
+def mode_fields(v: str) -> dict[str, Any]:
+    from modes_set import modeSetMap
+    return {"type": "mode", "code": v, "name": modeSetMap.get(v)}
+
+def listening_mode_fields(v: str) -> dict[str, Any]:
+    from modes_display import modeDisplayMap
+    name = modeDisplayMap.get(v)
+    return {"type": "listening_mode", "code": v, "name": name.strip() if name else None}
+
+def ast_fields(v: str) -> dict[str, Any]:
+    (inputs, outputs) = decoders.ast_channels(v)
+    return {"type": "audio", "signal": decoders.decode_ais(v[0:2]),
+            "frequency": decoders.decode_aif(v[2:4]),
+            "input_channels": list(inputs), "output_channels": list(outputs)}
+
+def vst_fields(v: str) -> dict[str, Any]:
+    fields: dict[str, Any] = {"type": "video"}
+    for (k, value) in decoders.vst_fields(v):
+        fields[snake_cached(k)] = value
+    return fields
+
+def onoff(kind: str, on_value: str) -> Callable[[str], dict[str, Any]]:
+    return lambda v: {"type": kind, "on": v == on_value}
+
+def tone_level(kind: str) -> Callable[[str], dict[str, Any]]:
+    # 06 is 0dB, and the level goes down as the number goes up:
+    return lambda v: {"type": kind, "db": None if (n := number(v)) is None else 6 - n}
+
+def display_fields(v: str) -> dict[str, Any]:
+    text = decoders.decode_fl("FL" + v)
+    return {"type": "display", "text": text.strip() if text is not None else None}
+
+# prefix -> function of the rest of the line; prefixes of 3 characters are tried first:
+FIELDS: dict[str, Callable[[str], dict[str, Any]]] = {
+    "PWR": onoff("power", "0"),
+    "VOL": lambda v: {"type": "volume", "level": number(v), "db": level_db(v, 161, 2)},
+    "MUT": onoff("mute", "0"),
+    "SR": mode_fields,
+    "LM": listening_mode_fields,
+    "FL": display_fields,
+    "AST": ast_fields,
+    "VST": vst_fields,
+    "TR": tone_level("treble"),
+    "BA": tone_level("bass"),
+    "TO": onoff("tone", "1"),
+    "ATW": onoff("loudness", "1"),
+    "ATC": onoff("eq", "1"),
+    "ATD": onoff("standing_wave", "1"),
+    "IS": lambda v: {"type": "phase_control", "value": number(v[:1])},
+    "ATE": lambda v: {"type": "phase_control_delay", "value": number(v)},
+    "VTC": lambda v: {"type": "video_resolution", "value": decoders.VTC_resolution_map.get(v)},
+    "PR": lambda v: {"type": "tuner_preset", "preset": presets.parse_preset(v)},
+    "FR": lambda v: {"type": "tuner_frequency", "frequency": presets.frequency(v)},
+    "TQ": lambda v: {"type": "tuner_preset_name", "name": (presets.tq_name("TQ" + v) or (None, ""))[1]},
+    "RGB": lambda v: {"type": "input_name", "id": v[0:2], "name": v[3:]},
+    "RGD": lambda v: {"type": "model", "value": v},
+    "SVB": lambda v: {"type": "mac_address", "value": v},
+    "SSI": lambda v: {"type": "software_version", "value": v},
+}
+
+def fields(line: str, input_name: Callable[[str], Optional[str]] = lambda i: None) -> dict[str, Any]:
+    "The typed fields of a line, including its type"
+    if line in decoders.ErrorMap:
+        return {"type": "error", "code": line, "message": decoders.ErrorMap[line]}
+    if line.startswith("FN"):
+        return {"type": "input", "id": line[2:], "name": input_name(line[2:])}
+    if parsed := zones.parse_line(line):
+        (zone, field, value) = parsed
+        if zone.name != "main":
+            z: dict[str, Any] = {"type": f"zone_{field}", "zone": zone.name}
+            if field == "volume":
+                z["db"] = zone.volume_db(value)
+            elif field == "input":
+                (z["id"], z["name"]) = (value, input_name(value))
+            else:
+                z["on"] = value == "0"
+            return z
+    for n in (3, 2):
+        if f := FIELDS.get(line[:n]):
+            return f(line[n:])
+    return {"type": "unknown"}
+
+def depends_on_inputs(line: str) -> bool:
+    "True for lines whose fields include an input name"
+    if line.startswith("FN"):
+        return True
+    parsed = zones.parse_line(line)
+    return parsed is not None and parsed[1] == "input"
+
+@functools.lru_cache(maxsize=ENCODED_CACHE_SIZE)
+def encoded_fields(line: str) -> str:
+    return ENCODER.encode({"raw": line, **fields(line)})
+
+def encode(line: str, t: float, input_name: Callable[[str], Optional[str]] = lambda i: None) -> str:
+    "One NDJSON line (without the newline) for a line received at time t"
+    if depends_on_inputs(line):
+        body = ENCODER.encode({"raw": line, **fields(line, input_name)})
+    else:
+        body = encoded_fields(line)
+    return f'{{"t":{t:.3f},{body[1:]}'
+
+
+class NdjsonWriter:
+    """Writes encoded lines to stream in batches (usable as an events listener)"""
+
+    def __init__(self, stream: TextIO, input_name: Callable[[str], Optional[str]] = lambda i: None):
+        self.stream = stream
+        self.input_name = input_name
+        self.lock = threading.Lock()
+        self.buffer: list[str] = []
+        self.timer: Optional[threading.Timer] = None
+
+    def on_line(self, line: str, _message: Optional[str] = None) -> None:
+        self.write(line)
+
+    def write(self, line: str, t: Optional[float] = None) -> None:
+        encoded = encode(line, time.time() if t is None else t, self.input_name)
+        with self.lock:
+            self.buffer.append(encoded)
+            if len(self.buffer) >= FLUSH_EVERY:
+                self.flush_locked()
+            elif self.timer is None:
+                self.timer = threading.Timer(FLUSH_INTERVAL, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self) -> None:
+        with self.lock:
+            self.flush_locked()
+
+    def flush_locked(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.buffer:
+            self.stream.write("\n".join(self.buffer) + "\n")
+            self.stream.flush()
+            self.buffer = []
@@ -0,0 +1,185 @@
+
+"""
+Outbound command queue that merges bursts: a command sent less than HOLD_TIME
+after the previous write is held briefly, and what accumulates is sent as its
+net effect in one write.
+
+  relative steps (VU/VD, TI/TD, BI/BD, zone volume steps) add up to one net
+  change: an absolute volume set when the current level is known, else the
+  remaining steps in one direction;
+  absolute sets of the same thing (05FN, 0010SR, 121VL, ...) keep only the last;
+  an absolute set also absorbs the steps before it, and the steps after it
+  are added to it.
+
+Any other command is a barrier: nothing is merged across it, so the order of,
+say, PO and VU is kept. Callers that need every code of a batch answered
+(probe modes, the preset sweep) use write_unmerged.
+"""
+
+from typing import Optional
+import threading
+import time
+
+import state
+import zones
+
+# commands closer together than this are merged, in seconds:
+HOLD_TIME = 0.05
+# a level reported by the AVR this soon after we set it may be stale, in seconds:
+SETTLE_TIME = 0.5
+
+# relative step code -> (response prefix, step):
+STEPS = {
+    "VU": ("VOL", 1), "VD": ("VOL", -1),
+    "TI": ("TR", 1), "TD": ("TR", -1),
+    "BI": ("BA", 1), "BD": ("BA", -1),
+}
+for z in zones.ZONES.values():
+    STEPS[z.volume[0]] = (z.volume[4], 1)
+    STEPS[z.volume[1]] = (z.volume[4], -1)
+
+# response prefix -> (up, down) step codes:
+STEP_CODES: dict[str, tuple[str, str]] = {}
+for (step_code, (step_key, step)) in STEPS.items():
+    (up, down) = STEP_CODES.get(step_key, ("", ""))
+    STEP_CODES[step_key] = (step_code, down) if step > 0 else (up, step_code)
+
+# response prefix -> (set suffix, digits, maximum), for the levels a step moves
+# by one unit and that can be set absolutely (the volumes):
+LEVELS = {z.volume[4]: (z.volume[2], z.volume[5], z.volume[8]) for z in zones.ZONES.values()}
+
+# response prefixes whose set commands (digits + suffix) only depend on the last one:
+LATEST_WINS = {"FN", "SR", "TR", "BA", "Z2F", "Z3F", "ZEA"} | set(LEVELS)
+
+def absolute_set(code: str) -> Optional[tuple[str, int]]:
+    "(response prefix, value) if code sets something absolutely (05FN, 121VL), else None"
+    key = state.expected_response(code)
+    if key not in LATEST_WINS or code in STEPS:
+        return None
+    digits = code[:len(code) - len(code.lstrip("0123456789"))]
+    if digits == "":
+        return None
+    return (key, int(digits))
+
+
+class Merge:
+    """The net effect of the commands for one response prefix within a burst"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.set_code: Optional[str] = None
+        self.value = 0
+        self.steps = 0
+        self.merged: list[str] = []
+
+    def codes(self, levels: dict[str, int]) -> list[str]:
+        "The codes to send; levels (e.g. {'VOL': 121}) is used and updated"
+        if self.key in LEVELS and (self.set_code is not None or self.key in levels):
+            (suffix, digits, maximum) = LEVELS[self.key]
+            base = self.value if self.set_code is not None else levels[self.key]
+            level = max(0, min(maximum, base + self.steps))
+            levels[self.key] = level
+            if len(self.merged) == 1 or (self.steps == 0 and self.set_code is not None):
+                return [self.merged[-1]] # nothing was merged away
+            if self.steps == 0:
+                return []
+            return [f"{level:0{digits}d}{suffix}"]
+        (up, down) = STEP_CODES.get(self.key, ("", ""))
+        steps = [up] * self.steps if self.steps > 0 else [down] * -self.steps
+        return ([self.set_code] if self.set_code is not None else []) + steps
+
+def compact(codes: list[str], levels: dict[str, int]) -> list[str]:
+    "The codes to send instead of codes, given the known levels (which are updated)"
+    items: list = [] # codes, and Merges where merged commands go
+    merges: dict[str, Merge] = {}
+    for code in codes:
+        if code in STEPS:
+            (key, step) = STEPS[code]
+        elif (a := absolute_set(code)) is not None:
+            (key, value) = a
+        else:
+            merges.clear() # a barrier
+            items.append(code)
+            continue
+        if (m := merges.get(key)) is None:
+            m = merges[key] = Merge(key)
+            items.append(m)
+        m.merged.append(code)
+        if code in STEPS:
+            m.steps += step
+        else:
+            (m.set_code, m.value, m.steps) = (code, value, 0) # latest wins
+    result: list[str] = []
+    for item in items:
+        result += item.codes(levels) if isinstance(item, Merge) else [item]
+    return result
+
+
+class OutboundQueue:
+    """Stands in for the connection (anything with write(bytes)), merging bursts.
+    Also an events listener, to learn the current levels from the AVR."""
+
+    def __init__(self, tn, hold: float = HOLD_TIME):
+        self.tn = tn
+        self.hold = hold
+        self.lock = threading.Lock()
+        self.pending: list[str] = []
+        self.levels: dict[str, int] = {}
+        self.set_at: dict[str, float] = {}
+        self.last_write = float("-inf")
+        self.timer: Optional[threading.Timer] = None
+        self.saved = 0 # commands not sent thanks to merging
+
+    def on_line(self, line: str, _message: Optional[str]) -> None:
+        key = state.response_prefix(line)
+        if key not in LEVELS or not line[len(key):].isdecimal():
+            return
+        with self.lock:
+            # while we are still changing it, our own idea of the level is newer:
+            if time.monotonic() - self.set_at.get(key, float("-inf")) > SETTLE_TIME:
+                self.levels[key] = int(line[len(key):])
+
+    def write(self, b: bytes) -> None:
+        codes = [c for c in b.decode().split("\r\n") if c]
+        with self.lock:
+            self.pending += codes
+            if self.timer is not None:
+                return # a flush is already due
+            wait = self.last_write + self.hold - time.monotonic()
+            if wait <= 0:
+                self.flush_locked()
+                return
+            self.timer = threading.Timer(wait, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def write_unmerged(self, b: bytes) -> None:
+        "Sends b now and as it is, after whatever is pending"
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self.flush_locked()
+            self.last_write = time.monotonic()
+            self.tn.write(b)
+
+    def flush(self) -> None:
+        "Sends what is pending now"
+        with self.lock:
+            self.timer = None
+            self.flush_locked()
+
+    def flush_locked(self) -> None:
+        if not self.pending:
+            return
+        before = dict(self.levels)
+        codes = compact(self.pending, self.levels)
+        now = time.monotonic()
+        for key in self.levels:
+            if self.levels[key] != before.get(key):
+                self.set_at[key] = now
+        self.saved += len(self.pending) - len(codes)
+        self.pending = []
+        self.last_write = now
+        if codes:
+            self.tn.write(b"".join(c.encode() + b"\r\n" for c in codes))
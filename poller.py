@@ -0,0 +1,121 @@
+
+"""
+Background status poller.
+Each field is polled at its own interval; the interval doubles (up to a maximum)
+while the field's value does not change, and goes back to the base interval when
+it does. A field that got an unsolicited update recently is not polled.
+All the queries that are due at the same time are sent in a single write.
+Answers that only repeat the cached value are quiet: the prompt does not show them.
+"""
+
+from typing import Callable, Optional
+import threading
+import time
+
+import state
+
+# how often the poller wakes up to check for due fields, in seconds:
+TICK = 0.5
+# interval growth factor for fields whose value did not change:
+BACKOFF = 2.0
+# lines arriving this soon after a poll are taken to be its answer, in seconds:
+ANSWER_TIME = 1.0
+
+
+class PollField:
+    """A status query polled at an adaptive interval"""
+
+    def __init__(self, name: str, query: str, base: float, maximum: float):
+        self.name = name
+        self.query = query
+        self.key = state.QUERY_RESPONSES[query]
+        self.base = base
+        self.maximum = maximum
+        self.interval = base
+        self.next_due = 0.0
+        self.polled_at: Optional[float] = None
+        self.last_value: Optional[str] = None
+
+    def __repr__(self):
+        return f"{self.name} ({self.query}) every {self.interval:.0f}s"
+
+# name, query, base interval, maximum interval (seconds):
+DEFAULT_FIELDS = [
+    ("power", "?P", 10, 120),
+    ("input", "?F", 10, 300),
+    ("volume", "?V", 5, 120),
+    ("audio", "?AST", 30, 600),
+    ("video", "?VST", 30, 600),
+    ("tone", "?TO", 60, 1800),
+    ("bass", "?BA", 60, 1800),
+    ("treble", "?TR", 60, 1800),
+    ("phase", "?IS", 60, 1800),
+]
+
+
+class Poller:
+    """Decides which status queries to send, using the cache to see what changed.
+    write_fn sends a list of queries in one write."""
+
+    def __init__(self, cache: state.StatusCache, write_fn: Callable[[list[str]], None],
+                 fields=None):
+        self.cache = cache
+        self.write_fn = write_fn
+        self.fields = [PollField(*f) for f in (fields or DEFAULT_FIELDS)]
+        self.lock = threading.Lock()
+        self.expected: dict[str, float] = {} # response prefix -> answer deadline
+
+    def quiet(self, line: str, now: Optional[float] = None) -> bool:
+        """True if line answers a poll and repeats the cached value.
+        Call before the line reaches the cache."""
+        key = state.response_prefix(line)
+        if key is None:
+            return False
+        with self.lock:
+            deadline = self.expected.pop(key, None)
+        if deadline is None or (time.monotonic() if now is None else now) > deadline:
+            return False
+        return self.cache.get(key) == line
+
+    def poll_once(self, now: float) -> list[str]:
+        "Sends the queries that are due at time now (monotonic); returns them"
+        due = []
+        for f in self.fields:
+            if f.next_due > now:
+                continue
+            line = self.cache.get(f.key)
+            changed = line != f.last_value
+            if changed:
+                f.interval = f.base
+                f.last_value = line
+            updated = self.cache.updated.get(f.key)
+            if (updated is not None and now - updated < f.interval
+                    and (f.polled_at is None or updated > f.polled_at + ANSWER_TIME)):
+                # fresh from an unsolicited update, check again later:
+                f.next_due = updated + f.interval
+                continue
+            if not changed and f.polled_at is not None:
+                f.interval = min(f.interval * BACKOFF, f.maximum)
+            due.append(f.query)
+            f.polled_at = now
+            f.next_due = now + f.interval
+        if due:
+            with self.lock:
+                for f in self.fields:
+                    if f.query in due:
+                        self.expected[f.key] = now + ANSWER_TIME
+            self.write_fn(due)
+        return due
+
+
+class PollThread(threading.Thread):
+    """ This thread runs a Poller until stopped """
+    def __init__(self, poller: Poller):
+        self.poller = poller
+        self.stopped = threading.Event()
+        threading.Thread.__init__(self, daemon=True)
+    def run(self):
+        while not self.stopped.wait(TICK):
+            self.poller.poll_once(time.monotonic())
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,210 @@
+
+"""
+Tuner preset catalog ("presets fetch", "preset <name|A1>").
+
+Presets are numbered by class (A to G) and number (01 to 09). The AVR selects
+one with A01PR, steps with TPI/TPD, and answers ?PR with PRA01, ?FR with the
+frequency (FRF08750 is FM 87.50MHz, FRA00540 is AM 540kHz) and ?TQ with the
+name of the current preset (TQA01"JAZZ FM ").
+
+PresetSweep selects every preset and asks its name and frequency, a few
+presets at a time, then goes back to the preset it started on. Answers come
+in order, so each one settles the oldest question still waiting. The catalog
+is kept per receiver in ~/.pioneer_avr_presets.json; "preset jazz" then
+selects a preset in one command, and "preset next" steps without asking the
+AVR where it is.
+"""
+
+from typing import Callable, Optional
+import json
+import os
+import threading
+import time
+
+import config
+
+report = config.report
+
+CLASSES = "ABCDEFG"
+ALL_PRESETS = [f"{c}{n:02d}" for c in CLASSES for n in range(1, 10)]
+
+# presets selected before waiting for their answers:
+SWEEP_WINDOW = 3
+# how long to wait for the answers to a preset, in seconds:
+ANSWER_TIMEOUT = 2.0
+
+presets_filename = os.path.expanduser("~/.pioneer_avr_presets.json")
+
+def parse_preset(s: str) -> Optional[str]:
+    "A01 for 'A1', 'a01' or 'A01'; None if not a preset"
+    s = s.strip().upper()
+    if len(s) in (2, 3) and s[0] in CLASSES and s[1:].isdecimal() and 1 <= int(s[1:]) <= 9:
+        return f"{s[0]}{int(s[1:]):02d}"
+    return None
+
+def frequency(value: str) -> Optional[str]:
+    "'FM 87.50MHz' for F08750, 'AM 540kHz' for A00540, None if not a frequency"
+    if len(value) < 2 or not value[1:].isdecimal():
+        return None
+    if value[0] == "F":
+        return f"FM {int(value[1:]) / 100:.2f}MHz"
+    if value[0] == "A":
+        return f"AM {int(value[1:])}kHz"
+    return None
+
+def tq_name(line: str) -> Optional[tuple[Optional[str], str]]:
+    "(preset if given, name) for a TQ line, None for other lines"
+    if not line.startswith("TQ"):
+        return None
+    v = line[2:]
+    preset = parse_preset(v[:3])
+    if preset:
+        v = v[3:]
+    return (preset, v.strip().strip('"').strip())
+
+def decode(line: str, catalog: Optional["PresetCatalog"] = None) -> Optional[str]:
+    "Readable version of a PR, FR or TQ line"
+    if line.startswith("PR") and (preset := parse_preset(line[2:])):
+        name = catalog.name(preset) if catalog else None
+        return f"Tuner preset {preset}" + (f" ({name})" if name else "")
+    if line.startswith("FR") and (f := frequency(line[2:])):
+        return f"Tuner frequency {f}"
+    if (tq := tq_name(line)) is not None:
+        return f"Tuner preset name {tq[1]}"
+    return None
+
+
+class PresetSweep:
+    """Selects presets with a few in flight, and records their names and frequencies
+    (an events listener). send_batch writes a list of codes at once.
+    Selecting a preset may bring an FR line of its own, so FR lines go to the
+    preset of the latest PR line, and a preset is done with its TQ answer (or
+    error), the last one asked."""
+
+    def __init__(self, send_batch: Callable[[list[str]], None], error_lines: set[str],
+                 window: int = SWEEP_WINDOW, timeout: float = ANSWER_TIMEOUT):
+        self.send_batch = send_batch
+        self.error_lines = error_lines
+        self.window = window
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.pending: list[str] = [] # presets in flight, oldest first
+        self.selected: set[str] = set() # ... whose PR line came
+        self.current: Optional[str] = None
+        self.results: dict[str, dict[str, Optional[str]]] = {}
+        self.done = 0
+
+    def on_line(self, line: str, _message: Optional[str]) -> None:
+        if not (line[:2] in ("PR", "FR", "TQ") or line in self.error_lines):
+            return
+        with self.cond:
+            if line.startswith("PR"):
+                self.current = parse_preset(line[2:])
+                if self.current in self.pending:
+                    self.selected.add(self.current)
+            elif line.startswith("FR"):
+                if self.current in self.pending:
+                    self.results[self.current]["frequency"] = frequency(line[2:])
+            elif self.pending:
+                oldest = self.pending[0]
+                if (tq := tq_name(line)) is not None:
+                    preset = tq[0] if tq[0] in self.pending else oldest
+                    self.results[preset]["name"] = tq[1]
+                    self.finish(preset)
+                else:
+                    if oldest not in self.selected:
+                        self.results[oldest]["error"] = line # not selected
+                    self.finish(oldest)
+                self.cond.notify_all()
+
+    def finish(self, preset: str) -> None:
+        "preset is done, and so are the ones sent before it"
+        while self.pending:
+            p = self.pending.pop(0)
+            self.done += 1
+            if p == preset:
+                break
+
+    def sweep(self, presets: list[str], restore: Optional[str] = None) -> dict[str, dict[str, Optional[str]]]:
+        """Name and frequency of each preset ({} for one that did not answer).
+        Then goes back to the restore preset, if given."""
+        todo = list(presets)
+        with self.cond:
+            self.results = {p: {} for p in presets}
+            (self.done, self.selected, self.current) = (0, set(), None)
+            while todo or self.pending:
+                codes = []
+                while todo and len(self.pending) < self.window:
+                    preset = todo.pop(0)
+                    codes += [f"{preset}PR", "?FR", "?TQ"]
+                    self.pending.append(preset)
+                done = self.done
+                if codes:
+                    self.send_batch(codes)
+                if not self.cond.wait_for(lambda: self.done > done, self.timeout):
+                    self.finish(self.pending[0])
+            results = self.results
+        if restore is not None:
+            self.send_batch([f"{restore}PR"])
+        return results
+
+
+class PresetCatalog:
+    """Names and frequencies of the tuner presets by receiver, saved between runs"""
+
+    def __init__(self, receiver: str = ""):
+        self.receiver = receiver
+        self.all: dict[str, dict] = self.load()
+
+    def load(self) -> dict[str, dict]:
+        try:
+            with open(presets_filename, encoding='UTF-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self) -> None:
+        try:
+            with open(presets_filename, "w", encoding='UTF-8') as f:
+                json.dump(self.all, f, indent=1)
+        except OSError as ex:
+            report(f"Could not save tuner presets to {presets_filename}: {ex}")
+
+    def presets(self) -> dict[str, dict]:
+        "preset -> {'name': ..., 'frequency': ...} for this receiver, in preset order"
+        return self.all.get(self.receiver, {}).get("presets", {})
+
+    def record(self, results: dict[str, dict[str, Optional[str]]]) -> None:
+        "Keeps the results of a sweep (presets without a frequency are left out)"
+        self.all[self.receiver] = {
+            "time": time.time(),
+            "presets": {p: {"name": r.get("name") or "", "frequency": r["frequency"]}
+                        for (p, r) in sorted(results.items()) if r.get("frequency")},
+        }
+
+    def name(self, preset: str) -> Optional[str]:
+        return self.presets().get(preset, {}).get("name") or None
+
+    def find(self, text: str) -> Optional[str]:
+        "The preset for 'A1', a name, or the start of just one name; None if none"
+        if preset := parse_preset(text):
+            return preset
+        text = text.strip().lower()
+        named = [(p, (e.get("name") or "").lower()) for (p, e) in self.presets().items()]
+        if exact := [p for (p, n) in named if n == text]:
+            return exact[0]
+        starting = [p for (p, n) in named if text and n.startswith(text)]
+        return starting[0] if len(starting) == 1 else None
+
+    def step(self, current: Optional[str], step: int) -> Optional[str]:
+        "The preset step (1 or -1) away from current, None if not known"
+        known = list(self.presets())
+        if not known:
+            return None
+        if current not in known:
+            return known[0] if step > 0 else known[-1]
+        return known[(known.index(current) + step) % len(known)]
+
+    def describe(self) -> list[str]:
+        return [f"{p}  {e['frequency']:<14} {e.get('name') or ''}".rstrip()
+                for (p, e) in self.presets().items()]
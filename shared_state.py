@@ -0,0 +1,204 @@
+#!/usr/bin/python3
+
+"""
+The receiver's current power, volume, mute, input and mode in a small
+memory-mapped file, so that other local programs (status bars, web pages,
+automation) can read it without a connection of their own.
+
+The file has a fixed layout:
+  header: magic, layout version (uint32), sequence number (uint64)
+  body (BODY): update time, power, mute, volume, input, mode and listening mode
+The writer (telnet.py --shared-state) makes the sequence number odd while it
+changes the body, and even again when done. A reader copies the body between
+two reads of the sequence number, and keeps the copy only if both are the same
+even number (a seqlock): no locks, and nothing is sent to the receiver.
+
+There is one file per receiver, default_path(HOST:PORT) unless given.
+Read from the command line with:
+  python3 shared_state.py [FILE | HOST[:PORT]]
+(no argument is fine when there is only one receiver), or from Python with
+shared_state.read(FILE), or a StateReader for repeated reads.
+"""
+
+from typing import Any, Callable, Optional
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+MAGIC = b"PAVR"
+LAYOUT_VERSION = 1
+HEADER = struct.Struct("<4sIQ")
+SEQUENCE = struct.Struct("<Q")
+SEQUENCE_OFFSET = 8
+# update time, connected, power, mute, volume (-1 unknown), input, input name,
+# mode (SR) code and name, listening mode (LM) code and name:
+BODY = struct.Struct("<dbbbh2s32s4s32s4s32s")
+SIZE = HEADER.size + BODY.size
+
+# attempts at a consistent copy before giving up (the writer died mid-update):
+READ_ATTEMPTS = 1000
+
+STATE_FOLDER = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+FILE_PREFIX = "pioneer_avr_state_"
+
+def default_path(receiver: str) -> str:
+    "The state file of a receiver (host:port), so that sessions to different ones do not mix"
+    if ":" not in receiver:
+        receiver += ":23"
+    return os.path.join(STATE_FOLDER, FILE_PREFIX + receiver.replace(":", "_").replace(os.sep, "_"))
+
+def existing_paths() -> list[str]:
+    "The state files of every receiver, in STATE_FOLDER"
+    return sorted(os.path.join(STATE_FOLDER, n) for n in os.listdir(STATE_FOLDER) if n.startswith(FILE_PREFIX))
+
+def text(b: bytes) -> str:
+    return b.rstrip(b"\0").decode("utf-8", "replace")
+
+def fixed(s: Optional[str], size: int) -> bytes:
+    "s in UTF-8, cut to size bytes (without splitting a character)"
+    return (s or "").encode("utf-8")[:size].decode("utf-8", "ignore").encode("utf-8")
+
+def flag(b: int) -> Optional[bool]:
+    return None if b < 0 else b == 1
+
+
+class StateWriter:
+    """Keeps the shared state file up to date (an events listener).
+    input_name gives the name of an input number, None if unknown."""
+
+    def __init__(self, path: str, input_name: Callable[[str], Optional[str]] = lambda i: None):
+        self.path = path
+        self.input_name = input_name
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.values: dict[str, Any] = {
+            "updated": 0.0, "connected": 1, "power": -1, "mute": -1, "volume": -1,
+            "input": "", "input_name": "", "mode": "", "mode_name": "",
+            "listening_mode": "", "listening_mode_name": "",
+        }
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, SIZE)
+            self.map = mmap.mmap(fd, SIZE)
+        finally:
+            os.close(fd)
+        self.publish()
+
+    def on_line(self, line: str, _message: Optional[str]) -> None:
+        if changes := self.parse(line):
+            with self.lock:
+                self.values.update(changes)
+                self.publish()
+
+    def parse(self, line: str) -> Optional[dict[str, Any]]:
+        "The values that line changes, None if none"
+        if line in ("PWR0", "PWR1"):
+            return {"power": int(line == "PWR0")}
+        if line in ("MUT0", "MUT1"):
+            return {"mute": int(line == "MUT0")}
+        if line.startswith("VOL") and line[3:].isdecimal():
+            return {"volume": int(line[3:])}
+        if line.startswith("FN") and line[2:].isdecimal():
+            return {"input": line[2:4], "input_name": self.input_name(line[2:4]) or ""}
+        if line.startswith("RGB") and line[3:5] == self.values["input"]:
+            return {"input_name": self.input_name(line[3:5]) or ""} # may have been learned
+        if line.startswith("SR") and line[2:].isdecimal():
+            from modes_set import modeSetMap
+            return {"mode": line[2:6], "mode_name": modeSetMap.get(line[2:], "")}
+        if line.startswith("LM") and len(line) > 2:
+            from modes_display import modeDisplayMap
+            return {"listening_mode": line[2:6], "listening_mode_name": modeDisplayMap.get(line[2:], "").strip()}
+        return None
+
+    def inputs_learned(self, names: dict[str, str]) -> None:
+        "Picks up the name of the current input if it is among names (id -> name) just learned"
+        with self.lock:
+            if (name := names.get(self.values["input"])) is not None and name != self.values["input_name"]:
+                self.values["input_name"] = name
+                self.publish()
+
+    def publish(self) -> None:
+        "Writes the values into the file, between two sequence number updates"
+        v = self.values
+        v["updated"] = time.time()
+        body = BODY.pack(v["updated"], v["connected"], v["power"], v["mute"], v["volume"],
+                         fixed(v["input"], 2), fixed(v["input_name"], 32),
+                         fixed(v["mode"], 4), fixed(v["mode_name"], 32),
+                         fixed(v["listening_mode"], 4), fixed(v["listening_mode_name"], 32))
+        self.sequence += 1 # odd: being written
+        SEQUENCE.pack_into(self.map, SEQUENCE_OFFSET, self.sequence)
+        self.map[HEADER.size:SIZE] = body
+        self.sequence += 1
+        HEADER.pack_into(self.map, 0, MAGIC, LAYOUT_VERSION, self.sequence)
+
+    def close(self) -> None:
+        "Marks the state as no longer kept up to date (at exit)"
+        with self.lock:
+            self.values["connected"] = 0
+            self.publish()
+
+
+class StateReader:
+    """Reads the shared state file; keeps it mapped between reads"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), SIZE, access=mmap.ACCESS_READ)
+
+    def read(self) -> Optional[dict[str, Any]]:
+        "The current state, None if not written (yet) or no consistent copy could be made"
+        for attempt in range(READ_ATTEMPTS):
+            (magic, version, before) = HEADER.unpack_from(self.map, 0)
+            if magic != MAGIC or version != LAYOUT_VERSION:
+                return None
+            if before % 2 == 0:
+                body = self.map[HEADER.size:SIZE]
+                if SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0] == before:
+                    return decode(body)
+            if attempt % 100 == 99:
+                time.sleep(0.001) # let the writer finish
+        return None
+
+    def close(self) -> None:
+        self.map.close()
+
+def decode(body: bytes) -> dict[str, Any]:
+    (updated, connected, power, mute, volume, input_code, input_name,
+     mode, mode_name, listening_mode, listening_mode_name) = BODY.unpack(body)
+    return {
+        "updated": updated,
+        "connected": connected == 1,
+        "power": flag(power),
+        "mute": flag(mute),
+        "volume": None if volume < 0 else volume,
+        "volume_db": None if volume < 0 else (volume - 161) / 2,
+        "input": text(input_code) or None,
+        "input_name": text(input_name) or None,
+        "mode": text(mode) or None,
+        "mode_name": text(mode_name) or None,
+        "listening_mode": text(listening_mode) or None,
+        "listening_mode_name": text(listening_mode_name) or None,
+    }
+
+def read(path: str) -> Optional[dict[str, Any]]:
+    "The current state in the file at path (see StateReader.read)"
+    reader = StateReader(path)
+    try:
+        return reader.read()
+    finally:
+        reader.close()
+
+if __name__ == "__main__":
+    import json
+    import sys
+    if len(sys.argv) > 1:
+        state_path = sys.argv[1] if os.path.isfile(sys.argv[1]) else default_path(sys.argv[1])
+    elif len(paths := existing_paths()) == 1:
+        state_path = paths[0]
+    else:
+        sys.exit(f"usage: {sys.argv[0]} FILE | HOST[:PORT]"
+                 + (f"; state files: {' '.join(paths)}" if paths else f"; no state files in {STATE_FOLDER}"))
+    print(json.dumps(read(state_path), indent=1))
@@ -1,8 +1,9 @@
 
 import json
 import os
+import threading
 
-from typing import Optional
+from typing import Callable, Optional
 
 # Default set. To read query the AVR's actual names and save to json, use "learn":
 
@@ -45,29 +46,88 @@ def check_exists(s: str) -> Optional[str]:
 
 sources_map_filename = "pioneer_avr_sources.json"
 
+def find_map_file() -> Optional[str]:
+    """The sources map file to read: in the current folder, else in the home folder"""
+    curr = os.path.join(os.getcwd(), sources_map_filename)
+    return check_exists(curr) or check_exists(os.path.expanduser(f"~/{sources_map_filename}"))
+
+# a learned name is published right away, and the names learned in the next
+# LEARN_BATCH_TIME seconds together after it (the "learn" command gets 60 in a burst):
+LEARN_BATCH_TIME = 0.1
+
+class Snapshot:
+    """The sources, commands and aliases at one point in time. Never changed once
+    published, so it can be read from any thread without locking."""
+
+    def __init__(self, source_map: dict[str, str], inverse_map: dict[str, str],
+                 aliases: tuple[tuple[str, str], ...]):
+        self.source_map = source_map
+        self.inverse_map = inverse_map
+        self.aliases = aliases
+        self.alias_map = {a: b for (x, y) in aliases for (a, b) in ((x, y), (y, x))}
+
+def build(base: Snapshot, updates: Optional[dict[str, str]] = None,
+          aliases: tuple[tuple[str, str], ...] = ()) -> Snapshot:
+    "A new snapshot: base with sources updated (id -> name) and aliases added"
+    updates = updates or {}
+    source_map = {**base.source_map, **updates}
+    inverse_map = dict(base.inverse_map)
+    for (k, v) in updates.items():
+        inverse_map[v.lower()] = k + "FN"
+    all_aliases = base.aliases + aliases
+    for (a, b) in all_aliases:
+        # an alias gets the command of its other name, if it has none of its own:
+        if inverse_map.get(a) is None and inverse_map.get(b):
+            inverse_map[a] = inverse_map[b]
+        elif inverse_map.get(b) is None and inverse_map.get(a):
+            inverse_map[b] = inverse_map[a]
+    return Snapshot(source_map, inverse_map, all_aliases)
+
+DEFAULT_ALIASES = (("apple", "appletv"), ("amazon", "amazontv"), ("radio", "tuner"),
+                   ("iradio", "internet radio"))
+
 class SourceMap:
+    """Input names and the commands selecting them. Changes publish a new Snapshot
+    by swapping one reference: readers (write_loop, help, completion) always see
+    a consistent one, and learned names are applied in batches.
+    on_learned, if set, is called with the names (id -> name) of each batch once published."""
 
     def __init__(self):
-        self.source_map = {}
-        self.inverse_map = {}
-        self.alias_map = {}
+        self.snapshot = Snapshot({}, {}, ())
+        self.lock = threading.Lock() # for writers only
+        self.pending: dict[str, str] = {}
+        self.unsaved: dict[str, str] = {} # learned names not written to the file yet
+        self.timer: Optional[threading.Timer] = None
+        self.on_learned: Optional[Callable[[dict[str, str]], None]] = None
+        self.successor: Optional["SourceMap"] = None # the map that replaced this one
         self.init_from_map(defaultInputSourcesMap)
 
+    @property
+    def source_map(self) -> dict[str, str]:
+        return self.snapshot.source_map
+
+    @property
+    def inverse_map(self) -> dict[str, str]:
+        return self.snapshot.inverse_map
+
+    @property
+    def alias_map(self) -> dict[str, str]:
+        return self.snapshot.alias_map
+
     def init_from_map(self, initmap):
-        for (k,v) in initmap.items():
-            self.source_map[k] = v
-            self.register_reverse_source(k, v)
         # the value here is the command for changing to the source given by the key
-        self.add_aliases()
+        self.publish(updates=initmap, aliases=DEFAULT_ALIASES)
+
+    def publish(self, updates: Optional[dict[str, str]] = None, aliases: tuple[tuple[str, str], ...] = ()) -> None:
+        with self.lock:
+            self.snapshot = build(self.snapshot, updates, aliases)
 
     def get(self, *args, **kwargs):
-        return self.source_map.get(*args, **kwargs)
+        return self.snapshot.source_map.get(*args, **kwargs)
 
     def read_from_file(self) -> None:
         """Reads sources map from JSON file""" 
-        cwd: str = os.getcwd()
-        curr = os.path.join(cwd, sources_map_filename)
-        map_file = check_exists(curr) or check_exists(os.path.expanduser(f"~/{sources_map_filename}"))
+        map_file = find_map_file()
         if map_file:
             read_map = {}
             print(f"Reading sources map from {map_file}")
@@ -82,47 +142,75 @@ class SourceMap:
 
     def save_to_file(self):
         """Save sources map to a JSON file"""
+        self.flush()
         with open(sources_map_filename, "w", encoding='UTF-8') as outfile:
             json.dump(self.source_map, outfile)
+        self.unsaved = {}
         print(f"Wrote sources map to {sources_map_filename}")
 
-    def register_reverse_source(self, k: str, v):
-        newk = v.lower()
-        self.inverse_map[newk] = k + "FN"
+    def keep_learned(self, old: "SourceMap") -> None:
+        """Carries over the names that old learned but did not save, including those
+        still pending, and its on_learned (when the file is reloaded).
+        Names old is asked to learn from then on are passed on to this map."""
+        self.on_learned = old.on_learned
+        with old.lock:
+            if old.timer is not None:
+                old.timer.cancel()
+                old.timer = None
+            learned = old.publish_pending()
+            if old.unsaved:
+                self.publish(updates=old.unsaved)
+                self.unsaved.update(old.unsaved)
+            old.successor = self
+        if learned and self.on_learned is not None:
+            self.on_learned(learned)
 
     def update_source(self, name: str, source_id: str):
         print(f"Updating source {name} ({source_id})")
-        self.source_map[source_id] = name
-        self.register_reverse_source(source_id, name)
-        alias = self.alias_map.get(name)
-        if alias:
-            self.check_aliases(name, alias)
+        self.publish(updates={source_id: name})
 
     def add_alias(self, a: str, b: str):
-        a = a.lower()
-        b = b.lower()
-        self.alias_map[a] = b
-        self.alias_map[b] = a
-        self.check_aliases(a,b)
-
-    def check_aliases(self, a: str, b:str):
-        if self.inverse_map.get(a) is None and self.inverse_map.get(b):
-            self.inverse_map[a] = self.inverse_map[b]
-            # print(f"{a} -> {b}")
-        else:
-            if self.inverse_map.get(b) is None and self.inverse_map.get(a):
-                self.inverse_map[b] = self.inverse_map[a]
-                # print(f"{b} -> {a}")
-
-    def add_aliases(self):
-        self.add_alias("apple", "appletv")
-        self.add_alias("amazon", "amazontv")
-        self.add_alias("radio", "tuner")
-        self.add_alias("iradio", "internet radio")
+        self.publish(aliases=((a.lower(), b.lower()),))
 
     def learn_input_from(self, s):
+        """Learns a name from an RGB answer. It is published at once, unless it
+        follows another one closely: then with the rest of the burst, within LEARN_BATCH_TIME"""
         source_id = s[0:2]
         name = s[3:]
-        if self.source_map.get(source_id, None) != name:
-            print(f"Updating source name {name} for {source_id}")
-            self.update_source(name, source_id)
+        with self.lock:
+            successor = self.successor
+            if successor is None:
+                if self.pending.get(source_id, self.snapshot.source_map.get(source_id)) == name:
+                    return
+                print(f"Updating source name {name} for {source_id}")
+                self.pending[source_id] = name
+                if self.timer is not None:
+                    return # in a burst
+                learned = self.publish_pending()
+                self.timer = threading.Timer(LEARN_BATCH_TIME, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if successor is not None:
+            successor.learn_input_from(s) # read by the reader thread before the swap
+            return
+        if self.on_learned is not None:
+            self.on_learned(learned)
+
+    def flush(self) -> None:
+        "Publishes the learned names now"
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            learned = self.publish_pending()
+        if learned and self.on_learned is not None:
+            self.on_learned(learned)
+
+    def publish_pending(self) -> dict[str, str]:
+        "Publishes the pending names (with the lock held); returns them"
+        learned = self.pending
+        if learned:
+            self.snapshot = build(self.snapshot, learned)
+            self.unsaved.update(learned)
+            self.pending = {}
+        return learned
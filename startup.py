@@ -0,0 +1,133 @@
+
+"""
+Startup sequence: wakes the AVR and holds back commands until it answers.
+
+A receiver coming out of standby ignores what it is sent for a moment, so the
+wake query (?P) is repeated with a short, growing delay until a PWR line comes
+back. Until then, writes are queued; they are released in one write as soon as
+the AVR is ready (or, at the latest, when waking gives up).
+
+The time from the first wake query to the first answer is kept per receiver
+in ~/.pioneer_avr_startup.json.
+"""
+
+from typing import Optional
+import json
+import os
+import threading
+import time
+
+import config
+
+report = config.report
+
+# delays between wake queries, in seconds (the last one repeats):
+WAKE_DELAYS = (0.1, 0.2, 0.4, 0.8, 1.0)
+# queued commands are released after this long even without an answer, in seconds:
+WAKE_TIMEOUT = 10.0
+# times to ready kept per receiver:
+KEEP_TIMES = 20
+
+startup_times_filename = os.path.expanduser("~/.pioneer_avr_startup.json")
+
+WAKING = "waking"
+READY = "ready"
+GAVE_UP = "gave up"
+
+
+class Startup:
+    """Stands in for the connection while the AVR wakes up (an events listener).
+    tn is anything with a write(bytes) method; receiver names the AVR (host:port)."""
+
+    def __init__(self, tn, receiver: str = "", timeout: float = WAKE_TIMEOUT):
+        self.tn = tn
+        self.receiver = receiver
+        self.timeout = timeout
+        self.state = WAKING
+        self.cond = threading.Condition()
+        self.queued: list[bytes] = []
+        self.started: Optional[float] = None
+        self.time_to_ready: Optional[float] = None
+        self.attempts = 0
+
+    def write(self, b: bytes) -> None:
+        "Writes b to the AVR, or queues it until the AVR is ready"
+        with self.cond:
+            if self.state == WAKING:
+                self.queued.append(b)
+                return
+        self.tn.write(b)
+
+    def release(self, new_state: str) -> None:
+        "Leaves the waking state, sending the queued writes at once"
+        with self.cond:
+            if self.state != WAKING:
+                return
+            self.state = new_state
+            if self.started is not None and new_state == READY:
+                self.time_to_ready = time.monotonic() - self.started
+            queued = b"".join(self.queued)
+            self.queued = []
+            # written under the lock, so that later writes cannot overtake these:
+            if queued:
+                self.tn.write(queued)
+            self.cond.notify_all()
+
+    def on_line(self, line: str, _message: Optional[str]) -> None:
+        "events listener; the first PWR line means the AVR is listening"
+        if self.state == WAKING and line.startswith("PWR"):
+            self.release(READY)
+
+    def wake(self) -> Optional[float]:
+        "Sends wake queries until the AVR answers; returns the time to ready, None if it never did"
+        self.started = time.monotonic()
+        deadline = self.started + self.timeout
+        with self.cond:
+            while self.state == WAKING:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                self.tn.write(b"?P\r\n")
+                delay = WAKE_DELAYS[min(self.attempts, len(WAKE_DELAYS) - 1)]
+                self.attempts += 1
+                self.cond.wait(min(delay, deadline - now))
+        if self.state == WAKING:
+            report(f"No answer from the AVR after {self.timeout:.0f}s, sending commands anyway")
+            self.release(GAVE_UP)
+            return None
+        if self.time_to_ready is not None:
+            if config.DEBUG:
+                report(f"AVR ready after {self.time_to_ready * 1000:.0f}ms ({self.attempts} wake queries)")
+            record_time(self.receiver, self.time_to_ready)
+        return self.time_to_ready
+
+    def start(self) -> threading.Thread:
+        "Wakes the AVR in the background"
+        t = threading.Thread(target=self.wake, daemon=True)
+        t.start()
+        return t
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        "Blocks until the AVR is ready (or waking gave up); True if ready"
+        with self.cond:
+            self.cond.wait_for(lambda: self.state != WAKING, timeout)
+            return self.state == READY
+
+
+def load_times() -> dict[str, list[float]]:
+    "Recorded times to ready (seconds), by receiver"
+    try:
+        with open(startup_times_filename, encoding='UTF-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def record_time(receiver: str, seconds: float) -> None:
+    "Adds a time to ready for receiver, keeping the latest KEEP_TIMES"
+    times = load_times()
+    times[receiver] = (times.get(receiver, []) + [round(seconds, 4)])[-KEEP_TIMES:]
+    try:
+        with open(startup_times_filename, "w", encoding='UTF-8') as f:
+            json.dump(times, f)
+    except OSError as ex:
+        report(f"Could not save startup times to {startup_times_filename}: {ex}")
@@ -0,0 +1,129 @@
+
+"""
+Cache of the latest status lines received from the AVR.
+Lines are keyed by their response prefix (PWR, VOL, FN, ...), so that
+read-only queries (?P, ?V, ?F, ...) can be answered without asking the AVR.
+"""
+
+from typing import Optional
+import time
+
+# query -> prefix of the line the AVR answers with:
+QUERY_RESPONSES = {
+    "?P": "PWR",
+    "?V": "VOL",
+    "?M": "MUT",
+    "?F": "FN",
+    "?BA": "BA",
+    "?TR": "TR",
+    "?TO": "TO",
+    "?L": "LM",
+    "?S": "SR",
+    "?AST": "AST",
+    "?VST": "VST",
+    "?VTC": "VTC",
+    "?IS": "IS",
+    "?ATW": "ATW",
+    "?ATC": "ATC",
+    "?ATD": "ATD",
+    "?ATE": "ATE",
+    "?RGD": "RGD",
+    "?SVB": "SVB",
+    "?SSI": "SSI",
+    "?PR": "PR",
+    "?FR": "FR",
+    # Zone 2, Zone 3 and HDZone power, volume, mute and input:
+    "?AP": "APR", "?ZV": "ZV", "?Z2M": "Z2M", "?ZS": "Z2F",
+    "?BP": "BPR", "?YV": "YV", "?Z3M": "Z3M", "?ZT": "Z3F",
+    "?ZEP": "ZEP", "?HZV": "XV", "?HZM": "HZM", "?ZEA": "ZEA",
+}
+
+RESPONSE_PREFIXES = set(QUERY_RESPONSES.values())
+
+# response prefix -> the query that asks for it:
+RESPONSE_QUERIES = {v: k for (k, v) in QUERY_RESPONSES.items()}
+
+# command suffix (after any digits) -> prefix of the line the AVR answers with:
+SET_RESPONSES = {
+    "PO": "PWR", "PF": "PWR", "PZ": "PWR",
+    "VU": "VOL", "VD": "VOL", "VL": "VOL",
+    "MO": "MUT", "MF": "MUT", "MZ": "MUT",
+    "FN": "FN", "FU": "FN", "FD": "FN",
+    "SR": "SR",
+    "TI": "TR", "TD": "TR", "TR": "TR",
+    "BI": "BA", "BD": "BA", "BA": "BA",
+    "TO": "TO",
+    "TPI": "PR", "TPD": "PR",
+    "ATW": "ATW", "ATC": "ATC", "ATD": "ATD", "ATE": "ATE",
+    "APO": "APR", "APF": "APR", "ZU": "ZV", "ZD": "ZV", "ZV": "ZV", "ZS": "Z2F",
+    "Z2MO": "Z2M", "Z2MF": "Z2M",
+    "BPO": "BPR", "BPF": "BPR", "YU": "YV", "YD": "YV", "YV": "YV", "ZT": "Z3F",
+    "Z3MO": "Z3M", "Z3MF": "Z3M",
+    "ZEO": "ZEP", "ZEF": "ZEP", "HZU": "XV", "HZD": "XV", "HZV": "XV", "ZEA": "ZEA",
+    "HZMO": "HZM", "HZMF": "HZM",
+}
+
+# the same, for commands where the digits come after the code (IS9):
+SET_PREFIX_RESPONSES = {"IS": "IS"}
+
+def expected_response(code: str) -> Optional[str]:
+    "Prefix of the line the AVR answers code with, None if unknown or none"
+    if (key := QUERY_RESPONSES.get(code) or SET_RESPONSES.get(code)) is not None:
+        return key
+    for n in (3, 2):
+        (digits, suffix) = (code[:-n], code[-n:])
+        if suffix in SET_RESPONSES and (digits == "" or digits.isdigit()):
+            return SET_RESPONSES[suffix]
+    if code[:2] in SET_PREFIX_RESPONSES and code[2:].isdigit():
+        return SET_PREFIX_RESPONSES[code[:2]]
+    return None
+
+def response_prefix(line: str) -> Optional[str]:
+    "The cache key for a status line, or None if it is not a cached kind"
+    if line[:3] in RESPONSE_PREFIXES:
+        return line[:3]
+    if line[:2] in RESPONSE_PREFIXES:
+        return line[:2]
+    return None
+
+
+class StatusCache:
+    """Latest line and decoded message for each kind of status line"""
+
+    def __init__(self):
+        self.lines: dict[str, str] = {}
+        self.messages: dict[str, Optional[str]] = {}
+        self.updated: dict[str, float] = {}
+
+    def update(self, line: str, message: Optional[str] = None) -> Optional[str]:
+        """Records line if it is a status line; returns its key.
+        Can be registered directly as an events listener."""
+        key = response_prefix(line)
+        if key is None:
+            return None
+        self.lines[key] = line
+        self.messages[key] = message
+        self.updated[key] = time.monotonic()
+        return key
+
+    def get(self, key: str) -> Optional[str]:
+        "Latest line for the given response prefix"
+        return self.lines.get(key)
+
+    def answer(self, query: str) -> Optional[str]:
+        "The cached line answering query (e.g. ?V), if known"
+        key = QUERY_RESPONSES.get(query)
+        if key is None:
+            return None
+        return self.lines.get(key)
+
+    def age(self, key: str) -> Optional[float]:
+        "Seconds since a line for key arrived, None if it never did"
+        t = self.updated.get(key)
+        if t is None:
+            return None
+        return time.monotonic() - t
+
+    def snapshot(self) -> dict[str, dict[str, Optional[str]]]:
+        "Copy of the cache contents, suitable for JSON"
+        return {k: {"line": v, "text": self.messages.get(k)} for (k, v) in list(self.lines.items())}
@@ -12,16 +12,27 @@ import telnetlib
 import threading
 import argparse
 import time
+import bisect
 
 import json
 
 # local imports:
 
-from modes_display import modeDisplayMap
-from modes_set import modeSetMap, inverseModeSetMap
+# the mode tables (modes_set, modes_display) and the subsystems behind commands
+# (mode_probe, presets, crawler, ...) are imported where they are used,
+# as most runs never need them
 
 import sources
 import decoders
+import events
+import state
+import list_cache
+import history
+import hot_reload
+import commands
+import startup
+import zones
+import tracing
 
 import config
 report = config.report
@@ -31,21 +42,30 @@ print_lock = config.print_lock
 
 # TODO: could have a pandora mode, ipod mode, radio mode, etc.
 
+def read_command_map(cfilename: str) -> dict[str,list[str]]:
+    """Reads map of commands from JSON file"""
+    with open(cfilename, encoding='UTF-8') as f:
+        return json.load(f)
+
 def load_command_map(folder:str):
     """Loads map of commands from JSON file"""
+    global command_map_watch
     cfilename = os.path.join(folder, "commandMap.json")
     try:
-        with open(cfilename, encoding='UTF-8') as f:
-            m = json.load(f)
-            report(f"Read commandMap from {cfilename}")
-            return m
+        m = read_command_map(cfilename)
+        report(f"Read commandMap from {cfilename}")
     except Exception as ex:
         report(f"Could not read commandMap from {cfilename}, {ex}")
         sys.exit(1)
+    command_map_watch = hot_reload.FileWatch(cfilename)
+    return m
 
 global commandMap
 commandMap: dict[str,list[str]] = {}
 
+# to notice edits to commandMap.json:
+command_map_watch: Optional[hot_reload.FileWatch] = None
+
 def print_help():
     "Prints help for the main commands"
     l = commandMap.keys()
@@ -56,9 +76,9 @@ def print_help():
     print("""    "help <command>" for help on a command, or "quit" to exit\n""")
 
 def print_mode_help():
-    "Lists the mode change options (not all work)"
+    "Lists the mode change options (not all work, see probe modes)"
     print("mode [mode]\tfor one of:\n")
-    for i in inverseModeSetMap:
+    for i in available_modes():
         print(f"{i}")
 
 def print_input_source_help():
@@ -70,221 +90,728 @@ def print_input_source_help():
 
 def send(tn, s:str):
     "Sends the given string as bytes"
+    if tracing.ENABLED:
+        tracing.sent(s)
     tn.write(s.encode() + b"\r\n")
 
+def send_batch(tn, codes: list[str], merge: bool = True):
+    """Sends several commands in a single write; with merge False, an outbound
+    queue sends them as they are, for callers that wait for an answer to each"""
+    if tracing.ENABLED:
+        for c in codes:
+            tracing.sent(c)
+    b = b"".join(c.encode() + b"\r\n" for c in codes)
+    if not merge and hasattr(tn, "write_unmerged"):
+        tn.write_unmerged(b)
+    else:
+        tn.write(b)
+
 def readline(tn) -> bytes:
     "Reads a line from the connection"
     s = tn.read_until(b"\r\n")
     return s[:-2]
 
 
-ErrorMap = {
-    "E02" : "NOT AVAILABLE NOW",
-    "E03" : "INVALID COMMAND",
-    "E04" : "COMMAND ERROR",
-    "E06" : "PARAMETER ERROR",
-    "B00" : "BUSY"
-    }
+ErrorMap = decoders.ErrorMap
 
 def parse_error(s:str):
     """Looks up error code that comes back from AVR"""
     return ErrorMap.get(s, None)
 
+# with --shared-state, the file other programs read the state from:
+STATE_WRITER = None # a shared_state.StateWriter, imported in main
+
+def names_learned(names: dict[str, str]) -> None:
+    "Called once names learned from RGB answers are in SOURCE_MAP"
+    if STATE_WRITER is not None:
+        STATE_WRITER.inputs_learned(names)
+
+# read in main, once the AVR is being woken up:
 SOURCE_MAP = sources.SourceMap()
-SOURCE_MAP.read_from_file()
+SOURCE_MAP.on_learned = names_learned
+sources_watch: Optional[hot_reload.FileWatch] = None
+
+def load_sources() -> None:
+    "Reads the sources map, and starts watching its file"
+    global sources_watch
+    SOURCE_MAP.read_from_file()
+    sources_watch = hot_reload.FileWatch(sources.find_map_file)
+
+# pages of network-source lists; prefetching starts once connected:
+LIST_CACHE = list_cache.ListCache()
+
+# latest status lines, kept up to date by the read loop:
+STATUS = state.StatusCache()
+events.subscribe(STATUS.update)
+
+# power, volume, mute and input of every zone:
+ZONE_STATES = zones.ZoneStates()
+events.subscribe(ZONE_STATES.on_line)
+
+# host:port of the AVR, set in main; the stores below are kept per receiver:
+RECEIVER = ""
+
+# listening modes found not to work, by signal class (see "probe modes"):
+MODE_SUPPORT = None # a mode_probe.ModeSupport, see mode_support()
+
+# tuner presets (see "presets fetch"):
+PRESETS = None # a presets.PresetCatalog, see preset_catalog()
+
+# network-source menus indexed by "crawl", for "find":
+LISTS = None # a crawler.ListStore, see list_store()
+CRAWLER = None # the crawler.Crawler started last
+# (source, select path) of the items listed by the last "find", for "goto":
+FOUND: list[tuple[str, tuple[int, ...]]] = []
+
+def mode_support():
+    "The mode_probe.ModeSupport of this receiver, read on first use"
+    global MODE_SUPPORT
+    if MODE_SUPPORT is None:
+        import mode_probe
+        MODE_SUPPORT = mode_probe.ModeSupport(RECEIVER)
+    return MODE_SUPPORT
+
+def preset_catalog():
+    "The presets.PresetCatalog of this receiver, read on first use"
+    global PRESETS
+    if PRESETS is None:
+        import presets
+        PRESETS = presets.PresetCatalog(RECEIVER)
+    return PRESETS
+
+def list_store():
+    "The crawler.ListStore of this receiver, read on first use"
+    global LISTS
+    if LISTS is None:
+        import crawler
+        LISTS = crawler.ListStore(RECEIVER)
+    return LISTS
+
+# volume, power, input and mode over time, for the "history" command:
+HISTORY = history.History()
+events.subscribe(HISTORY.on_line)
+
+# with --poll, answers that repeat the cached value are not shown:
+POLLER = None # a poller.Poller, imported in main
+
+# with --output ndjson, lines are written as typed JSON events instead of being decoded:
+NDJSON = None # an ndjson.NdjsonWriter, imported in main
 
 # We really want two threads: one with the output, another with the commands.
 
 def read_loop(tn: telnetlib.Telnet) -> None:
     """Main loop that reads and decodes data that comes back from the AVR"""
     sys.stdout.flush()
-    count:int = 0
     while True:
-        count += 1
         b:bytes = readline(tn)
         s = b.decode().strip()
-        err = parse_error(s)
-        if err:
-            report(f"ERROR: {err}")
-            continue
-        if s.startswith("RGB"):
-            # report(f"Learning (maybe) from '{s[3:]}'") # only if new
-            SOURCE_MAP.learn_input_from(s[3:])
-            continue
-        if decoded := decoders.try_all(s):
-            report(decoded)
-            continue
-        if s == "PWR0":
-            report("Power is ON")
-            continue
-        if s == "PWR1":
-            report("Power is OFF")
-            continue
-        if s.startswith("SVB"):
-            report(f"AVR mac address: {s[3:]}")
-            continue
-        if s.startswith("SSI"):
-            report(f"AVR software version: {s[3:]}")
-            continue
-        if s.startswith('FN'):
-            inputs = SOURCE_MAP.get(s[2:], f"unknown ({s})")
-            report(f"Input is {inputs}")
+        if NDJSON is not None:
+            write_event(s)
             continue
-        if s.startswith('ATW'):
-            flag = "on" if s == "ATW1" else "off"
-            report(f"loudness is {flag}")
-            continue
-        if s.startswith('ATC'):
-            fl = "on" if s == "ATC1" else "off"
-            report(f"eq is {fl}")
-            continue
-        if s.startswith('ATD'):
-            fl = "on" if s == "ATD1" else "off"
-            report(f"standing wave is {fl}")
-            continue
-        if m := translate_mode(s):
-            report(f"Listening mode is {m} ({s})")
-            continue
-        if s.startswith('SR'):
-            code = s[2:]
-            v = modeSetMap.get(code, None)
-            if v:
-                report(f"mode is {v} ({s})")
-                continue
-        if s.startswith('VOL'):
-            db = decoders.vol_db_level(s[3:])
-            report(f"volume is {db}")
-            continue
-        if s.startswith('RGD'):
-            report(f"AVR model info: {s}")
-            continue
-        if s.startswith('VTA'):
-            report(f"Got video parameter prohibition info {s}")
-            continue
-        if s.startswith('AUA'):
-            report(f"Got audio parameter prohibition info {s}")
-            continue
-        # default:
-        if len(s) > 0:
-            report(f"Unknown status line {s}")
+        if tracing.ENABLED:
+            tracing.received(s)
+            t0 = tracing.begin()
+            message = decode_line(s)
+            tracing.end("decode", "decode", t0, line=s)
+        else:
+            message = decode_line(s)
+        if message and not (POLLER is not None and POLLER.quiet(s)):
+            report(message)
+        if s:
+            events.publish(s, message)
+
+def write_event(s: str) -> None:
+    "The ndjson output's part of read_loop: no messages are built"
+    if not s:
+        return
+    if LIST_CACHE.feed(s):
+        events.publish(s, None) # a list page read in the background: not written
+        return
+    if s.startswith("RGB"):
+        SOURCE_MAP.learn_input_from(s[3:])
+    NDJSON.write(s)
+    events.publish(s, None)
+
+def decode_line(s: str) -> Optional[str]:
+    """Decodes a line that came back from the AVR, returning the message to report (if any)"""
+    err = parse_error(s)
+    if err:
+        return f"ERROR: {err}"
+    if LIST_CACHE.feed(s):
+        return None # part of a list page fetched in the background
+    if s.startswith("RGB"):
+        # report(f"Learning (maybe) from '{s[3:]}'") # only if new
+        SOURCE_MAP.learn_input_from(s[3:])
+        return None
+    if zone_message := zones.decode(s, lambda i: SOURCE_MAP.get(i, i)):
+        return zone_message
+    if s[:2] in ("PR", "FR", "TQ"):
+        import presets
+        if tuner_message := presets.decode(s, preset_catalog()):
+            return tuner_message
+    if config.DIFF and (s.startswith("AST") or s.startswith("VST")):
+        return decoders.diff_signal(s)
+    if decoded := decoders.try_all(s):
+        return decoded
+    if s == "PWR0":
+        return "Power is ON"
+    if s == "PWR1":
+        return "Power is OFF"
+    if s.startswith("SVB"):
+        return f"AVR mac address: {s[3:]}"
+    if s.startswith("SSI"):
+        return f"AVR software version: {s[3:]}"
+    if s.startswith('FN'):
+        inputs = SOURCE_MAP.get(s[2:], f"unknown ({s})")
+        return f"Input is {inputs}"
+    if s.startswith('ATW'):
+        flag = "on" if s == "ATW1" else "off"
+        return f"loudness is {flag}"
+    if s.startswith('ATC'):
+        fl = "on" if s == "ATC1" else "off"
+        return f"eq is {fl}"
+    if s.startswith('ATD'):
+        fl = "on" if s == "ATD1" else "off"
+        return f"standing wave is {fl}"
+    if m := translate_mode(s):
+        return f"Listening mode is {m} ({s})"
+    if s.startswith('SR'):
+        from modes_set import modeSetMap
+        code = s[2:]
+        v = modeSetMap.get(code, None)
+        if v:
+            return f"mode is {v} ({s})"
+    if s.startswith('VOL'):
+        db = decoders.vol_db_level(s[3:])
+        return f"volume is {db}"
+    if s.startswith('RGD'):
+        return f"AVR model info: {s}"
+    if s.startswith('VTA'):
+        return f"Got video parameter prohibition info {s}"
+    if s.startswith('AUA'):
+        return f"Got audio parameter prohibition info {s}"
+    # default:
+    if len(s) > 0:
+        return f"Unknown status line {s}"
+    return None
+
+def check_reload() -> None:
+    """Swaps in freshly read command and sources maps if their files changed.
+    Cheap to call often: the files are only stat'ed every few seconds."""
+    global commandMap, SOURCE_MAP
+    reloaded = False
+    if command_map_watch is not None and command_map_watch.changed():
+        try:
+            m = read_command_map(command_map_watch.path or "")
+        except Exception as ex:
+            report(f"Could not reload commandMap from {command_map_watch.path}, {ex}")
+        else:
+            commandMap = m
+            reloaded = True
+            report(f"Reloaded commandMap from {command_map_watch.path}")
+    if sources_watch is not None and sources_watch.changed():
+        new_map = sources.SourceMap()
+        new_map.read_from_file()
+        new_map.keep_learned(SOURCE_MAP)
+        if new_map.unsaved:
+            report(f"Kept {len(new_map.unsaved)} learned source names that were not saved yet; \"save\" writes them")
+        SOURCE_MAP = new_map
+        reloaded = True
+    if reloaded:
+        rebuild_completions()
+
+# sorted list of everything that can be typed, for tab completion:
+COMPLETIONS: list[str] = []
+
+def rebuild_completions() -> None:
+    "Rebuilds the completion list from the current maps"
+    global COMPLETIONS
+    words = (set(ROUTER.exact) | set(ROUTER.prefixes) | set(commandMap) | set(SOURCE_MAP.inverse_map)) - {""}
+    words |= {f"mode {m}" for m in available_modes()}
+    words.add("probe modes")
+    words |= {"presets fetch", "preset next", "preset prev", "crawl stop", "crawl restart"}
+    words |= {f"preset {e['name'].lower()}" for e in preset_catalog().presets().values() if e.get("name")}
+    COMPLETIONS = sorted(words)
+
+def complete(text: str, state_index: int) -> Optional[str]:
+    "readline completer over the whole input line"
+    completions = COMPLETIONS
+    i = bisect.bisect_left(completions, text) + state_index
+    if i < len(completions) and completions[i].startswith(text):
+        return completions[i]
+    return None
+
+def resolve_command(command: str) -> list[str]:
+    """The raw AVR codes that a command sends, for entry points that queue codes"""
+    check_reload()
+    return commands.capture(ROUTER, command)
 
 
 def write_loop(tn: telnetlib.Telnet) -> None:
     """Main loop that reads user input and sends commands to the AVR"""
-    s: Optional[str] = None
     while True:
         try:
             read = input("command: ")
         except EOFError:
             print("Goodbye!")
             sys.exit(0)
-        command = read.strip()
-        split_command = command.split()
-        base_command = split_command[0] if len(split_command) > 0 else None
-        second_arg = split_command[1] if len(split_command) > 1 else None
-        # print(f"base command: {base_command}\n")
-        if command in ("quit", "exit"):
-            print("Read thread says bye-bye!")
-            # sys.exit()
+        if tracing.ENABLED:
+            t0 = tracing.begin()
+            check_reload()
+            result = ROUTER.dispatch(tn, read)
+            tracing.end("command", "input", t0, command=read)
+        else:
+            check_reload()
+            result = ROUTER.dispatch(tn, read)
+        if result == commands.QUIT:
             return
-        if command == "debug":
-            config.DEBUG = not config.DEBUG
-            report(f"Debug is now {config.DEBUG}")
-            continue
-        if command == "status":
-            get_status(tn)
-            continue
-        if command == "learn":
-            # query the range of source codes to get their names back (if any):
-            for i in range(0,60):
-                s = str(i).rjust(2,"0")
-                send(tn, f"?RGB{s}")
-            continue
-        if command == "save":
-            SOURCE_MAP.save_to_file()
-            continue
-        if command == "sources" or command == "inputs":
-            with print_lock:
-                print_input_source_help()
-            continue
-        if command == "modes":
-            with print_lock:
-                print_mode_help()
-            continue
-        if base_command in ("help", "?"):
-            if command in ("help", "?"):
-                with print_lock:
-                    print_help()
-                continue
-            second = split_command[1] if len(split_command) > 1 else None
-            if second:
-                if p:= commandMap.get(second, None):
-                    report(f"{second}: {p[1]}")
-                    continue
-                if second in ["mode", "modes"]:
-                    with print_lock:
-                        print_mode_help()
-                    continue
-                if "inputs".startswith(second) or "sources".startswith(second):
-                    print_input_source_help()
-                    continue
-                if SOURCE_MAP.inverse_map.get(second, None):
-                    report(f"{second}: change source to {second}")
-                    continue
-            report(f"""Could not recognize help command "{command}" """)
-            continue
-        # to select from a menu:
-        if base_command == "select" and second_arg:
-            s = second_arg.rjust(2,"0") + "GFI"
-            send(tn, s)
-            continue
-        # to display from a menu:
-        if base_command == "display" and second_arg:
-            s = second_arg.rjust(5, "0") + "GCI" # may need to pad with zeros.
-            send(tn, s)
-            continue
-        # check if command is just a positive or negative integer:
-        intval = int(command) if command.split("-", 1)[-1].isdecimal() else None
-        if intval:
-            if intval > 0:
-                intval = min(intval, 10)
-                report(f"Volume up {intval}")
-                for _x in range(0, intval):
-                    send(tn, "VU")
-                    time.sleep(0.1)
-            if intval < 0:
-                intval = abs(max(intval, -30))
-                report(f"Volume down {intval}")
-                for _x in range(0, intval):
-                    send(tn, "VD")
-                    time.sleep(0.1)
-            continue
-        if p := commandMap.get(command, None):
-            s = p[0]
-            for c in s.split(","):
-                if config.DEBUG:
-                    print(f"Sending {c}")
-                send(tn, c.strip())
-            continue
-        if p := SOURCE_MAP.inverse_map.get(command, None):
-            # changing to a source by using the source name as the command
-            send(tn, p)
-            continue
-        if base_command == "mode":
-            change_mode(tn, split_command)
-            continue
-        if command != "":
-            report(f"Sending raw command {command}")
-            sys.stdout.flush()
-            send(tn, command) # try raw command
 
 
-# TODO: some modes work and some don't;
-# document which ones, only include those in help
+# The commands understood by write_loop (and by the gateway and scripts):
+ROUTER = commands.Router()
+
+@ROUTER.exact_command("")
+def do_nothing(tn, command: str, l: list[str]):
+    pass
+
+def at_prompt(tn, command: str) -> bool:
+    """False (after saying so) when tn only records codes (the gateway, scripts),
+    for commands that act on this program rather than on the AVR"""
+    if isinstance(tn, commands.Recorder):
+        report(f"{command} only runs at the prompt")
+        return False
+    return True
+
+@ROUTER.exact_command("quit", "exit")
+def quit_command(tn, command: str, l: list[str]):
+    if not at_prompt(tn, command):
+        return
+    print("Read thread says bye-bye!")
+    return commands.QUIT
+
+@ROUTER.exact_command("debug")
+def toggle_debug(tn, command: str, l: list[str]):
+    if not at_prompt(tn, command):
+        return
+    config.DEBUG = not config.DEBUG
+    report(f"Debug is now {config.DEBUG}")
+
+@ROUTER.exact_command("diff")
+def toggle_diff(tn, command: str, l: list[str]):
+    if not at_prompt(tn, command):
+        return
+    config.DIFF = not config.DIFF
+    report(f"Diff mode (audio/video info changes only) is now {config.DIFF}")
+
+@ROUTER.exact_command("status")
+def status_command(tn, command: str, l: list[str]):
+    get_status(tn)
+
+@ROUTER.exact_command("learn")
+def learn_command(tn, command: str, l: list[str]):
+    # query the range of source codes to get their names back (if any):
+    for i in range(0,60):
+        s = str(i).rjust(2,"0")
+        send(tn, f"?RGB{s}")
+
+@ROUTER.exact_command("save")
+def save_command(tn, command: str, l: list[str]):
+    if not at_prompt(tn, command):
+        return
+    SOURCE_MAP.save_to_file()
+
+@ROUTER.prefix_command("history")
+def history_command(tn, command: str, l: list[str]):
+    if not at_prompt(tn, command):
+        return
+    print_history(l[1:])
+
+@ROUTER.exact_command("sources", "inputs")
+def sources_command(tn, command: str, l: list[str]):
+    if not at_prompt(tn, command):
+        return
+    with print_lock:
+        print_input_source_help()
+
+@ROUTER.exact_command("modes")
+def modes_command(tn, command: str, l: list[str]):
+    if not at_prompt(tn, command):
+        return
+    with print_lock:
+        print_mode_help()
+
+@ROUTER.prefix_command("help", "?")
+def help_command(tn, command: str, l: list[str]):
+    if not at_prompt(tn, command):
+        return
+    if len(l) == 1:
+        with print_lock:
+            print_help()
+        return
+    second = l[1]
+    if p:= commandMap.get(second, None):
+        report(f"{second}: {p[1]}")
+        return
+    if second in ["mode", "modes"]:
+        with print_lock:
+            print_mode_help()
+        return
+    if "inputs".startswith(second) or "sources".startswith(second):
+        print_input_source_help()
+        return
+    if second in ["zone", "zones"]:
+        print_zone_help()
+        return
+    if second in ["preset", "presets"]:
+        print_preset_help()
+        return
+    if second in ["crawl", "find", "goto"]:
+        print_crawl_help()
+        return
+    if SOURCE_MAP.inverse_map.get(second, None):
+        report(f"{second}: change source to {second}")
+        return
+    report(f"""Could not recognize help command "{command}" """)
+
+def print_zone_help():
+    "Explains the zone command"
+    with print_lock:
+        print("zone <zones> <action>, where <zones> is main, 2, 3, hd, a list like 2,3, or all,")
+        print("and <action> is on, off, up, down, mute, unmute, volume <dB>, input <name> or status.")
+        print("Commands for several zones are sent together. \"zone\" alone shows what is known of each zone.")
+
+def print_preset_help():
+    "Explains the preset commands"
+    with print_lock:
+        print("preset <name|A1>\tselect a tuner preset by name (or the start of one) or class and number")
+        print("preset next|prev\tstep through the presets known to the catalog")
+        print("presets\t\t\tlist the catalog; \"presets fetch\" reads it from the AVR (tuner input only)")
+
+def print_crawl_help():
+    "Explains crawl, find and goto"
+    with print_lock:
+        print("crawl\t\tindex the menus of the current network source in the background (resumes where it stopped)")
+        print("crawl status\tsay how much of each source is indexed")
+        print("crawl stop|restart\tstop crawling, or forget the index of this source and crawl it again")
+        print("find <text>\tsearch the indexed titles; goto <n> opens the n-th item found")
+
+def input_id(name: str) -> Optional[str]:
+    "The two-digit id of an input, given its name"
+    code = SOURCE_MAP.inverse_map.get(name)
+    return code[:2] if code else None
+
+@ROUTER.prefix_command("zone", "zones")
+def zone_command(tn, command: str, l: list[str]):
+    if len(l) == 1:
+        with print_lock:
+            for line in ZONE_STATES.describe(lambda i: SOURCE_MAP.get(i, i)):
+                print(line)
+        return
+    if l[1:] == ["status"]:
+        (selection, action, args) = ("all", "status", [])
+    else:
+        (selection, action, args) = (l[1], l[2] if len(l) > 2 else "", l[3:])
+    try:
+        codes = zones.zone_codes(selection.lower(), action.lower(), args, input_id)
+    except ValueError as ex:
+        report(f"{ex}; see \"help zone\"")
+        return
+    send_batch(tn, codes)
+
+@ROUTER.prefix_command("preset", "presets")
+def preset_command(tn, command: str, l: list[str]):
+    if l[1:] == ["fetch"]:
+        if isinstance(tn, commands.Recorder):
+            report("presets fetch waits for the AVR's answers, and only runs at the prompt")
+            return
+        fetch_presets(tn)
+        return
+    if len(l) == 1:
+        with print_lock:
+            for line in preset_catalog().describe() or ["No tuner presets known yet, use \"presets fetch\""]:
+                print(line)
+        return
+    arg = " ".join(l[1:])
+    if arg.lower() in ("next", "prev"):
+        # from the catalog, no need to ask the AVR where it is:
+        current = STATUS.get("PR")
+        preset = preset_catalog().step(current[2:] if current else None, 1 if arg.lower() == "next" else -1)
+        if preset is None:
+            send(tn, "TPI" if arg.lower() == "next" else "TPD")
+            return
+    elif (preset := preset_catalog().find(arg)) is None:
+        report(f"No tuner preset called {arg}; see \"presets\"")
+        return
+    send(tn, f"{preset}PR")
+
+def fetch_presets(tn) -> None:
+    "Reads the name and frequency of every tuner preset, and keeps them"
+    import batch
+    import presets
+    waiter = batch.ResponseWaiter(set(ErrorMap))
+    events.subscribe(waiter.on_line)
+    try:
+        waiter.start(["FN", "PR"])
+        send_batch(tn, ["?F", "?PR"])
+        waiter.wait(presets.ANSWER_TIMEOUT)
+    finally:
+        events.unsubscribe(waiter.on_line)
+    if STATUS.get("FN") != "FN02":
+        report("The tuner presets can only be read with the tuner as input")
+        return
+    sweep = presets.PresetSweep(lambda codes: send_batch(tn, codes, merge=False), set(ErrorMap))
+    restore = STATUS.get("PR")
+    report(f"Reading {len(presets.ALL_PRESETS)} tuner presets...")
+    events.subscribe(sweep.on_line)
+    try:
+        results = sweep.sweep(presets.ALL_PRESETS, restore[2:] if restore else None)
+    finally:
+        events.unsubscribe(sweep.on_line)
+    catalog = preset_catalog()
+    catalog.record(results)
+    catalog.save()
+    rebuild_completions()
+    report(f"{len(catalog.presets())} of {len(results)} tuner presets read")
+
+def list_source() -> str:
+    "The network source whose menus are shown (GHH), else the input"
+    if LIST_CACHE.source is not None:
+        return LIST_CACHE.source
+    line = STATUS.get("FN")
+    return line if line else "unknown"
+
+@ROUTER.prefix_command("crawl")
+def crawl_command(tn, command: str, l: list[str]):
+    global CRAWLER
+    import crawler
+    lists = list_store()
+    if isinstance(tn, commands.Recorder):
+        report("crawl waits for the AVR's answers, and only runs at the prompt")
+        return
+    running = CRAWLER is not None and CRAWLER.running()
+    if l[1:] == ["stop"]:
+        if running:
+            CRAWLER.stop()
+            report(f"Crawling stopped after {CRAWLER.folders} folders; \"crawl\" resumes")
+        return
+    if l[1:] == ["status"] or running:
+        for source in lists.sources():
+            todo = len(lists.todo(source))
+            report(f"{source}: {len(lists.index(source).items)} items" + (f", {todo} folders to go" if todo else ""))
+        if running:
+            report(f"Crawling {CRAWLER.source}, {CRAWLER.folders} folders so far")
+        return
+    source = list_source()
+    if l[1:] == ["restart"]:
+        lists.restart(source)
+    if not lists.todo(source):
+        report(f"{source} is indexed; use \"crawl restart\" to crawl it again")
+        return
+    CRAWLER = crawler.Crawler(lambda codes: send_batch(tn, codes), lists, source, LIST_CACHE.set_background)
+    CRAWLER.start()
+    report(f"Crawling {source} in the background; \"crawl stop\" stops")
+
+@ROUTER.prefix_command("find")
+def find_command(tn, command: str, l: list[str]):
+    global FOUND
+    if len(l) < 2:
+        return False
+    lists = list_store()
+    FOUND = [(source, p) for source in lists.sources() for p in lists.index(source).find(" ".join(l[1:]))]
+    with print_lock:
+        if not FOUND:
+            print("Nothing found" + ("" if lists.sources() else "; use \"crawl\" to index the menus first"))
+        for (i, (source, p)) in enumerate(FOUND, 1):
+            print(f"{i:3}  {lists.index(source).describe(p)}")
+
+@ROUTER.prefix_command("goto")
+def goto_command(tn, command: str, l: list[str]):
+    if len(l) != 2 or not l[1].isdecimal() or not 1 <= int(l[1]) <= len(FOUND):
+        report("Use \"goto N\" for the N-th item of the last \"find\"")
+        return
+    if isinstance(tn, commands.Recorder):
+        report("goto waits for the AVR's answers, and only runs at the prompt")
+        return
+    if CRAWLER is not None and CRAWLER.running():
+        report("Crawling; \"crawl stop\" first")
+        return
+    (source, path) = FOUND[int(l[1]) - 1]
+    if source != list_source():
+        report(f"That item is in {source}; change to that source first")
+        return
+    # the folders on the way are opened without being shown, then the item is selected:
+    import crawler
+    reader = crawler.ListReader()
+    events.subscribe(reader.on_line)
+    LIST_CACHE.set_background(True)
+    try:
+        page = reader.open(lambda codes: send_batch(tn, codes), path[:-1], pace=0)
+    finally:
+        LIST_CACHE.set_background(False)
+        events.unsubscribe(reader.on_line)
+    if page is None:
+        report("The AVR did not show the menus on the way; run \"crawl restart\" if they changed")
+        return
+    send_batch(tn, crawler.select_codes(page, path[-1]))
+
+# to select from a menu:
+@ROUTER.prefix_command("select")
+def select_command(tn, command: str, l: list[str]):
+    if len(l) < 2:
+        return False
+    send_batch(tn, LIST_CACHE.select_codes(l[1]))
+
+# to display from a menu:
+@ROUTER.prefix_command("display")
+def display_command(tn, command: str, l: list[str]):
+    if len(l) < 2:
+        return False
+    if l[1].isdecimal() and (page := LIST_CACHE.lookup(int(l[1]))):
+        with print_lock:
+            for line in page.lines:
+                print(decoders.decode_geh(line))
+        return
+    if l[1].isdecimal():
+        LIST_CACHE.request(int(l[1]))
+    s = l[1].rjust(5, "0") + "GCI" # may need to pad with zeros.
+    send(tn, s)
+
+# check if command is just a positive or negative integer:
+@ROUTER.pattern_command(r"-?\d+")
+def volume_steps(tn, command: str, l: list[str]):
+    intval = int(command)
+    # the steps are sent together; the outbound queue turns them into one volume set:
+    if intval > 0:
+        intval = min(intval, 10)
+        report(f"Volume up {intval}")
+        send_batch(tn, ["VU"] * intval)
+    elif intval < 0:
+        intval = abs(max(intval, -30))
+        report(f"Volume down {intval}")
+        send_batch(tn, ["VD"] * intval)
+    else:
+        return False
+
+@ROUTER.lookup
+def command_map_command(tn, command: str, l: list[str]):
+    p = commandMap.get(command, None)
+    if not p:
+        return False
+    for c in p[0].split(","):
+        if config.DEBUG:
+            print(f"Sending {c}")
+        send(tn, c.strip())
+
+@ROUTER.lookup
+def source_command(tn, command: str, l: list[str]):
+    # changing to a source by using the source name as the command
+    p = SOURCE_MAP.inverse_map.get(command, None)
+    if not p:
+        return False
+    send(tn, p)
+
+@ROUTER.prefix_command("mode")
+def mode_command(tn, command: str, l: list[str]):
+    change_mode(tn, l)
+
+@ROUTER.prefix_command("probe")
+def probe_command(tn, command: str, l: list[str]):
+    if l[1:] != ["modes"]:
+        report("Use \"probe modes\" to find which listening modes work with the current input")
+        return
+    if isinstance(tn, commands.Recorder):
+        report("probe modes waits for the AVR's answers, and only runs at the prompt")
+        return
+    probe_modes(tn)
+
+def probe_modes(tn) -> None:
+    "Tries every listening mode with the current input, and remembers which ones work"
+    from modes_set import modeSetMap
+    import batch
+    import mode_probe
+    waiter = batch.ResponseWaiter(set(ErrorMap))
+    events.subscribe(waiter.on_line)
+    try:
+        waiter.start(["AST", "SR"])
+        send_batch(tn, ["?AST", "?S"])
+        waiter.wait(mode_probe.ANSWER_TIMEOUT)
+    finally:
+        events.unsubscribe(waiter.on_line)
+    signal = mode_probe.signal_class(STATUS.get("AST"))
+    current = STATUS.get("SR")
+    if current is None:
+        # a mode the AVR stays in would pass for accepted:
+        report("The AVR did not say which listening mode it is in; try \"probe modes\" again")
+        return
+    report(f"Trying {len(modeSetMap)} listening modes with a {signal} input...")
+    # every code needs its answer, so none may be merged away:
+    probe = mode_probe.ModeProbe(lambda codes: send_batch(tn, codes, merge=False), set(ErrorMap))
+    events.subscribe(probe.on_line)
+    try:
+        results = probe.sweep(list(modeSetMap), current[2:])
+    finally:
+        events.unsubscribe(probe.on_line)
+    mode_support().record(signal, results)
+    mode_support().save()
+    rebuild_completions()
+    works = [modeSetMap[c] for (c, ok) in results.items() if ok]
+    unanswered = sum(1 for ok in results.values() if ok is None)
+    with print_lock:
+        print(f"{len(works)} of {len(results)} modes work with a {signal} input"
+              + (f" ({unanswered} unanswered)" if unanswered else "") + ":")
+        for name in works:
+            print(f"  {name}")
+
+@ROUTER.default_command
+def raw_command(tn, command: str, l: list[str]):
+    report(f"Sending raw command {command}")
+    sys.stdout.flush()
+    send(tn, command) # try raw command
+
+
+def history_label(metric: str, value: str) -> str:
+    "Readable name for a value of a categorical history metric"
+    if metric == "input":
+        return SOURCE_MAP.get(value, value)
+    if metric == "mode":
+        if m := translate_mode(value):
+            return m.strip()
+        from modes_set import modeSetMap
+        return modeSetMap.get(value[2:], value)
+    return value
+
+def print_history(l: list[str]) -> None:
+    "Prints the history of a metric, given [metric, window]"
+    if len(l) == 0:
+        report(f"history <metric> [window], metric is one of {', '.join(HISTORY.metrics)}, window like 30m, 2h or 3d")
+        return
+    window = history.parse_window(l[1]) if len(l) > 1 else 3600.0
+    if window is None:
+        report(f"Could not understand window {l[1]}, use e.g. 30m, 2h or 3d")
+        return
+    lines = HISTORY.report(l[0], window, lambda v: history_label(l[0], v))
+    with print_lock:
+        for line in lines:
+            print(line)
+
+
+# Some modes work and some don't, depending on the receiver and the input;
+# "probe modes" finds out, and the modes that failed are left out of help.
+
+def available_modes() -> dict[str, str]:
+    """inverseModeSetMap, without the modes that "probe modes" found not to work
+    with the current input signal"""
+    from modes_set import inverseModeSetMap
+    import mode_probe
+    rejected = mode_support().rejected(mode_probe.signal_class(STATUS.get("AST")))
+    if not rejected:
+        return inverseModeSetMap
+    return {k: v for (k, v) in inverseModeSetMap.items() if v not in rejected}
 
 def get_modes_with_prefix(prefix:str) -> set[str]:
     """Returns all the map keys that start with prefix --- except when prefix
     is itself a key, in that case, only preix is returned"""
+    inverseModeSetMap = available_modes()
     if inverseModeSetMap.get(prefix, None) is not None:
         return set([prefix])
     s:set[str] = set({})
@@ -308,7 +835,7 @@ def change_mode(tn, l: list[str]) -> bool:
         return False
     if len(mset) == 1:
         mode = mset.pop()
-        m = inverseModeSetMap.get(mode)
+        m = available_modes().get(mode)
         assert m is not None
         report(f"trying to change mode to {modestring} ({m})")
         send(tn, m + "SR")
@@ -334,6 +861,7 @@ def second_arg_fun(cmd: str) -> Optional[str]:
 def translate_mode(s: str) -> Optional[str]:
     if not s.startswith('LM'):
         return None
+    from modes_display import modeDisplayMap
     s = s[2:]
     return modeDisplayMap.get(s, "Unknown")
 
@@ -341,15 +869,17 @@ def translate_mode(s: str) -> Optional[str]:
 def get_status(tn: telnetlib.Telnet):
     """Gets the status by sending a series of status requests.
        Each request prints the corresponding info."""
-    send(tn, "?P") # power
-    send(tn, "?F") # input
-    send(tn, "?BA")
-    send(tn, "?TR")
-    send(tn, "?TO")
-    send(tn, "?L")
-    send(tn, "?AST")
-    send(tn, "?IS")
-    send(tn, "?VST")
+    send_batch(tn, [
+        "?P", # power
+        "?F", # input
+        "?BA",
+        "?TR",
+        "?TO",
+        "?L",
+        "?AST",
+        "?IS",
+        "?VST",
+    ])
     # send(tn, "?VTC") # not very interesting if always AUTO
 
 
@@ -362,23 +892,81 @@ class ReadThread(threading.Thread):
         read_loop(self.tn)
 
 
-# TODO: add command-line options to control, for example, displaying the info from the screen;
-# also, for one-off commands.
+# TODO: add command-line options to control, for example, displaying the info from the screen.
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('host', metavar='host', type=str, help='address of AVR')
+    parser.add_argument('host', metavar='host', type=str, nargs='?', default=None,
+                        help='address of AVR (default: the last one discovered)')
+    parser.add_argument('--port', type=int, default=23, help='telnet port of the AVR (default 23)')
+    parser.add_argument('--discover', metavar='CIDR', type=str, default=None,
+                        help='look for AVRs on a subnet, e.g. 192.168.1.0/24 (results are kept for a day)')
+    parser.add_argument('--rescan', action='store_true',
+                        help='with --discover, scan the subnet even if recent results are known')
+    parser.add_argument('--gateway', metavar='PORT', type=int, default=None,
+                        help='serve local HTTP/WebSocket clients on PORT instead of the prompt')
+    parser.add_argument('--bind', metavar='ADDRESS', type=str, default="127.0.0.1",
+                        help='address the gateway listens on (default 127.0.0.1)')
+    parser.add_argument('-f', '--file', metavar='SCRIPT', type=str, default=None,
+                        help='run the commands in SCRIPT ("-" for stdin) and exit')
+    parser.add_argument('--poll', action='store_true',
+                        help='keep the status fresh by polling in the background')
+    parser.add_argument('--plugin', metavar='MODULE', action='append', default=[],
+                        help='load commands from MODULE (which has a register(router) function)')
+    parser.add_argument('--journal', metavar='FOLDER', type=str, default=None,
+                        help='record every line from the AVR in a binary journal in FOLDER')
+    parser.add_argument('--trace', metavar='FILE', type=str, default=None,
+                        help='write a Chrome trace (JSON) of commands, sends and answers to FILE on exit')
+    parser.add_argument('--shared-state', metavar='FILE', type=str, nargs='?', default=None,
+                        const="", help='keep the current power, volume, input and mode in FILE (by '
+                                       'default one per receiver in /dev/shm) for other programs to read '
+                                       '(see shared_state.py)')
+    parser.add_argument('--output', choices=['text', 'ndjson'], default='text',
+                        help='ndjson: write lines from the AVR to stdout as JSON events, '
+                             'and everything else to stderr (default text)')
 
     # print(f"argv: {sys.argv}")
-    script_folder = os.path.dirname(os.path.abspath(sys.argv[0]))
-    commandMap = load_command_map(script_folder)
-
     args = parser.parse_args()
+
+    if args.trace:
+        import atexit
+        tracing.start()
+        atexit.register(tracing.save, args.trace)
+
+    if args.output == "ndjson":
+        import atexit
+        import ndjson
+        NDJSON = ndjson.NdjsonWriter(sys.stdout, lambda i: SOURCE_MAP.get(i))
+        atexit.register(NDJSON.flush)
+        sys.stdout = sys.stderr # messages and the prompt
+
+    if args.rescan and not args.discover:
+        parser.error("--rescan goes with --discover CIDR")
+    if args.discover:
+        import ipaddress
+        try:
+            ipaddress.ip_network(args.discover, strict=False)
+        except ValueError as ex:
+            parser.error(f"--discover needs a subnet such as 192.168.1.0/24: {ex}")
+    if args.discover or args.host is None:
+        import discovery
+        if args.discover:
+            found = discovery.discover(args.discover, args.port, refresh=args.rescan)
+        else:
+            found = discovery.load_cache() or []
+        for r in found:
+            print(discovery.describe(r))
+        if args.host is None:
+            if len(found) != 1:
+                parser.error("give the AVR address, or use --discover CIDR to find it")
+            args.host = found[0]["host"]
+            args.port = int(found[0].get("port", args.port))
+
     print(f"AVR hostname/address is {args.host}")
 
     try:
-        telnet_connection = telnetlib.Telnet(args.host, port=23)
+        telnet_connection = telnetlib.Telnet(args.host, port=args.port)
     except Exception as e:
         print(f"Could not connect to {args.host}: {e}")
         sys.exit(1)
@@ -388,11 +976,78 @@ if __name__ == "__main__":
     test_s = telnet_connection.read_very_eager()
     # print("very eager: ", test_s)
 
-    send(telnet_connection, "?P") # to wake up
+    RECEIVER = f"{args.host}:{args.port}"
+
+    # until the AVR answers the wake queries, commands are held back:
+    avr = startup.Startup(telnet_connection, RECEIVER)
+    events.subscribe(avr.on_line)
+
+    # bursts of commands (volume steps, input changes) are merged before they go out:
+    import outbound
+    outbound_queue = outbound.OutboundQueue(avr)
+    events.subscribe(outbound_queue.on_line)
+
+    LIST_CACHE.send_fn = lambda c: send(outbound_queue, c)
+
+    if args.shared_state is not None:
+        import atexit
+        import shared_state
+        STATE_WRITER = shared_state.StateWriter(args.shared_state or shared_state.default_path(RECEIVER),
+                                                lambda i: SOURCE_MAP.get(i))
+        events.subscribe(STATE_WRITER.on_line)
+        atexit.register(STATE_WRITER.close)
 
+    # the maps are read while the AVR wakes up, but before any line is decoded
+    # (its answers wait in the connection until the read thread starts):
+    avr.start()
+    script_folder = os.path.dirname(os.path.abspath(sys.argv[0]))
+    commandMap = load_command_map(script_folder)
+    load_sources()
     readThread = ReadThread(telnet_connection)
     readThread.daemon = True
     readThread.start()
+    for plugin in args.plugin:
+        commands.load_plugin(ROUTER, plugin)
+
+    if args.journal:
+        import atexit
+        import journal
+        journal_writer = journal.JournalWriter(args.journal)
+        events.subscribe(journal_writer.on_line)
+        atexit.register(journal_writer.close)
+
+    if args.poll:
+        import poller
+        POLLER = poller.Poller(STATUS, lambda codes: send_batch(outbound_queue, codes))
+        poller.PollThread(POLLER).start()
+
+    if args.file:
+        import batch
+        if args.file == "-":
+            script_lines = sys.stdin.read().splitlines()
+        else:
+            with open(args.file, encoding='UTF-8') as script_file:
+                script_lines = script_file.read().splitlines()
+        avr.wait()
+        # scripts time each command, so theirs are sent as they are:
+        runner = batch.ScriptRunner(resolve_command, lambda codes: send_batch(avr, codes),
+                                    STATUS, set(ErrorMap))
+        sys.exit(0 if runner.run(script_lines) else 1)
+
+    if args.gateway:
+        import gateway
+        gateway.run(lambda c: send(outbound_queue, c), resolve_command, args.bind, args.gateway)
+        sys.exit(0)
+
+    # only the prompt needs completion:
+    rebuild_completions()
+    try:
+        import readline as line_editing # not to hide our readline()
+        line_editing.set_completer(complete)
+        line_editing.set_completer_delims("")
+        line_editing.parse_and_bind("tab: complete")
+    except ImportError:
+        pass
 
     # the main thread does the writing, and everything exits when it does:
-    write_loop(telnet_connection)
+    write_loop(outbound_queue)
@@ -0,0 +1,53 @@
+import unittest
+
+import batch
+import events
+import state
+from fake_avr import FakeAVR
+
+class TestScriptRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.avr = FakeAVR()
+        self.writes = []
+        self.status = state.StatusCache()
+        events.subscribe(self.status.update)
+
+    def tearDown(self):
+        events.unsubscribe(self.status.update)
+
+    def send_batch(self, codes):
+        "Answers right away, as if the AVR were instantaneous"
+        self.writes.append(codes)
+        for c in codes:
+            for line in self.avr.handle(c):
+                events.publish(line, None)
+
+    def runner(self):
+        return batch.ScriptRunner(lambda c: c.split(","), self.send_batch, self.status,
+                                  {"E04"}, timeout=0.2)
+
+    def test_pipelined(self):
+        ok = self.runner().run(["# volume and input", "PO", "VU,VU", "05FN", "",
+                                "expect VOL123", "expect FN05", "expect PWR0"])
+        self.assertTrue(ok)
+        self.assertEqual(self.writes, [["PO", "VU"], ["VU", "05FN"], ["?V", "?F", "?P"]])
+
+    def test_mismatch(self):
+        self.assertFalse(self.runner().run(["PF", "expect PWR0"]))
+
+    def test_error(self):
+        r = self.runner()
+        self.assertFalse(r.run(["?V", "XYZ", "?P"]))
+        self.assertEqual([s.error for s in r.steps], [None, "E04", None])
+        self.assertEqual([s.answered for s in r.steps], [True, True, True])
+
+    def test_bad_sleep(self):
+        r = self.runner()
+        self.assertFalse(r.run(["PO", "sleep abc", "sleep 0", "?P"]))
+        self.assertEqual([s.command for s in r.steps], ["PO", "?P"])
+        self.assertTrue(all(s.answered for s in r.steps))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import contextlib
+import io
+import unittest
+
+import commands
+
+class TestRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.router = commands.Router()
+        self.calls = []
+        names = {"up": "VU"}
+
+        @self.router.exact_command("status")
+        def status(tn, command, l):
+            self.calls.append("status")
+
+        @self.router.lookup
+        def names_lookup(tn, command, l):
+            if command not in names:
+                return False
+            tn.write(names[command].encode() + b"\r\n")
+
+        @self.router.prefix_command("select")
+        def select(tn, command, l):
+            if len(l) < 2:
+                return False
+            tn.write(l[1].rjust(2, "0").encode() + b"GFI\r\n")
+
+        @self.router.pattern_command(r"-?\d+")
+        def number(tn, command, l):
+            self.calls.append(int(command))
+
+        @self.router.pattern_command(r"vol (\d+)")
+        def volume(tn, command, l):
+            tn.write(f"{l[1]}VL\r\n".encode())
+
+        @self.router.default_command
+        def raw(tn, command, l):
+            tn.write(command.encode() + b"\r\n")
+
+    def test_dispatch(self):
+        self.assertEqual(commands.capture(self.router, "up"), ["VU"])
+        self.assertEqual(commands.capture(self.router, " select 3 "), ["03GFI"])
+        self.assertEqual(commands.capture(self.router, "vol 120"), ["120VL"])
+        self.assertEqual(commands.capture(self.router, "status"), [])
+        self.assertEqual(commands.capture(self.router, "-5"), [])
+        self.assertEqual(self.calls, ["status", -5])
+
+    def test_decline(self):
+        # select without an argument falls through to the default:
+        self.assertEqual(commands.capture(self.router, "select"), ["select"])
+        self.assertEqual(commands.capture(self.router, "5-3"), ["5-3"])
+
+
+class TestTelnetCommands(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with contextlib.redirect_stdout(io.StringIO()):
+            import telnet # pylint: disable=import-outside-toplevel
+        cls.telnet = telnet
+        telnet.commandMap = telnet.read_command_map("commandMap.json")
+
+    def capture(self, command):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return commands.capture(self.telnet.ROUTER, command)
+
+    def test_commands(self):
+        self.assertEqual(self.capture("up"), ["VU"])
+        self.assertEqual(self.capture("info"), ["?RGD", "?SVB", "?SSI"])
+        self.assertEqual(self.capture("mode"), ["?S"]) # commandMap entry
+        self.assertEqual(self.capture("mode pure direct"), ["0008SR"])
+        self.assertEqual(self.capture("tv"), ["05FN"])
+        self.assertEqual(self.capture("display 9"), ["00009GCI"])
+        self.assertEqual(self.capture("?V"), ["?V"])
+        self.assertEqual(self.capture(""), [])
+        self.assertEqual(self.capture("quit"), [])
+        self.assertEqual(self.capture("zone 2,3 input tv"), ["05ZS", "05ZT"])
+        self.assertEqual(self.capture("preset b3"), ["B03PR"])
+        self.assertEqual(self.capture("presets fetch"), []) # only at the prompt
+
+    def test_prompt_only(self):
+        debug = self.telnet.config.DEBUG
+        for command in ("debug", "help", "history", "save", "quit"):
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                self.assertIsNone(self.telnet.ROUTER.dispatch(commands.Recorder(), command))
+            self.assertIn("only runs at the prompt", out.getvalue())
+        self.assertEqual(self.telnet.config.DEBUG, debug)
+
+
+if __name__ == '__main__':
+    unittest.main()
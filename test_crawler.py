@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+
+import crawler
+import list_cache
+from fake_avr import FakeAVR, Responder
+
+class TestCrawler(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = crawler.lists_filename
+        self.folder = tempfile.TemporaryDirectory()
+        crawler.lists_filename = os.path.join(self.folder.name, "lists.json")
+        self.saved_timeout = crawler.PAGE_TIMEOUT
+
+    def tearDown(self):
+        crawler.lists_filename = self.saved
+        crawler.PAGE_TIMEOUT = self.saved_timeout
+        self.folder.cleanup()
+
+    def crawl(self, store, answers=None):
+        c = crawler.Crawler(None, store, "00", pace=0)
+        menus = Responder(c.reader.on_line, answers=answers)
+        c.send_batch = menus.send_batch
+        c.run()
+        return (c, menus)
+
+    def test_crawl_and_find(self):
+        store = crawler.ListStore("avr:23")
+        (c, menus) = self.crawl(store)
+        index = store.index("00")
+        self.assertEqual(len(index.items), 21)
+        self.assertEqual(c.folders, 5) # the top menu, Jazz, Rock, Classic Rock, News Talk
+        self.assertEqual(len(c.reader.pages), 0) # every page was let go once read
+        self.assertNotIn("GCH02", [line[:5] for line in menus.lines]) # nothing was played
+        self.assertEqual(store.todo("00"), [])
+        self.assertEqual(index.find("bbc"), [(3, 1)])
+        self.assertEqual(index.describe((3, 1)), "BBC World Service (Channel in News Talk)")
+        self.assertEqual(len(index.find("jazz chan")), 10)
+        self.assertEqual(index.find("rock")[0], (2,)) # shortest path first
+        self.assertEqual(index.find("radio 3"), [(2, 1, 3)])
+        self.assertEqual(index.find("classical"), [])
+        # the second page of Jazz was asked for:
+        self.assertIn("00009GCI", menus.codes)
+        # saved, and read back by the next run:
+        self.assertEqual(len(crawler.ListStore("avr:23").index("00").items), 21)
+        self.assertEqual(crawler.ListStore("other:23").sources(), [])
+
+    def test_resume(self):
+        crawler.PAGE_TIMEOUT = 0.01
+        store = crawler.ListStore("avr:23")
+        self.crawl(store, answers=6)
+        todo = crawler.ListStore("avr:23").todo("00")
+        self.assertTrue(todo)
+        self.assertNotEqual(todo, [()])
+        store = crawler.ListStore("avr:23")
+        self.crawl(store)
+        self.assertEqual(len(store.index("00").items), 21)
+        self.assertEqual(store.todo("00"), [])
+
+    def test_open(self):
+        reader = crawler.ListReader()
+        menus = Responder(reader.on_line)
+        page = reader.open(menus.send_batch, (1,), pace=0)
+        self.assertEqual((page.start, page.end, page.total), (1, 8, 10))
+        menus.send_batch(crawler.select_codes(page, 10))
+        self.assertEqual(menus.codes[-2:], ["00010GCI", "01GFI"])
+        self.assertEqual(menus.avr.list_start, 10)
+
+    def test_background_pages_are_quiet(self):
+        cache = list_cache.ListCache()
+        avr = FakeAVR()
+        cache.set_background(True)
+        self.assertTrue(all(cache.feed(line) for line in avr.handle("19IP")[1:]))
+        cache.set_background(False)
+        self.assertEqual(cache.view_start, 1)
+        self.assertFalse(cache.feed(avr.handle("01GFI")[2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
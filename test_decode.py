@@ -9,5 +9,21 @@ class TestDecode(unittest.TestCase):
         r = decoders.decode_fl(s)
         self.assertEqual(r, "   APPLETV    ")
 
+    def test_diff_signal(self):
+        decoders.last_signal_fields.clear()
+        first = decoders.diff_signal("VST41122110922110921")
+        self.assertEqual(first, decoders.decode_vst("VST41122110922110921"))
+        self.assertIsNone(decoders.diff_signal("VST41122110922110921"))
+        self.assertEqual(decoders.diff_signal("VST41222110922110921"),
+                         "Input resolution: 1080/24p → 4Kx2K/24Hz")
+
+    def test_ast_channels(self):
+        # data positions 5-7 are the L/C/R input channels, 26-28 the L/C/R outputs:
+        payload = "0602" + "111" + "0" * 18 + "111" + "0" * 15
+        r = decoders.decode_ast("AST" + payload)
+        self.assertEqual(r, "Audio input signal: DTS\nAudio input frequency: 48kHz\n"
+                         "Input Channels:\nLeft,\nCenter,\nRight,\n\n"
+                         "Output Channels:\nLeft,\nCenter,\nRight,\n")
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,54 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+import discovery
+from fake_avr import FakeAVR
+
+class TestDiscovery(unittest.IsolatedAsyncioTestCase):
+
+    async def test_scan(self):
+        avr = FakeAVR(model="SC-LX57")
+        port = await avr.start("127.0.0.1")
+        # a listener that never answers:
+        silent = await asyncio.start_server(lambda r, w: None, "127.0.0.2", port)
+        try:
+            start = time.monotonic()
+            found = await discovery.scan("127.0.0.0/29", port, timeout=0.3)
+            self.assertLess(time.monotonic() - start, 2.0)
+        finally:
+            silent.close()
+            await avr.stop()
+        self.assertEqual(len(found), 1)
+        self.assertEqual(found[0]["host"], "127.0.0.1")
+        self.assertEqual(found[0]["model"], "<001><SC-LX57>")
+        self.assertEqual(found[0]["mac"], "0009B0123456")
+
+
+class TestDiscoveryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = discovery.discovery_cache_filename
+        (fd, discovery.discovery_cache_filename) = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(discovery.discovery_cache_filename)
+        discovery.discovery_cache_filename = self.saved
+
+    def test_ttl(self):
+        receivers = [{"host": "10.0.0.5", "port": "23", "model": "x"}]
+        discovery.save_cache("10.0.0.0/24", receivers)
+        self.assertEqual(discovery.load_cache("10.0.0.0/24"), receivers)
+        self.assertIsNone(discovery.load_cache("10.0.1.0/24"))
+        self.assertIsNone(discovery.load_cache(ttl=-1))
+
+    def test_nothing_found_is_not_cached(self):
+        discovery.save_cache("10.0.0.0/24", [])
+        self.assertIsNone(discovery.load_cache("10.0.0.0/24"))
+
+
+if __name__ == '__main__':
+    unittest.main()
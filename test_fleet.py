@@ -0,0 +1,80 @@
+import json
+import threading
+import time
+import unittest
+
+import fleet
+from loadtest import Receiver
+
+class TestLink(unittest.TestCase):
+
+    def test_noisy_receiver_is_coalesced(self):
+        worker = fleet.Worker(0, ["10.0.0.1:23"], None)
+        link = worker.links["10.0.0.1:23"]
+        link.on_line("RGB051TV")
+        for i in range(fleet.LINE_BUDGET + 100):
+            link.on_line(f"VOL{i % 185:03d}")
+        link.on_line("FN05")
+        self.assertEqual(len(worker.batch), fleet.LINE_BUDGET)
+        self.assertEqual(link.coalesced, 100) # the RGB line used up one of the budget
+        link.release()
+        last = [json.loads(e) for e in worker.batch[-2:]]
+        self.assertEqual({e["raw"] for e in last}, {f"VOL{(fleet.LINE_BUDGET + 99) % 185:03d}", "FN05"})
+        self.assertEqual(last[-1]["receiver"], "10.0.0.1:23")
+        self.assertEqual(last[-1]["name"], "TV")
+
+    def test_sharding(self):
+        self.assertEqual(fleet.receiver_id("10.0.0.1"), "10.0.0.1:23")
+        receivers = [f"10.0.{i // 250}.{i % 250}:23" for i in range(150)]
+        shards = [fleet.shard_of(r, 8) for r in receivers]
+        self.assertEqual(shards, [fleet.shard_of(r, 8) for r in receivers])
+        self.assertEqual(set(shards), set(range(8)))
+
+
+class TestFleet(unittest.TestCase):
+
+    def setUp(self):
+        self.receivers = [Receiver(0) for _ in range(3)]
+        self.addresses = [f"127.0.0.1:{r.start()}" for r in self.receivers]
+        self.events = []
+        self.cond = threading.Condition()
+
+    def tearDown(self):
+        for r in self.receivers:
+            r.stop()
+
+    def on_event(self, line):
+        with self.cond:
+            self.events.append(json.loads(line))
+            self.cond.notify_all()
+
+    def wait_for(self, predicate, timeout=20):
+        with self.cond:
+            return self.cond.wait_for(lambda: any(predicate(e) for e in self.events), timeout)
+
+    def test_routing_and_restart(self):
+        f = fleet.Fleet(self.addresses, 2, self.on_event)
+        f.start()
+        try:
+            for a in self.addresses:
+                self.assertTrue(self.wait_for(lambda e, a=a: e.get("type") == "connected" and e["receiver"] == a))
+            self.assertTrue(f.send(self.addresses[1], "?V"))
+            self.assertTrue(self.wait_for(lambda e: e.get("raw") == "VOL121"))
+            answered = [e["receiver"] for e in self.events if e.get("raw") == "VOL121"]
+            # every client of a receiver gets its answers, but we have one per receiver:
+            self.assertEqual(answered, [self.addresses[1]])
+            self.assertFalse(f.send("10.9.9.9", "?V"))
+
+            shard = f.shards[f.shard_of[self.addresses[0]]]
+            shard.process.kill()
+            self.assertTrue(self.wait_for(lambda e: e.get("type") == "worker_restarted"))
+            self.assertTrue(self.wait_for(lambda e: e.get("type") == "connected"
+                                          and e["receiver"] == self.addresses[0]
+                                          and e["t"] > time.time() - 15))
+            self.assertTrue(f.send(self.addresses[0], "VU"))
+            self.assertTrue(self.wait_for(lambda e: e.get("raw") == "VOL122"))
+        finally:
+            f.stop()
+
+if __name__ == '__main__':
+    unittest.main()
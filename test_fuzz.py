@@ -0,0 +1,69 @@
+import contextlib
+import io
+import json
+import os
+import random
+import string
+import time
+import unittest
+
+import decoders
+from bench_decoders import CORPUS
+
+# FUZZ_SEED=<n> reproduces a run; FUZZ_CASES=<n> runs more cases.
+SEED = int(os.environ.get("FUZZ_SEED", "1234"))
+CASES = int(os.environ.get("FUZZ_CASES", "3000"))
+# no single line should take anywhere near this long, in seconds:
+MAX_LINE_TIME = 0.02
+
+PREFIXES = sorted({s[:3] for s in CORPUS} | {s[:2] for s in CORPUS} | {"RGB", "SR", "LM", "VTA", "AUA"})
+ALPHABET = string.ascii_letters + string.digits + string.punctuation + " \t\x00\x7fé"
+
+def fuzz_lines(rng: random.Random, cases: int):
+    "Truncated corpus lines, then random payloads after known prefixes, then noise"
+    for s in CORPUS:
+        for i in range(len(s) + 1):
+            yield s[:i]
+    for _ in range(cases):
+        n = rng.choice((0, 1, 2, 5, 17, 40, 200, 2000))
+        payload = "".join(rng.choice(ALPHABET) for _ in range(n))
+        if rng.random() < 0.5:
+            payload = "".join(rng.choice(string.hexdigits) for _ in range(n))
+        yield rng.choice(PREFIXES) + payload
+        yield payload
+
+class TestFuzz(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.lines = list(fuzz_lines(random.Random(SEED), CASES))
+
+    def check(self, fn):
+        for s in self.lines:
+            start = time.perf_counter()
+            try:
+                fn(s)
+            except Exception as ex: # pylint: disable=broad-except
+                self.fail(f"{fn.__name__}({s!r}) raised {ex!r} (FUZZ_SEED={SEED})")
+            elapsed = time.perf_counter() - start
+            self.assertLess(elapsed, MAX_LINE_TIME, f"{fn.__name__}({s[:40]!r}...) took {elapsed:.4f}s")
+
+    def test_decoders(self):
+        for d in dict.fromkeys(decoders.DECODERS):
+            with self.subTest(decoder=d.__name__):
+                self.check(d)
+        self.check(decoders.vol_db_level)
+        self.check(decoders.db_level)
+
+    def test_decode_line(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            import telnet # pylint: disable=import-outside-toplevel
+            self.check(telnet.decode_line)
+
+    def test_ndjson(self):
+        import ndjson # pylint: disable=import-outside-toplevel
+        self.check(lambda s: json.loads(ndjson.encode(s, 0.0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
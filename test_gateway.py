@@ -0,0 +1,106 @@
+import asyncio
+import json
+import unittest
+
+import gateway
+import state
+
+class TestStatusCache(unittest.TestCase):
+
+    def test_answer(self):
+        c = state.StatusCache()
+        self.assertIsNone(c.update("FL022020204150504C45545620202020"))
+        self.assertEqual(c.update("VOL121", "volume is -20.0dB"), "VOL")
+        self.assertEqual(c.answer("?V"), "VOL121")
+        self.assertIsNone(c.answer("?P"))
+        self.assertEqual(c.snapshot()["VOL"]["text"], "volume is -20.0dB")
+
+
+class Writer:
+    """Collects what a handler writes back"""
+
+    def __init__(self):
+        self.data = b""
+
+    def write(self, b):
+        self.data += b
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TestGateway(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.sent = []
+        self.gw = gateway.Gateway(self.sent.append)
+        self.gw.loop = asyncio.get_running_loop()
+
+    def test_accept_key(self):
+        # example from RFC 6455
+        self.assertEqual(gateway.ws_accept_key("dGhlIHNhbXBsZSBub25jZQ=="),
+                         "s3pPLMBiTxaQ9kYGzzhZRbK+xOo=")
+
+    async def test_frames(self):
+        for n in (5, 300, 70000):
+            reader = asyncio.StreamReader()
+            reader.feed_data(gateway.ws_frame(b"x" * n))
+            (opcode, payload) = await gateway.ws_read_frame(reader)
+            self.assertEqual(opcode, 1)
+            self.assertEqual(len(payload), n)
+
+    async def test_dedupe(self):
+        self.assertEqual(await self.gw.submit("?V"), ["?V"])
+        self.assertEqual(self.gw.enqueue(["?V", "05FN"]), ["05FN"])
+        self.assertEqual(self.gw.enqueue(["05FN", "PO"]), ["PO"])
+        self.assertEqual(self.gw.commands.qsize(), 3)
+
+    async def test_steps_are_not_deduped(self):
+        self.assertEqual(await self.gw.submit("VU"), ["VU"])
+        self.assertEqual(self.gw.enqueue(["VU", "TPI"]), ["VU", "TPI"])
+        self.assertEqual(self.gw.enqueue(["TPI"]), ["TPI"])
+        self.assertEqual(self.gw.commands.qsize(), 4)
+
+    async def test_query_from_cache(self):
+        self.gw.dispatch("PWR0", "Power is ON")
+        self.assertEqual(await self.gw.query("?P"), "PWR0")
+        self.assertEqual(self.gw.commands.qsize(), 0)
+
+    async def test_query_miss_waits_for_answer(self):
+        task = asyncio.create_task(self.gw.query("?V"))
+        await asyncio.sleep(0)
+        self.assertEqual(self.gw.commands.qsize(), 1)
+        self.gw.dispatch("VOL121", None)
+        self.assertEqual(await task, "VOL121")
+
+    async def post(self, length, body=b""):
+        reader = asyncio.StreamReader()
+        reader.feed_data(f"POST /command HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode() + body)
+        reader.feed_eof()
+        writer = Writer()
+        await self.gw.handle(reader, writer)
+        return writer.data.split(b"\r\n")[0].decode()
+
+    async def test_post_length(self):
+        self.assertEqual(await self.post("abc"), "HTTP/1.1 400 Error")
+        self.assertEqual(await self.post(-1), "HTTP/1.1 400 Error")
+        self.assertEqual(await self.post(gateway.MAX_BODY + 1), "HTTP/1.1 413 Error")
+        self.assertEqual(await self.post(4, b"?V\r\n"), "HTTP/1.1 202 OK")
+
+    async def test_fanout(self):
+        q: asyncio.Queue = asyncio.Queue(2)
+        self.gw.clients.add(q)
+        for i in range(3):
+            self.gw.dispatch(f"VOL12{i}", None)
+        self.assertEqual(q.qsize(), 2)
+        reader = asyncio.StreamReader()
+        reader.feed_data(q.get_nowait())
+        (_, payload) = await gateway.ws_read_frame(reader)
+        self.assertEqual(json.loads(payload)["line"], "VOL121")
+
+
+if __name__ == '__main__':
+    unittest.main()
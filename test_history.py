@@ -0,0 +1,59 @@
+import unittest
+
+import history
+
+T0 = 1_700_000_000 - 1_700_000_000 % 3600 # on the hour
+
+class TestHistory(unittest.TestCase):
+
+    def test_ring(self):
+        r = history.Ring(3, 2)
+        for i in range(5):
+            r.append((float(i), i * 10.0))
+        self.assertEqual(r.rows_since(0), [(2.0, 20.0), (3.0, 30.0), (4.0, 40.0)])
+        self.assertEqual(r.rows_since(3.5), [(4.0, 40.0)])
+
+    def test_volume_rollups(self):
+        h = history.History()
+        for i in range(3 * 3600 // 10): # a point every 10 seconds for 3 hours
+            h.on_line(f"VOL{101 + i % 20:03}", t=T0 + i * 10)
+        m = h.metrics["volume"]
+        self.assertEqual(m.minutes.count, 3 * 60 - 1)
+        self.assertEqual(m.hours.count, 2)
+        now = T0 + 3 * 3600
+        minutes = m.buckets(600, now)
+        self.assertEqual(len(minutes), 11)
+        hours = m.buckets(86400, now)
+        self.assertEqual(len(hours), 3)
+        self.assertEqual([r[4] for r in hours], [360, 360, 360])
+        self.assertEqual(hours[0][1], -30.0)
+        self.assertEqual(hours[0][2], -20.5)
+
+    def test_idle_metric(self):
+        h = history.History()
+        h.on_line("VOL101", t=T0)
+        m = h.metrics["volume"]
+        self.assertEqual(len(m.buckets(1800, T0 + 60)), 1)
+        # the open minute is from long before the window:
+        self.assertEqual(m.buckets(1800, T0 + 7200), [])
+        self.assertEqual(len(m.buckets(86400, T0 + 7200)), 1)
+        self.assertEqual(m.buckets(86400, T0 + 3 * 86400), [])
+
+    def test_input_report(self):
+        h = history.History()
+        h.on_line("FN19", t=T0)
+        h.on_line("FN05", t=T0 + 10)
+        h.on_line("FN05", t=T0 + 70)
+        lines = h.report("input", 3600, label={"05": "TV", "19": "HDMI1"}.get, now=T0 + 80)
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].endswith("TV (1 changes)"))
+        self.assertTrue(lines[1].endswith("TV (0 changes)"))
+
+    def test_parse_window(self):
+        self.assertEqual(history.parse_window("2h"), 7200)
+        self.assertEqual(history.parse_window("15"), 900)
+        self.assertIsNone(history.parse_window("xh"))
+
+
+if __name__ == '__main__':
+    unittest.main()
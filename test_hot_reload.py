@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+
+from hot_reload import FileWatch
+
+class TestFileWatch(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp()
+        os.write(fd, b"{}")
+        os.close(fd)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_changes(self):
+        w = FileWatch(self.path, interval=0)
+        self.assertFalse(w.changed())
+        with open(self.path, "w", encoding="UTF-8") as f:
+            f.write('{"up": ["VU", "volume up"]}')
+        self.assertTrue(w.changed())
+        self.assertFalse(w.changed())
+        os.remove(self.path)
+        self.assertTrue(w.changed())
+
+    def test_interval(self):
+        w = FileWatch(self.path, interval=3600)
+        with open(self.path, "w", encoding="UTF-8") as f:
+            f.write("[]  ")
+        self.assertFalse(w.changed()) # not checked again yet
+
+    def test_moving_path(self):
+        found = [None]
+        w = FileWatch(lambda: found[0], interval=0)
+        self.assertFalse(w.changed())
+        found[0] = self.path
+        self.assertTrue(w.changed())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import journal
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, segment_size=journal.SEGMENT_SIZE):
+        w = journal.JournalWriter(self.folder, segment_size)
+        for i in range(1000):
+            w.append(f"VOL{i % 185:03}" if i % 3 else f"FN{i % 50:02}", t=1000 + i)
+            w.append("FL022020204150504C45545620202020", t=1000 + i)
+            w.append("XYZ unknown", t=1000 + i)
+        w.close()
+
+    def test_roundtrip(self):
+        self.write()
+        lines = list(journal.query(self.folder))
+        self.assertEqual(len(lines), 3000)
+        self.assertEqual(lines[0], (1000.0, "FN00"))
+        self.assertEqual(lines[2], (1000.0, "XYZ unknown"))
+
+    def test_range_query(self):
+        self.write(segment_size=4096)
+        self.assertGreater(len(journal.list_segments(self.folder)), 3)
+        found = list(journal.query(self.folder, 1500, 1502, ["VOL", "FN"]))
+        self.assertEqual(found, [(1500.0, "VOL130"), (1501.0, "FN01"), (1502.0, "VOL132")])
+
+    def test_prefixes(self):
+        self.write()
+        with self.assertRaises(ValueError):
+            list(journal.query(self.folder, prefixes=["VOLUME"]))
+        w = journal.JournalWriter(self.folder)
+        w.append("ZV041", t=3000)
+        w.close()
+        self.assertEqual(list(journal.query(self.folder, 2000, prefixes=["ZV"])), [(3000.0, "ZV041")])
+
+    def test_flushed_when_quiet(self):
+        w = journal.JournalWriter(self.folder)
+        saved = journal.FLUSH_INTERVAL
+        journal.FLUSH_INTERVAL = 0.01
+        try:
+            w.append("PWR0")
+            time.sleep(0.1)
+            self.assertEqual([l for (_, l) in journal.query(self.folder)], ["PWR0"])
+        finally:
+            journal.FLUSH_INTERVAL = saved
+            w.close()
+
+    def test_partial_record(self):
+        self.write()
+        (_, path) = journal.list_segments(self.folder)[-1]
+        with open(path, "ab") as f:
+            f.write(journal.RECORD.pack(5000 * 10**6, 2, 10) + b"12")
+        self.assertEqual(len(list(journal.query(self.folder, 1990))), 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import threading
+import unittest
+
+import list_cache
+from list_cache import ListCache
+
+def page_lines(start, end, total):
+    lines = [f"GDH{start:05}{end:05}{total:05}"]
+    for i in range(start, end + 1):
+        lines.append(f"GEH{i - start + 1:02}020Station {i}")
+    return lines
+
+class TestListCache(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.cache = ListCache(self.sent.append, capacity=3)
+        self.cache.feed("GHH00")
+        self.cache.feed("GCH01000000Stations")
+
+    def test_page_and_prefetch(self):
+        for line in page_lines(1, 8, 500):
+            self.assertFalse(self.cache.feed(line))
+        self.assertEqual(self.sent, ["00009GCI"])
+        # the prefetched page is not shown:
+        self.assertTrue(self.cache.feed("GCH01000000Stations"))
+        for line in page_lines(9, 16, 500):
+            self.assertTrue(self.cache.feed(line))
+        page = self.cache.lookup(9)
+        self.assertIsNotNone(page)
+        self.assertEqual(page.lines[1], "GEH01020Station 9")
+        self.assertEqual(self.sent[-1], "00017GCI")
+        # user is on page 9, AVR is on page 9 too:
+        self.assertEqual(self.cache.select_codes("3"), ["03GFI"])
+        self.assertIsNotNone(self.cache.lookup(5))
+        self.assertEqual(self.cache.select_codes("3"), ["00001GCI", "03GFI"])
+
+    def test_requested_page_is_shown(self):
+        for line in page_lines(1, 8, 500):
+            self.cache.feed(line)
+        self.assertEqual(self.cache.prefetch_start, 9)
+        self.cache.request(9) # "display 9" before the prefetch is answered
+        for line in page_lines(9, 16, 500):
+            self.assertFalse(self.cache.feed(line))
+        self.assertEqual(self.cache.view_start, 9)
+
+    def test_half_received_prefetch_is_dropped(self):
+        for line in page_lines(1, 8, 500):
+            self.cache.feed(line)
+        lines = page_lines(9, 16, 500)
+        for line in lines[:4]:
+            self.cache.feed(line)
+        self.cache.prefetch_time -= list_cache.PREFETCH_TIMEOUT + 1
+        for line in lines[4:]:
+            self.assertFalse(self.cache.feed(line))
+        self.assertIsNone(self.cache.lookup(9))
+
+    def test_lru(self):
+        self.cache.send_fn = None
+        for start in (1, 9, 17, 25):
+            for line in page_lines(start, start + 7, 500):
+                self.cache.feed(line)
+        self.assertIsNone(self.cache.lookup(1))
+        self.assertIsNotNone(self.cache.lookup(9))
+        self.cache.feed("GCH01000000Other list")
+        self.assertIsNone(self.cache.lookup(9))
+
+    def test_lookup_while_pages_arrive(self):
+        cache = ListCache(capacity=50)
+        cache.feed("GHH00")
+        cache.feed("GCH01000000Stations")
+        done = threading.Event()
+        def reader():
+            for start in range(1, 20000, 8):
+                for line in page_lines(start, start + 7, 20000):
+                    cache.feed(line)
+            done.set()
+        thread = threading.Thread(target=reader)
+        thread.start()
+        while not done.is_set():
+            cache.lookup(3) # not a page start: searches every page
+        thread.join()
+        self.assertIsNotNone(cache.lookup(19995))
+
+
+if __name__ == '__main__':
+    unittest.main()
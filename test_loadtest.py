@@ -0,0 +1,25 @@
+import contextlib
+import io
+import unittest
+
+import loadtest
+
+class TestLoadTest(unittest.TestCase):
+
+    def test_short_run(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            r = loadtest.run_load(sessions=2, rate=40, event_rate=200, duration=0.5, sample=0.2)
+        self.assertGreater(r["answered"], 0)
+        self.assertEqual(r["answered"], r["sent"])
+        self.assertEqual((r["dropped"], r["errors"], r["events_lost"]), (0, 0, 0))
+        self.assertLessEqual(r["latency_ms"]["p50"], r["latency_ms"]["p99"])
+        self.assertGreaterEqual(len(r["rss"]), 3)
+
+    def test_percentile(self):
+        self.assertEqual(loadtest.percentile([1, 2, 3, 4, 5], 0.5), 3)
+        self.assertEqual(loadtest.percentile([1, 2, 3, 4, 5], 1.0), 5)
+        self.assertIsNone(loadtest.percentile([], 0.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import contextlib
+import io
+import os
+import queue
+import tempfile
+import threading
+import time
+import unittest
+
+import events
+import mode_probe
+import outbound
+from fake_avr import Responder
+
+class PickyAVR:
+    """Accepts some modes; cyclic 0001 becomes 0009; answers in order"""
+
+    def __init__(self, probe, accepts):
+        self.probe = probe
+        self.accepts = accepts
+        self.mode = "0009"
+        self.writes = []
+
+    def send_batch(self, codes):
+        self.writes.append(codes)
+        for c in codes:
+            mode = c[:4]
+            if mode == "0001":
+                mode = "0009"
+            elif mode not in self.accepts:
+                self.probe.on_line("E02", None)
+                continue
+            self.mode = mode
+            self.probe.on_line("SR" + mode, None)
+
+
+class SlowAVR(PickyAVR):
+    """PickyAVR answering in order on its own thread, late for the slow codes"""
+
+    def __init__(self, probe, accepts, slow, delay):
+        super().__init__(probe, accepts)
+        self.slow = slow
+        self.delay = delay
+        self.codes = queue.Queue()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def send_batch(self, codes):
+        for c in codes:
+            self.codes.put(c)
+
+    def run(self):
+        while True:
+            c = self.codes.get()
+            if c[:4] in self.slow:
+                time.sleep(self.delay)
+            PickyAVR.send_batch(self, [c])
+
+
+class TestModeProbe(unittest.TestCase):
+
+    def test_sweep(self):
+        probe = mode_probe.ModeProbe(None, {"E02", "E04"}, window=2, timeout=0.1)
+        avr = PickyAVR(probe, {"0010", "0013"})
+        probe.send_batch = avr.send_batch
+        results = probe.sweep(["0010", "0099", "0013", "0001", "0151"], restore="0009")
+        self.assertEqual(results, {"0010": True, "0099": False, "0013": True, "0001": True, "0151": False})
+        self.assertEqual(max(len(w) for w in avr.writes), 2)
+        self.assertEqual(avr.writes[-1], ["0009SR"]) # back where it was
+        self.assertEqual(avr.mode, "0009")
+
+    def test_unanswered(self):
+        probe = mode_probe.ModeProbe(lambda codes: None, {"E04"}, timeout=0.01)
+        self.assertEqual(probe.sweep(["0010", "0013"]), {"0010": None, "0013": None})
+
+    def test_late_answer(self):
+        probe = mode_probe.ModeProbe(None, {"E02"}, window=1, timeout=0.1)
+        avr = SlowAVR(probe, {"0010", "0013"}, slow={"0099"}, delay=0.15)
+        probe.send_batch = avr.send_batch
+        results = probe.sweep(["0010", "0099", "0013", "0151"], restore="0009")
+        self.assertEqual(results, {"0010": True, "0099": None, "0013": True, "0151": False})
+
+    def test_unknown_mode(self):
+        # the AVR stays in 0009, which the probe did not know it was in:
+        probe = mode_probe.ModeProbe(lambda codes: probe.on_line("SR0009", None), {"E02"}, timeout=0.1)
+        self.assertEqual(probe.sweep(["0010"]), {"0010": False})
+
+    def test_signal_class(self):
+        self.assertEqual(mode_probe.signal_class("AST0401110000000000"), "2ch")
+        self.assertEqual(mode_probe.signal_class("AST0401111111110000"), "multi-ch")
+        self.assertEqual(mode_probe.signal_class(None), "unknown")
+
+    def test_support(self):
+        saved = mode_probe.mode_support_filename
+        with tempfile.TemporaryDirectory() as folder:
+            mode_probe.mode_support_filename = os.path.join(folder, "modes.json")
+            try:
+                support = mode_probe.ModeSupport("avr:23")
+                support.record("2ch", {"0010": True, "0099": False, "0013": None})
+                support.save()
+                again = mode_probe.ModeSupport("avr:23")
+                self.assertEqual(again.rejected("2ch"), {"0099"})
+                self.assertEqual(again.rejected("multi-ch"), set())
+                self.assertEqual(mode_probe.ModeSupport("other:23").rejected("2ch"), set())
+            finally:
+                mode_probe.mode_support_filename = saved
+
+
+class TestProbeThroughOutboundQueue(unittest.TestCase):
+
+    def test_probe_modes(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            import telnet # pylint: disable=import-outside-toplevel
+        from modes_set import modeSetMap # pylint: disable=import-outside-toplevel
+        saved = (mode_probe.mode_support_filename, mode_probe.ANSWER_TIMEOUT, telnet.MODE_SUPPORT)
+        connection = Responder(events.publish)
+        queue = outbound.OutboundQueue(connection)
+        out = io.StringIO()
+        with tempfile.TemporaryDirectory() as folder:
+            mode_probe.mode_support_filename = os.path.join(folder, "modes.json")
+            mode_probe.ANSWER_TIMEOUT = 0.2
+            telnet.MODE_SUPPORT = None
+            try:
+                with contextlib.redirect_stdout(out):
+                    telnet.probe_modes(queue)
+            finally:
+                (mode_probe.mode_support_filename, mode_probe.ANSWER_TIMEOUT, telnet.MODE_SUPPORT) = saved
+        self.assertIn(f"{len(modeSetMap)} of {len(modeSetMap)} modes work", out.getvalue())
+        self.assertEqual(queue.saved, 0)
+        self.assertEqual(sum(1 for c in connection.codes if c.endswith("SR")), len(modeSetMap) + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import io
+import json
+import unittest
+
+import ndjson
+
+class TestNdjson(unittest.TestCase):
+
+    def event(self, line, input_name=lambda i: None):
+        return json.loads(ndjson.encode(line, 1000.5, input_name))
+
+    def test_typed_fields(self):
+        self.assertEqual(self.event("VOL121"),
+                         {"t": 1000.5, "raw": "VOL121", "type": "volume", "level": 121, "db": -20.0})
+        self.assertEqual(self.event("PWR0")["on"], True)
+        self.assertEqual(self.event("MUT1")["on"], False)
+        self.assertEqual(self.event("TR04")["db"], 2)
+        self.assertEqual(self.event("E04"), {"t": 1000.5, "raw": "E04", "type": "error",
+                                             "code": "E04", "message": "COMMAND ERROR"})
+        self.assertEqual(self.event("FL022020204150504C45545620202020")["text"], "APPLETV")
+        audio = self.event("AST0502" + "1" * 8)
+        self.assertEqual(audio["signal"], "DOLBY DIGITAL")
+        self.assertEqual(audio["frequency"], "48kHz")
+        self.assertIsInstance(audio["input_channels"], list)
+        self.assertIn("input_resolution", self.event("VST1060000"))
+        self.assertEqual(self.event("XYZ")["type"], "unknown")
+
+    def test_zones_and_inputs(self):
+        names = {"05": "TV"}.get
+        self.assertEqual(self.event("FN05", names)["name"], "TV")
+        self.assertIsNone(self.event("FN05")["name"])
+        self.assertEqual(self.event("ZV61"), {"t": 1000.5, "raw": "ZV61", "type": "zone_volume",
+                                              "zone": "2", "db": -20.0})
+        self.assertEqual(self.event("Z2F05", names)["name"], "TV")
+
+    def test_bad_input(self):
+        for line in ("VOL", "VOLxyz", "TR", "AST", "VST", "FL0Z", "SR", "LM", "RGB", "IS"):
+            self.assertEqual(self.event(line)["raw"], line)
+
+    def test_batches(self):
+        out = io.StringIO()
+        w = ndjson.NdjsonWriter(out)
+        for i in range(ndjson.FLUSH_EVERY - 1):
+            w.write(f"VOL{i:03}", t=i)
+        self.assertEqual(out.getvalue(), "")
+        w.write("PWR0", t=99)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), ndjson.FLUSH_EVERY)
+        self.assertEqual(json.loads(lines[-1])["raw"], "PWR0")
+        w.write("PWR1", t=100)
+        w.flush()
+        self.assertEqual(json.loads(out.getvalue().splitlines()[-1])["on"], False)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import time
+import unittest
+
+import outbound
+
+class Connection:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, b):
+        self.writes.append(b.decode().split())
+
+
+class TestCompact(unittest.TestCase):
+
+    def test_steps(self):
+        self.assertEqual(outbound.compact(["VU"] * 5 + ["VD"], {"VOL": 120}), ["124VL"])
+        self.assertEqual(outbound.compact(["VU"] * 3, {}), ["VU"] * 3) # level unknown
+        self.assertEqual(outbound.compact(["TI", "TI", "TD"], {}), ["TI"])
+        self.assertEqual(outbound.compact(["ZU", "ZU", "ZD", "YD"], {"ZV": 80}), ["81ZV", "YD"])
+        self.assertEqual(outbound.compact(["VU", "VD"], {"VOL": 3}), [])
+        self.assertEqual(outbound.compact(["VD"] * 5, {"VOL": 2}), ["000VL"])
+
+    def test_latest_wins(self):
+        self.assertEqual(outbound.compact(["05FN", "19FN", "0010SR", "0013SR"], {}), ["19FN", "0013SR"])
+        levels = {}
+        self.assertEqual(outbound.compact(["VU", "150VL", "VU", "VU"], levels), ["152VL"])
+        self.assertEqual(levels, {"VOL": 152})
+
+    def test_barriers(self):
+        self.assertEqual(outbound.compact(["PO", "VU", "VU", "PF", "VU"], {"VOL": 100}),
+                         ["PO", "102VL", "PF", "VU"])
+        self.assertEqual(outbound.compact(["05FN", "?F", "19FN"], {}), ["05FN", "?F", "19FN"])
+
+
+class TestOutboundQueue(unittest.TestCase):
+
+    def test_burst(self):
+        tn = Connection()
+        q = outbound.OutboundQueue(tn, hold=0.05)
+        q.on_line("VOL120", None)
+        for _ in range(20):
+            q.write(b"VU\r\n")
+        self.assertEqual(tn.writes, [["VU"]]) # the first one goes out right away
+        time.sleep(0.15)
+        self.assertEqual(tn.writes, [["VU"], ["140VL"]])
+        self.assertEqual(q.saved, 18)
+        # the answer to the first step is older than what we just set:
+        q.on_line("VOL121", None)
+        self.assertEqual(q.levels["VOL"], 140)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+import state
+from poller import Poller
+
+FIELDS = [("power", "?P", 10, 80), ("volume", "?V", 5, 40)]
+
+class TestPoller(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = state.StatusCache()
+        self.writes = []
+        self.poller = Poller(self.cache, self.writes.append, FIELDS)
+
+    def answer(self, line, t):
+        self.cache.update(line)
+        self.cache.updated[state.response_prefix(line)] = t
+
+    def test_coalesced(self):
+        self.assertEqual(self.poller.poll_once(1000), ["?P", "?V"])
+        self.assertEqual(self.writes, [["?P", "?V"]])
+        self.assertEqual(self.poller.poll_once(1001), [])
+
+    def test_quiet_answers(self):
+        self.answer("VOL121", 900)
+        self.poller.poll_once(1000)
+        self.assertTrue(self.poller.quiet("VOL121", 1000.2)) # same as before
+        self.assertFalse(self.poller.quiet("VOL121", 1000.3)) # not asked again
+        self.assertFalse(self.poller.quiet("PWR0", 1000.2)) # first value: news
+        self.poller.poll_once(self.poller.fields[1].next_due)
+        self.assertFalse(self.poller.quiet("VOL125", self.poller.fields[1].next_due)) # changed
+        self.assertFalse(self.poller.quiet("MUT0", 1000.2))
+
+    def test_backoff(self):
+        self.poller.poll_once(1000)
+        self.answer("PWR0", 1000.1)
+        t = 1000
+        intervals = []
+        for _ in range(5):
+            t = self.poller.fields[0].next_due
+            self.poller.poll_once(t)
+            intervals.append(self.poller.fields[0].interval)
+        self.assertEqual(intervals, [10, 20, 40, 80, 80])
+        self.answer("PWR1", t + 0.1) # changed
+        self.poller.poll_once(self.poller.fields[0].next_due)
+        self.assertEqual(self.poller.fields[0].interval, 10)
+
+    def test_skip_after_unsolicited(self):
+        self.poller.poll_once(1000)
+        self.answer("VOL121", 1004)
+        self.assertEqual(self.poller.poll_once(1005), [])
+        self.assertEqual(self.poller.fields[1].next_due, 1009)
+        self.assertEqual(self.poller.poll_once(1009), ["?V"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+import presets
+from fake_avr import Responder
+
+class TestPresets(unittest.TestCase):
+
+    def test_sweep(self):
+        sweep = presets.PresetSweep(None, {"E04"}, timeout=0.1)
+        tuner = Responder(sweep.on_line)
+        sweep.send_batch = tuner.send_batch
+        tuner.avr.preset = "C03"
+        results = sweep.sweep(presets.ALL_PRESETS, restore="C03")
+        self.assertEqual(len(results), 63)
+        self.assertEqual(results["A01"], {"frequency": "FM 87.70MHz", "name": "STATION A1"})
+        self.assertEqual(results["G09"]["name"], "STATION G9")
+        self.assertLessEqual(max(len(w) for w in tuner.batches), 3 * presets.SWEEP_WINDOW)
+        self.assertEqual(tuner.avr.preset, "C03") # back where it was
+
+    def test_sweep_without_names(self):
+        sweep = presets.PresetSweep(None, {"E04"}, timeout=0.1)
+        tuner = Responder(sweep.on_line, replies={"?TQ": ["E04"]})
+        sweep.send_batch = tuner.send_batch
+        results = sweep.sweep(["A01", "A02", "B01"])
+        self.assertEqual(results["A02"], {"frequency": "FM 87.90MHz"})
+        self.assertEqual(results["B01"], {"frequency": "FM 89.50MHz"})
+
+    def test_unanswered(self):
+        sweep = presets.PresetSweep(lambda codes: None, {"E04"}, timeout=0.01)
+        self.assertEqual(sweep.sweep(["A01", "A02"]), {"A01": {}, "A02": {}})
+
+    def test_parsing(self):
+        self.assertEqual(presets.parse_preset("a1"), "A01")
+        self.assertIsNone(presets.parse_preset("H1"))
+        self.assertIsNone(presets.parse_preset("A10"))
+        self.assertEqual(presets.frequency("A00540"), "AM 540kHz")
+        self.assertEqual(presets.tq_name('TQB02"JAZZ FM "'), ("B02", "JAZZ FM"))
+        self.assertEqual(presets.decode("FRF08750"), "Tuner frequency FM 87.50MHz")
+
+    def test_catalog(self):
+        saved = presets.presets_filename
+        with tempfile.TemporaryDirectory() as folder:
+            presets.presets_filename = os.path.join(folder, "presets.json")
+            try:
+                catalog = presets.PresetCatalog("avr:23")
+                catalog.record({"A01": {"frequency": "FM 87.50MHz", "name": "JAZZ FM"},
+                                "A02": {"frequency": "FM 101.10MHz", "name": "NEWS"},
+                                "A03": {}, "B01": {"frequency": "AM 540kHz", "name": ""}})
+                catalog.save()
+                again = presets.PresetCatalog("avr:23")
+                self.assertEqual(list(again.presets()), ["A01", "A02", "B01"])
+                self.assertEqual(again.find("jazz fm"), "A01")
+                self.assertEqual(again.find("ne"), "A02")
+                self.assertEqual(again.find("b1"), "B01")
+                self.assertIsNone(again.find("rock"))
+                self.assertEqual(again.step("B01", 1), "A01")
+                self.assertEqual(again.step("A01", -1), "B01")
+                self.assertEqual(again.step(None, 1), "A01")
+                self.assertIsNone(presets.PresetCatalog("other:23").step("A01", 1))
+            finally:
+                presets.presets_filename = saved
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import shared_state
+
+class TestSharedState(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "state")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_roundtrip(self):
+        w = shared_state.StateWriter(self.path, {"05": "TV"}.get)
+        state = shared_state.read(self.path)
+        self.assertIsNone(state["power"])
+        self.assertIsNone(state["volume"])
+        for line in ("PWR0", "VOL121", "MUT1", "FN05", "SR0006", "XYZ"):
+            w.on_line(line, None)
+        state = shared_state.read(self.path)
+        self.assertEqual((state["power"], state["mute"], state["volume"], state["volume_db"]),
+                         (True, False, 121, -20.0))
+        self.assertEqual((state["input"], state["input_name"]), ("05", "TV"))
+        self.assertEqual(state["mode"], "0006")
+        self.assertTrue(state["connected"])
+        w.close()
+        self.assertFalse(shared_state.read(self.path)["connected"])
+
+    def test_learned_name(self):
+        names = {"05": "TV"}
+        w = shared_state.StateWriter(self.path, names.get)
+        w.on_line("FN05", None)
+        names["05"] = "MY TV" # learned within a burst, published after the RGB line
+        w.inputs_learned({"04": "DVD", "05": "MY TV"})
+        self.assertEqual(shared_state.read(self.path)["input_name"], "MY TV")
+        w.close()
+
+    def test_path_per_receiver(self):
+        a = shared_state.default_path("192.168.1.20:23")
+        self.assertEqual(a, shared_state.default_path("192.168.1.20"))
+        self.assertNotEqual(a, shared_state.default_path("192.168.1.21:23"))
+        self.assertNotEqual(a, shared_state.default_path("192.168.1.20:8102"))
+        self.assertEqual(os.path.dirname(a), shared_state.STATE_FOLDER)
+
+    def test_torn_reads_are_retried(self):
+        w = shared_state.StateWriter(self.path)
+        r = shared_state.StateReader(self.path)
+        stop = threading.Event()
+
+        def write():
+            i = 0
+            while not stop.is_set():
+                w.on_line(f"VOL{i % 100:03d}", None)
+                w.on_line(f"FN{i % 100:02d}", None)
+                i += 1
+
+        t = threading.Thread(target=write)
+        t.start()
+        try:
+            for _ in range(2000):
+                state = r.read()
+                if state is not None and state["volume"] is not None and state["input"] is not None:
+                    # the volume is set first, so the input is the same number or one behind:
+                    self.assertIn(int(state["input"]) - state["volume"], (0, -1, 99))
+        finally:
+            stop.set()
+            t.join()
+            r.close()
+
+    def test_unfinished_write(self):
+        w = shared_state.StateWriter(self.path)
+        w.map[shared_state.SEQUENCE_OFFSET] += 1 # as if the writer died mid-update
+        self.assertIsNone(shared_state.read(self.path))
+
+if __name__ == '__main__':
+    unittest.main()
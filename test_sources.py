@@ -1,3 +1,5 @@
+import contextlib
+import io
 import unittest
 
 from sources import SourceMap
@@ -17,6 +19,42 @@ class TestSources(unittest.TestCase):
         self.assertEqual(s.inverse_map["television"], val)
         self.assertEqual(s.inverse_map["tele"], val)
 
+    def test_learn_burst(self):
+        s = SourceMap()
+        published = []
+        s.on_learned = published.append
+        before = s.snapshot
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(60):
+                s.learn_input_from(f"{i:02d}1NAME {i}")
+            self.assertEqual(s.source_map["00"], "NAME 0") # the first one at once
+            self.assertEqual(s.source_map["05"], "TV") # the rest of the burst not yet
+            s.flush()
+        self.assertEqual([len(p) for p in published], [1, 59])
+        self.assertEqual(s.source_map["05"], "NAME 5")
+        self.assertEqual(s.inverse_map["name 5"], "05FN")
+        self.assertEqual(s.inverse_map["tv"], "05FN") # old names still work
+        self.assertEqual(before.source_map["05"], "TV") # old snapshots do not change
+        after = s.snapshot
+        s.learn_input_from("051NAME 5")
+        s.flush()
+        self.assertIs(s.snapshot, after)
+
+    def test_reload_keeps_learned(self):
+        s = SourceMap()
+        with contextlib.redirect_stdout(io.StringIO()):
+            s.learn_input_from("051MY TV")
+            s.learn_input_from("061MY SAT") # pending, in the same burst
+        reloaded = SourceMap()
+        reloaded.keep_learned(s)
+        self.assertEqual(reloaded.source_map["05"], "MY TV")
+        self.assertEqual(reloaded.unsaved, {"05": "MY TV", "06": "MY SAT"})
+        # learned by the old map before the global is swapped:
+        with contextlib.redirect_stdout(io.StringIO()):
+            s.learn_input_from("101MY BD")
+        reloaded.flush()
+        self.assertEqual(reloaded.source_map["10"], "MY BD")
+        self.assertNotIn("10", s.pending)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import startup
+
+class SleepyAVR:
+    """Ignores everything until it has been sent `wakes` power queries"""
+
+    def __init__(self, wakes: int):
+        self.wakes = wakes
+        self.written: list[bytes] = []
+        self.listener = None
+
+    def write(self, b: bytes) -> None:
+        self.written.append(b)
+        if b == b"?P\r\n":
+            self.wakes -= 1
+            if self.wakes == 0:
+                self.listener("PWR0", None)
+
+
+class TestStartup(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.saved_filename = startup.startup_times_filename
+        startup.startup_times_filename = os.path.join(self.folder.name, "startup.json")
+
+    def tearDown(self):
+        startup.startup_times_filename = self.saved_filename
+        self.folder.cleanup()
+
+    def test_queued_until_ready(self):
+        avr = SleepyAVR(3)
+        s = startup.Startup(avr, "avr:23")
+        avr.listener = s.on_line
+        s.write(b"VU\r\n")
+        s.write(b"VU\r\n")
+        self.assertEqual(avr.written, [])
+        self.assertIsNotNone(s.wake())
+        self.assertEqual(s.attempts, 3)
+        # the queued commands go out in one write, right after the answer:
+        self.assertEqual(avr.written, [b"?P\r\n"] * 3 + [b"VU\r\nVU\r\n"])
+        s.write(b"VD\r\n")
+        self.assertEqual(avr.written[-1], b"VD\r\n")
+        self.assertEqual(len(startup.load_times()["avr:23"]), 1)
+
+    def test_gives_up(self):
+        avr = SleepyAVR(-1)
+        s = startup.Startup(avr, "avr:23", timeout=0.2)
+        s.write(b"PO\r\n")
+        self.assertIsNone(s.wake())
+        self.assertFalse(s.wait(0))
+        self.assertEqual(avr.written[-1], b"PO\r\n")
+        self.assertEqual(startup.load_times(), {})
+
+
+class TestLazyImports(unittest.TestCase):
+
+    def test_tables_not_loaded_at_import(self):
+        lazy = ("modes_set", "modes_display", "discovery", "gateway", "batch", "poller", "journal", "ndjson",
+                "shared_state", "readline", "mode_probe", "outbound", "presets", "crawler")
+        out = subprocess.run([sys.executable, "-W", "ignore", "-c",
+                              f"import sys, telnet; print([m for m in {lazy!r} if m in sys.modules])"],
+                             capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(out.stdout.strip(), "[]")
+
+
+if __name__ == '__main__':
+    unittest.main()
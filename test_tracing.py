@@ -0,0 +1,42 @@
+import json
+import os
+import tempfile
+import unittest
+
+import tracing
+
+class TestTracing(unittest.TestCase):
+
+    def tearDown(self):
+        tracing.stop()
+
+    def test_round_trip(self):
+        tracing.start()
+        tracing.sent("?V")
+        tracing.sent("VU")
+        tracing.received("VOL121")
+        t0 = tracing.begin()
+        tracing.end("decode", "decode", t0, line="VOL121")
+        tracing.received("VOL122")
+        tracing.received("PWR0") # nobody asked
+        events = tracing.TRACER.to_json()["traceEvents"]
+        trips = [e["name"] for e in events if e.get("cat") == "round trip"]
+        self.assertEqual(trips, ["?V -> VOL121", "VU -> VOL122"])
+        flows = sorted((e["id"], e["ph"]) for e in events if e.get("cat") == "flow")
+        self.assertEqual(flows, [(1, "f"), (1, "s"), (2, "f"), (2, "s")])
+        self.assertTrue(all(e["dur"] >= 0 for e in events if e["ph"] == "X"))
+        self.assertIn({"name": "round trips"}, [e["args"] for e in events if e["ph"] == "M"])
+
+    def test_save(self):
+        tracing.start()
+        tracing.sent("?P")
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, "trace.json")
+            tracing.save(filename)
+            with open(filename, encoding='UTF-8') as f:
+                self.assertIn("traceEvents", json.load(f))
+        self.assertFalse(tracing.ENABLED)
+
+
+if __name__ == '__main__':
+    unittest.main()
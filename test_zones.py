@@ -0,0 +1,45 @@
+import unittest
+
+import state
+import zones
+
+class TestZones(unittest.TestCase):
+
+    def test_codes(self):
+        self.assertEqual(zones.zone_codes("2,3", "on", []), ["APO", "BPO"])
+        self.assertEqual(zones.zone_codes("all", "off", []), ["PF", "APF", "BPF", "ZEF"])
+        self.assertEqual(zones.zone_codes("main,hd", "volume", ["-30"]), ["101VL", "51HZV"])
+        self.assertEqual(zones.zone_codes("2", "volume", ["10"]), ["81ZV"]) # zones top out at 0dB
+        self.assertEqual(zones.zone_codes("z2", "input", ["dvd"], lambda n: "04"), ["04ZS"])
+        self.assertEqual(zones.zone_codes("3", "status", []), ["?BP", "?YV", "?Z3M", "?ZT"])
+        for (selection, action, args) in (("4", "on", []), ("2", "dance", []),
+                                          ("2", "volume", []), ("2", "input", ["nowhere"])):
+            with self.assertRaises(ValueError):
+                zones.zone_codes(selection, action, args)
+
+    def test_state(self):
+        s = zones.ZoneStates()
+        for line in ("APR0", "ZV51", "Z2MUT1", "Z2F04", "XV81", "VOL121", "ZEP1"):
+            s.on_line(line, None)
+        self.assertEqual(s.describe(lambda i: {"04": "DVD"}[i])[1],
+                         "Zone 2: power on, volume -30.0dB, mute off, input DVD")
+        self.assertEqual(s.zones["main"].volume, -20.0)
+        self.assertEqual((s.zones["hd"].power, s.zones["hd"].volume), (False, 0.0))
+        self.assertIsNone(s.zones["3"].power)
+
+    def test_decode(self):
+        self.assertEqual(zones.decode("BPR0"), "Zone 3 power is ON")
+        self.assertEqual(zones.decode("HZMUT0"), "HDZone mute is on")
+        self.assertEqual(zones.decode("ZEA25", lambda i: "BD"), "HDZone input is BD")
+        self.assertIsNone(zones.decode("PWR0")) # the main zone is decoded as before
+        self.assertIsNone(zones.decode("ZVX"))
+
+    def test_responses_known(self):
+        # every zone code has the answer the batch mode waits for:
+        for z in zones.ZONES.values():
+            for code in z.queries() + [z.power[0], z.volume[0], z.mute[1], "05" + z.input[0]]:
+                self.assertIsNotNone(state.expected_response(code), code)
+
+
+if __name__ == '__main__':
+    unittest.main()
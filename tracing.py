@@ -0,0 +1,136 @@
+
+"""
+Optional tracing of where the time goes between typing a command and seeing
+its answer (telnet.py --trace FILE).
+
+Records user commands, sends, received lines, decoding and printing, and pairs
+each sent code with the line that answers it (by response prefix, see state.py).
+The trace is written in Chrome trace-event JSON, which chrome://tracing and
+https://ui.perfetto.dev show as a timeline: one track per thread, plus a
+"round trips" track with a span from each code to its answer, linked by arrows.
+
+When tracing is off, each traced place costs one check of ENABLED.
+"""
+
+from typing import Any, Optional
+import json
+import os
+import threading
+import time
+
+import state
+
+ENABLED = False
+# events kept at most (later ones are counted, not kept):
+MAX_EVENTS = 500_000
+
+PID = os.getpid()
+# the pseudo-thread showing command to answer spans:
+ROUND_TRIP_TID = 0
+
+
+class Tracer:
+    """Collects trace events; timestamps are in microseconds since the tracer started"""
+
+    def __init__(self):
+        self.start_ns = time.perf_counter_ns()
+        self.events: list[dict[str, Any]] = []
+        self.threads: dict[int, str] = {}
+        self.pending: dict[str, list[tuple[float, str, int]]] = {}
+        self.next_flow = 1
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def now(self) -> float:
+        return (time.perf_counter_ns() - self.start_ns) / 1000
+
+    def add(self, event: dict[str, Any], tid: Optional[int] = None) -> None:
+        if len(self.events) >= MAX_EVENTS:
+            self.dropped += 1
+            return
+        if tid is None:
+            tid = threading.get_ident()
+            if tid not in self.threads:
+                self.threads[tid] = threading.current_thread().name
+        event["pid"] = PID
+        event["tid"] = tid
+        self.events.append(event)
+
+    def complete(self, name: str, cat: str, ts: float, args: dict[str, Any]) -> None:
+        "A span from ts to now on the current thread"
+        self.add({"name": name, "cat": cat, "ph": "X", "ts": ts, "dur": self.now() - ts, "args": args})
+
+    def sent(self, code: str) -> None:
+        "A code written to the AVR; its answer, if it has a known one, is awaited"
+        ts = self.now()
+        self.add({"name": f"send {code}", "cat": "send", "ph": "i", "s": "t", "ts": ts})
+        if (key := state.expected_response(code)) is None:
+            return
+        with self.lock:
+            flow = self.next_flow
+            self.next_flow += 1
+            self.pending.setdefault(key, []).append((ts, code, flow))
+        self.add({"name": "answer", "cat": "flow", "ph": "s", "id": flow, "ts": ts})
+
+    def received(self, line: str) -> None:
+        "A line read from the AVR; closes the round trip of the oldest code it answers"
+        ts = self.now()
+        self.add({"name": f"line {line}", "cat": "receive", "ph": "i", "s": "t", "ts": ts})
+        key = state.response_prefix(line)
+        if key is None:
+            return
+        with self.lock:
+            waiting = self.pending.get(key)
+            if not waiting:
+                return
+            (sent_ts, code, flow) = waiting.pop(0)
+        self.add({"name": "answer", "cat": "flow", "ph": "f", "bp": "e", "id": flow, "ts": ts})
+        self.add({"name": f"{code} -> {line}", "cat": "round trip", "ph": "X",
+                  "ts": sent_ts, "dur": ts - sent_ts}, ROUND_TRIP_TID)
+
+    def to_json(self) -> dict[str, Any]:
+        "The trace, in Chrome trace-event format"
+        names = [(ROUND_TRIP_TID, "round trips")] + list(self.threads.items())
+        metadata = [{"name": "thread_name", "ph": "M", "pid": PID, "tid": tid, "args": {"name": n}}
+                    for (tid, n) in names]
+        return {"traceEvents": metadata + list(self.events), "displayTimeUnit": "ms",
+                "otherData": {"dropped_events": self.dropped}}
+
+    def save(self, filename: str) -> None:
+        with open(filename, "w", encoding='UTF-8') as f:
+            json.dump(self.to_json(), f)
+
+
+TRACER = Tracer()
+
+def start() -> None:
+    "Starts tracing with a fresh tracer"
+    global TRACER, ENABLED
+    TRACER = Tracer()
+    ENABLED = True
+
+def stop() -> None:
+    global ENABLED
+    ENABLED = False
+
+def save(filename: str) -> None:
+    "Stops tracing and writes the trace"
+    stop()
+    TRACER.save(filename)
+    print(f"Wrote trace to {filename} ({len(TRACER.events)} events)")
+
+# call these only when ENABLED:
+
+def begin() -> float:
+    "Start time for a span, to give to end()"
+    return TRACER.now()
+
+def end(name: str, cat: str, ts: float, **args) -> None:
+    "Records a span started at ts"
+    TRACER.complete(name, cat, ts, args)
+
+def sent(code: str) -> None:
+    TRACER.sent(code)
+
+def received(line: str) -> None:
+    TRACER.received(line)
@@ -0,0 +1,191 @@
+
+"""
+Zones: the main zone, Zone 2, Zone 3 and HDZone each have their own power,
+volume, mute and input, with their own codes (APO/?AP/APR for Zone 2 power,
+?ZV/ZV for its volume, ...).
+
+ZoneStates follows the state of every zone from the lines the AVR sends, and
+zone_codes turns a command for one or several zones into the codes to send,
+which are written at once.
+
+    zone 2 on                zone 2,3 volume -30      zone all off
+    zone hd input dvd        zone main,2 mute         zone status
+"""
+
+from typing import Callable, Optional
+
+
+class Zone:
+    """The codes of one zone.
+    power, mute: (on, off, query, response prefix);
+    volume: (up, down, set suffix, query, response prefix, digits, 0dB value, steps per dB, maximum);
+    input: (set suffix, query, response prefix)"""
+
+    def __init__(self, name: str, label: str, power: tuple[str, str, str, str],
+                 volume: tuple[str, str, str, str, str, int, int, int, int],
+                 mute: tuple[str, str, str, str], input_codes: tuple[str, str, str]):
+        self.name = name
+        self.label = label
+        self.power = power
+        self.volume = volume
+        self.mute = mute
+        self.input = input_codes
+
+    def queries(self) -> list[str]:
+        "The status queries for this zone"
+        return [self.power[2], self.volume[3], self.mute[2], self.input[1]]
+
+    def volume_db(self, value: str) -> Optional[float]:
+        "dB for a volume response value, None if not a number"
+        if not value.isdecimal():
+            return None
+        (zero, steps) = self.volume[6:8]
+        return (int(value) - zero) / steps
+
+    def volume_code(self, db: float) -> str:
+        "The code setting the volume to db (clamped to the zone's range)"
+        (digits, zero, steps, maximum) = self.volume[5:9]
+        value = max(0, min(round(zero + db * steps), maximum))
+        return f"{value:0{digits}d}{self.volume[2]}"
+
+
+ZONES = {
+    "main": Zone("main", "Main zone", ("PO", "PF", "?P", "PWR"),
+                 ("VU", "VD", "VL", "?V", "VOL", 3, 161, 2, 185),
+                 ("MO", "MF", "?M", "MUT"), ("FN", "?F", "FN")),
+    "2": Zone("2", "Zone 2", ("APO", "APF", "?AP", "APR"),
+              ("ZU", "ZD", "ZV", "?ZV", "ZV", 2, 81, 1, 81),
+              ("Z2MO", "Z2MF", "?Z2M", "Z2MUT"), ("ZS", "?ZS", "Z2F")),
+    "3": Zone("3", "Zone 3", ("BPO", "BPF", "?BP", "BPR"),
+              ("YU", "YD", "YV", "?YV", "YV", 2, 81, 1, 81),
+              ("Z3MO", "Z3MF", "?Z3M", "Z3MUT"), ("ZT", "?ZT", "Z3F")),
+    "hd": Zone("hd", "HDZone", ("ZEO", "ZEF", "?ZEP", "ZEP"),
+               ("HZU", "HZD", "HZV", "?HZV", "XV", 2, 81, 1, 81),
+               ("HZMO", "HZMF", "?HZM", "HZMUT"), ("ZEA", "?ZEA", "ZEA")),
+}
+
+ZONE_ALIASES = {"1": "main", "zone2": "2", "zone3": "3", "hdzone": "hd", "z2": "2", "z3": "3"}
+
+# response prefix -> (zone, field), longest prefixes first:
+RESPONSES = sorted(((p, (z, f)) for z in ZONES.values()
+                    for (f, p) in (("power", z.power[3]), ("volume", z.volume[4]),
+                                   ("mute", z.mute[3]), ("input", z.input[2]))),
+                   key=lambda item: -len(item[0]))
+
+def parse_line(line: str) -> Optional[tuple[Zone, str, str]]:
+    "(zone, field, value) for a zone status line, None for other lines"
+    for (prefix, (zone, field)) in RESPONSES:
+        if line.startswith(prefix):
+            value = line[len(prefix):]
+            if value.isdecimal():
+                return (zone, field, value)
+    return None
+
+
+class ZoneState:
+    """What is known of one zone"""
+
+    def __init__(self, zone: Zone):
+        self.zone = zone
+        self.power: Optional[bool] = None
+        self.volume: Optional[float] = None
+        self.mute: Optional[bool] = None
+        self.input: Optional[str] = None
+
+    def update(self, field: str, value: str) -> None:
+        if field == "power":
+            self.power = value == "0" # PWR0, APR0, ... mean on
+        elif field == "mute":
+            self.mute = value == "0"
+        elif field == "volume":
+            self.volume = self.zone.volume_db(value)
+        elif field == "input":
+            self.input = value
+
+    def describe(self, input_name: Callable[[str], str] = lambda i: i) -> str:
+        def onoff(b: Optional[bool]) -> str:
+            return "?" if b is None else ("on" if b else "off")
+        volume = "?" if self.volume is None else f"{self.volume}dB"
+        source = "?" if self.input is None else input_name(self.input)
+        return (f"{self.zone.label}: power {onoff(self.power)}, volume {volume}, "
+                f"mute {onoff(self.mute)}, input {source}")
+
+
+class ZoneStates:
+    """State of every zone, kept up to date as an events listener"""
+
+    def __init__(self):
+        self.zones = {name: ZoneState(z) for (name, z) in ZONES.items()}
+
+    def on_line(self, line: str, _message: Optional[str]) -> None:
+        if parsed := parse_line(line):
+            (zone, field, value) = parsed
+            self.zones[zone.name].update(field, value)
+
+    def describe(self, input_name: Callable[[str], str] = lambda i: i) -> list[str]:
+        return [z.describe(input_name) for z in self.zones.values()]
+
+
+def decode(line: str, input_name: Callable[[str], str] = lambda i: i) -> Optional[str]:
+    "Message for a status line of Zone 2, Zone 3 or HDZone (the main zone is decoded elsewhere)"
+    parsed = parse_line(line)
+    if parsed is None or parsed[0].name == "main":
+        return None
+    (zone, field, value) = parsed
+    if field == "power":
+        return f"{zone.label} power is {'ON' if value == '0' else 'OFF'}"
+    if field == "mute":
+        return f"{zone.label} mute is {'on' if value == '0' else 'off'}"
+    if field == "volume":
+        return f"{zone.label} volume is {zone.volume_db(value)}dB"
+    return f"{zone.label} input is {input_name(value)}"
+
+def parse_zones(selection: str) -> list[Zone]:
+    "Zones for a selection like 2, 2,3, main,hd or all; ValueError if unknown"
+    if selection == "all":
+        return list(ZONES.values())
+    zones = []
+    for name in selection.split(","):
+        name = ZONE_ALIASES.get(name, name)
+        if name not in ZONES:
+            raise ValueError(f"unknown zone {name}, use main, 2, 3, hd or all")
+        if ZONES[name] not in zones:
+            zones.append(ZONES[name])
+    return zones
+
+def zone_codes(selection: str, action: str, args: list[str],
+               input_id: Callable[[str], Optional[str]] = lambda n: None) -> list[str]:
+    """Codes for an action (on, off, up, down, mute, unmute, volume DB, input NAME, status)
+    on the selected zones; input_id gives the two-digit id of an input name.
+    Raises ValueError for a command that cannot be sent."""
+    zones = parse_zones(selection)
+    codes: list[str] = []
+    for z in zones:
+        if action == "on":
+            codes.append(z.power[0])
+        elif action == "off":
+            codes.append(z.power[1])
+        elif action == "up":
+            codes.append(z.volume[0])
+        elif action == "down":
+            codes.append(z.volume[1])
+        elif action == "mute":
+            codes.append(z.mute[0])
+        elif action == "unmute":
+            codes.append(z.mute[1])
+        elif action == "status":
+            codes += z.queries()
+        elif action == "volume":
+            try:
+                db = float(args[0])
+            except (IndexError, ValueError):
+                raise ValueError("zone volume needs a level in dB, e.g. -30") from None
+            codes.append(z.volume_code(db))
+        elif action == "input":
+            name = " ".join(args).lower()
+            if (i := input_id(name)) is None:
+                raise ValueError(f"unknown input {name}")
+            codes.append(i + z.input[0])
+        else:
+            raise ValueError(f"unknown zone action {action}")
+    return codes